@@ -1,7 +1,7 @@
 import torch
 
 from client.TestClient import TestClient
-from client.mixin.ClientHandler import UpdateReceiver
+from client.mixin.ClientHandler import UpdateReceiver, get_weights_from_downlink
 from core.handlers.Handler import Handler
 
 
@@ -18,7 +18,8 @@ class PersonalUpdateReceiver(Handler):
 
     def _handle(self, request):
         client = request.get('client')
-        weights_buffer = client.message_queue.get_from_downlink(client.client_id, 'weights')
+        # a shallow copy, the blend below must not write into a shared snapshot
+        weights_buffer = dict(get_weights_from_downlink(client))
         if self.is_init:
             for key, var in client.model.state_dict().items():
                 if client.training_params[key]:
@@ -4,6 +4,9 @@ from client.mixin.InitHandler import InitHandler
 from core.handlers.Handler import HandlerChain
 from core.handlers.ModelTrainHandler import ClientTrainHandler, ClientPostTrainHandler
 from client.mixin.DataStore import DataStore
+from collections import defaultdict
+from utils import Time
+from utils.ParamVector import ParamVector
 import torch
 
 
@@ -63,9 +66,25 @@ class NormalClient(Client):
 
     def local_run(self):
         self.message_queue.set_training_status(self.client_id, True)
+        self.restore_optimizer_state()
         self.execute_chain()
+        self.park_optimizer_state()
         self.message_queue.set_training_status(self.client_id, False)
 
+    def park_optimizer_state(self):
+        # 两轮之间优化器状态(如momentum)存放在data_proxy中, SpillingDataStore可以将其换出
+        optimizer = self.optimizer
+        if optimizer is not None and len(optimizer.state) > 0:
+            self.data_proxy.set(self.client_id, 'optimizer_param_state', optimizer.state)
+            optimizer.state = defaultdict(dict)
+
+    def restore_optimizer_state(self):
+        optimizer = self.optimizer
+        state = self.data_proxy.get(self.client_id, 'optimizer_param_state')
+        if optimizer is not None and state is not None:
+            optimizer.state = state
+            self.data_proxy.set(self.client_id, 'optimizer_param_state', None)
+
     def execute_chain(self):
         request = {"global_var": self.global_var, "client": self, 'epoch': self.time_stamp}
         self.handler_chain.handle(request)
@@ -92,6 +111,8 @@ class NormalClient(Client):
     def upload(self, **kwargs):
         self.update_dict["client_id"] = self.client_id
         self.update_dict["time_stamp"] = self.time_stamp
+        # the server splits the turnaround of the client into training and upload with it
+        self.update_dict["upload_time"] = Time.now()
 
         for k, v in kwargs.items():
             self.upload_item(k, v)
@@ -136,6 +157,10 @@ class NormalClient(Client):
                     corrupted[key] = self.update_dict["weights"][key] * 100
                 self.update_dict["weights"] = corrupted
 
+        # upload the weights as one packed vector
+        if self.global_var['config']['global'].get('param_vector', False) and "weights" in self.update_dict:
+            self.update_dict["weights"] = ParamVector.of(self.update_dict["weights"])
+
         self.customize_upload()
         self.message_queue.put_into_uplink(self.update_dict)
         print("Client", self.client_id, "uploaded")
@@ -152,7 +177,9 @@ class NormalClient(Client):
                 setattr(self, k, v)
 
         self.message_queue.set_training_status(self.client_id, True)
+        self.restore_optimizer_state()
         self.execute_chain()
+        self.park_optimizer_state()
         self.message_queue.set_training_status(self.client_id, False)
 
         return self
@@ -6,8 +6,8 @@ from client.TestClient import TestClient
 
 
 class PFedMeClientRaw(TestClient):
-    def __init__(self, c_id, stop_event, selected_event, delay, index_list, config, dev):
-        super().__init__(c_id, stop_event, selected_event, delay, index_list, config, dev)
+    def __init__(self, c_id, stop_event, selected_event, delay, index_list, config, dev, data_proxy=None):
+        super().__init__(c_id, stop_event, selected_event, delay, index_list, config, dev, data_proxy)
         self.K = config.get('K', 30)
         self.lamda = config["optimizer"]["params"].get('lamda', 0.1)
         self.learning_rate = config["optimizer"]["params"].get('lr', 0.01)
@@ -58,8 +58,8 @@ class SelfStreamClient(NormalClient):
 
 
 class StreamClient(NormalClient):
-    def __init__(self, c_id, stop_event, selected_event, delay, index_list, config, dev):
-        super().__init__(c_id, stop_event, selected_event, delay, index_list, config, dev)
+    def __init__(self, c_id, stop_event, selected_event, delay, index_list, config, dev, data_proxy=None):
+        super().__init__(c_id, stop_event, selected_event, delay, index_list, config, dev, data_proxy)
         self.task_id = -1
         self.task_num = config.get("task_num", 1)
 
@@ -77,8 +77,8 @@ class StreamClientWithGlobal(StreamClient):
     scenario. This class's data is controlled by the server, and the model is trained on each task in turn.
     """
 
-    def __init__(self, c_id, stop_event, selected_event, delay, index_list, config, dev):
-        super().__init__(c_id, stop_event, selected_event, delay, index_list, config, dev)
+    def __init__(self, c_id, stop_event, selected_event, delay, index_list, config, dev, data_proxy=None):
+        super().__init__(c_id, stop_event, selected_event, delay, index_list, config, dev, data_proxy)
         self.task_num = len(index_list)
 
     def change_task(self):
@@ -147,8 +147,8 @@ class ContinualClient(StreamClientWithGlobal):
     scenario. In this scenario, client trains on different independent datasets in sequence.
     """
 
-    def __init__(self, c_id, stop_event, selected_event, delay, index_list, config, dev):
-        super().__init__(c_id, stop_event, selected_event, delay, index_list, config, dev)
+    def __init__(self, c_id, stop_event, selected_event, delay, index_list, config, dev, data_proxy=None):
+        super().__init__(c_id, stop_event, selected_event, delay, index_list, config, dev, data_proxy)
         self.label_mapping = None
 
     def create_handler_chain(self):
@@ -209,12 +209,37 @@ class ContinualClientWithEWC(ContinualClient):
     ContinualClientWithEWC is a class that inherits from ContinualClient and is used to implement the EWC loss.
     """
 
-    def __init__(self, c_id, stop_event, selected_event, delay, index_list, config, dev):
-        super().__init__(c_id, stop_event, selected_event, delay, index_list, config, dev)
+    def __init__(self, c_id, stop_event, selected_event, delay, index_list, config, dev, data_proxy=None):
+        super().__init__(c_id, stop_event, selected_event, delay, index_list, config, dev, data_proxy)
         self.previous_model = None
         self.fisher = None
         self.ewc_lambda = 2000
 
+    # the fisher matrix and the previous model are kept in the data_proxy, e.g. SpillingDataStore spills them
+    @property
+    def fisher(self):
+        return self.data_proxy.get(self.client_id, 'fisher')
+
+    @fisher.setter
+    def fisher(self, value):
+        self.data_proxy.set(self.client_id, 'fisher', value)
+
+    @fisher.deleter
+    def fisher(self):
+        self.data_proxy.set(self.client_id, 'fisher', None)
+
+    @property
+    def previous_model(self):
+        return self.data_proxy.get(self.client_id, 'previous_model')
+
+    @previous_model.setter
+    def previous_model(self, value):
+        self.data_proxy.set(self.client_id, 'previous_model', value)
+
+    @previous_model.deleter
+    def previous_model(self):
+        self.data_proxy.set(self.client_id, 'previous_model', None)
+
     def create_handler_chain(self):
         super().create_handler_chain()
         self.handler_chain.add_handler_after(FisherHandler(), UpdateReceiver)
@@ -223,6 +248,7 @@ class ContinualClientWithEWC(ContinualClient):
         if self.mu != 0:
             global_model = deepcopy(self.model)
         data_sum = 0
+        fisher = self.fisher
         self.model.train()
         for epoch in range(self.epoch):
             for data, label in self.train_dl:
@@ -239,7 +265,7 @@ class ContinualClientWithEWC(ContinualClient):
                     for w, w_t in zip(self.model.parameters(), global_model.parameters()):
                         proximal_term += (w - w_t).norm(2)
                     loss = loss + (self.mu / 2) * proximal_term
-                if self.fisher is not None:
+                if fisher is not None:
                     loss += self.ewc_loss()
                 # backpropagate
                 loss.backward()
@@ -289,8 +315,9 @@ class ContinualClientWithEWC(ContinualClient):
             EWC loss: a scalar value representing the EWC loss
         """
         loss = 0
+        fisher, previous_model = self.fisher, self.previous_model
         for name, param in self.model.named_parameters():
-            _loss = torch.sum(self.fisher[name] * (param - self.previous_model[name]).pow(2))
+            _loss = torch.sum(fisher[name] * (param - previous_model[name]).pow(2))
             loss += _loss.sum()
         loss = self.ewc_lambda / 2 * loss
         return loss
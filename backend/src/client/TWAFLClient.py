@@ -1,7 +1,5 @@
-from time import sleep
-
 from client.NormalClient import NormalClient
-from client.mixin.ClientHandler import DelaySimulator
+from client.mixin.ClientHandler import DelaySimulator, simulate_delay
 from core.handlers.Handler import Handler
 
 
@@ -20,7 +18,7 @@ class TWAFLDelay(Handler):
         client = request.get('client')
         flag = client.time_stamp % 15 in [11, 13, 14, 12, 0]
         if flag:
-            sleep(client.delay)
+            simulate_delay(client, client.delay)
         else:
-            sleep(client.new_delay)
+            simulate_delay(client, client.new_delay)
         return request
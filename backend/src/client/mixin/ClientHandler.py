@@ -1,7 +1,9 @@
-import copy
 import time
 
+import torch
+
 from core.handlers.Handler import Handler
+from utils.GlobalVarGetter import GlobalVarGetter
 
 
 class UpdateSender(Handler):
@@ -11,16 +13,36 @@ class UpdateSender(Handler):
         return request
 
 
+def get_weights_from_downlink(client):
+    """
+    Returns the weights dispatched to the client.
+    When model snapshots are enabled, the downlink only carries a version id and the shared immutable snapshot
+    is returned, so the caller must not modify it.
+    """
+    if client.global_var['config']['global'].get('model_snapshot', False):
+        version = client.message_queue.get_from_downlink(client.client_id, 'weights_version')
+        if version is not None:
+            snapshot = client.message_queue.get_model_snapshot(version)
+            if snapshot is not None:
+                return snapshot
+    return client.message_queue.get_from_downlink(client.client_id, 'weights')
+
+
+def load_weights(client, weights_buffer, key_filter=None):
+    # copy into the parameters in place, which avoids deep-copying the whole state_dict
+    state_dict = client.model.state_dict()
+    with torch.no_grad():
+        for k in weights_buffer:
+            if client.training_params[k] and (key_filter is None or key_filter(k)):
+                state_dict[k].copy_(weights_buffer[k])
+
+
 class UpdateReceiver(Handler):
     def _handle(self, request):
         client = request.get('client')
-        weights_buffer = client.message_queue.get_from_downlink(client.client_id, 'weights')
-        state_dict = client.model.state_dict()
-        for k in weights_buffer:
-            if client.training_params[k]:
-                state_dict[k] = copy.deepcopy(weights_buffer[k])
+        weights_buffer = get_weights_from_downlink(client)
+        load_weights(client, weights_buffer)
         del weights_buffer
-        client.model.load_state_dict(state_dict)
         client.time_stamp = client.message_queue.get_from_downlink(client.client_id, 'time_stamp')
         client.schedule_t = client.message_queue.get_from_downlink(client.client_id, 'schedule_time_stamp')
         client.receive_notify()
@@ -38,5 +60,20 @@ class DelaySimulator(Handler):
                 d = delay()  # 动态获取延迟
             else:
                 d = delay
-            time.sleep(d)
+            simulate_delay(client, d)
         return request
+
+
+def simulate_delay(client, delay):
+    # clients run by a worker pool hand the delay to the pool, which holds back the upload instead of the worker
+    defer = getattr(client, 'defer_delay', None)
+    if defer is not None:
+        defer(delay)
+        return
+    # 虚拟时钟模式下不真正休眠, 由时钟按模拟完成时间释放
+    # the client's own global_var only carries the config, the clock lives in the process-wide one
+    clock = GlobalVarGetter.get().get('virtual_clock')
+    if clock is None:
+        time.sleep(delay)
+    else:
+        clock.sleep(client.client_id, delay)
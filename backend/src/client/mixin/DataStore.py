@@ -1,3 +1,14 @@
+import atexit
+import collections
+import os
+import queue
+import shutil
+import threading
+import uuid
+
+import torch
+
+
 class DataStore:
     """
     统一管理所有Client的数据，支持自定义共享/隔离策略。
@@ -57,3 +68,186 @@ class DataStore:
             self.set(client_id, k, v)
 
     # 可扩展：支持hook、跨client共享等
+
+
+class SpillingDataStore(DataStore):
+    """
+    按LRU和字节预算管理隔离数据的DataStore: 超出budget时, 最久未访问的client的张量被换出,
+    再次访问或被调度器选中(prefetch)时换回原设备。
+    - mode='mmap': 换出到spill_dir下的文件, 换回时以内存映射方式读取
+    - mode='pinned': 换出到锁页内存, 只释放显存, 换回时异步拷贝
+    只有dict/list/tuple中的张量会被换出, DataLoader、优化器等对象保持常驻。
+    可换出的数据:
+    - NormalClient两轮之间的优化器状态(optimizer_param_state), EWC的fisher/previous_model
+    - WorkerPoolClientManager下每个client的全部状态(优化器状态、buffers、client_state)
+    限制: 模型和train_dl只在WorkerPoolClientManager下被换出(每个worker只有一份)。不使用worker pool时,
+    每个client的模型和train_dl常驻内存/显存, 不受budget限制。
+    config:
+        budget: 隔离数据的字节预算, 如'4GB'
+        mode: 'mmap'或'pinned'
+        spill_dir: mmap模式的换出目录
+    """
+
+    def __init__(self, share_keys=None, isolate_keys=None, shared_dict=None, budget='4GB', mode='mmap',
+                 spill_dir='../spill'):
+        super().__init__(share_keys, isolate_keys, shared_dict)
+        if mode not in ('mmap', 'pinned'):
+            raise ValueError(f"unknown spill mode {mode}")
+        self.budget = _parse_bytes(budget)
+        self.mode = mode
+        self.spill_dir = os.path.join(spill_dir, uuid.uuid4().hex)
+        atexit.register(shutil.rmtree, self.spill_dir, True)
+        self.lock = threading.RLock()
+        # client_id -> resident bytes, oldest access first
+        self._lru = collections.OrderedDict()
+        self.resident = 0
+        # client_id -> (file or pinned tensors, bytes)
+        self._spilled = {}
+        self._prefetch = queue.Queue()
+        self._prefetcher = None
+
+    def get(self, client_id, key, default=None):
+        if key in self._strategies or key in self.share_keys:
+            return super().get(client_id, key, default)
+        with self.lock:
+            self.touch(client_id)
+            return super().get(client_id, key, default)
+
+    def set(self, client_id, key, value):
+        if key in self._strategies or key in self.share_keys:
+            return super().set(client_id, key, value)
+        with self.lock:
+            self.touch(client_id)
+            old = self._isolated.get(client_id, {}).get(key)
+            super().set(client_id, key, value)
+            self.account(client_id, _tensor_bytes(value) - _tensor_bytes(old))
+            self.enforce(client_id)
+
+    def get_all(self, client_id=None):
+        with self.lock:
+            if client_id is not None:
+                self.touch(client_id)
+            return super().get_all(client_id)
+
+    def touch(self, client_id):
+        # must be called under the lock
+        if client_id in self._spilled:
+            self.fetch(client_id)
+        if client_id in self._lru:
+            self._lru.move_to_end(client_id)
+
+    def account(self, client_id, delta):
+        self._lru[client_id] = self._lru.get(client_id, 0) + delta
+        self._lru.move_to_end(client_id)
+        self.resident += delta
+
+    def enforce(self, keep=None):
+        for client_id in list(self._lru):
+            if self.resident <= self.budget:
+                break
+            if client_id != keep and self._lru[client_id] > 0:
+                self.spill(client_id)
+
+    def spill(self, client_id):
+        tensors = []
+        self._isolated[client_id] = _extract(self._isolated[client_id], tensors)
+        size = self._lru.pop(client_id)
+        self.resident -= size
+        if self.mode == 'pinned':
+            pin = torch.cuda.is_available()
+            stored = [t.detach().to('cpu', copy=True).pin_memory() if pin else t.detach().to('cpu', copy=True)
+                      for t in tensors]
+        else:
+            os.makedirs(self.spill_dir, exist_ok=True)
+            stored = os.path.join(self.spill_dir, f'{client_id}.pt')
+            tmp = f'{stored}.{uuid.uuid4().hex}'
+            torch.save([t.detach().cpu() for t in tensors], tmp)
+            # the tensors of an earlier fetch still map the old file, which stays valid after the rename
+            os.replace(tmp, stored)
+        self._spilled[client_id] = (stored, size)
+
+    def fetch(self, client_id):
+        stored, size = self._spilled.pop(client_id)
+        if self.mode == 'pinned':
+            tensors = stored
+        else:
+            try:
+                tensors = torch.load(stored, mmap=True, weights_only=False)
+            except TypeError:
+                tensors = torch.load(stored)
+        self._isolated[client_id] = _restore(self._isolated[client_id], tensors)
+        self.account(client_id, size)
+        self.enforce(client_id)
+
+    def prefetch(self, client_ids):
+        """
+        换回被选中的client, 在后台线程中完成, 不阻塞调度器。
+        """
+        with self.lock:
+            if self._prefetcher is None:
+                self._prefetcher = threading.Thread(target=self._run_prefetch, daemon=True)
+                self._prefetcher.start()
+        for client_id in client_ids:
+            self._prefetch.put(client_id)
+
+    def _run_prefetch(self):
+        while True:
+            client_id = self._prefetch.get()
+            with self.lock:
+                self.touch(client_id)
+
+
+class _TensorRef:
+    def __init__(self, index, device, requires_grad):
+        self.index = index
+        self.device = device
+        self.requires_grad = requires_grad
+
+
+def _extract(value, tensors):
+    if isinstance(value, torch.Tensor):
+        tensors.append(value)
+        return _TensorRef(len(tensors) - 1, value.device, value.requires_grad)
+    return _map(value, _extract, tensors)
+
+
+def _restore(value, tensors):
+    if isinstance(value, _TensorRef):
+        t = tensors[value.index].to(value.device, non_blocking=True)
+        if value.requires_grad and t.is_floating_point():
+            t.requires_grad_()
+        return t
+    return _map(value, _restore, tensors)
+
+
+def _map(value, func, tensors):
+    if isinstance(value, dict):
+        # copy keeps the type, e.g. OrderedDict or defaultdict
+        result = value.copy()
+        for k, v in value.items():
+            result[k] = func(v, tensors)
+        return result
+    if type(value) in (list, tuple):
+        return type(value)(func(v, tensors) for v in value)
+    return value
+
+
+def _tensor_bytes(value):
+    if isinstance(value, torch.Tensor):
+        return value.nelement() * value.element_size()
+    if isinstance(value, dict):
+        return sum(_tensor_bytes(v) for v in value.values())
+    if isinstance(value, (list, tuple)):
+        return sum(_tensor_bytes(v) for v in value)
+    return 0
+
+
+def _parse_bytes(size):
+    if isinstance(size, (int, float)):
+        return int(size)
+    units = {'KB': 1 << 10, 'MB': 1 << 20, 'GB': 1 << 30, 'TB': 1 << 40, 'B': 1}
+    size = size.strip().upper()
+    for unit, factor in units.items():
+        if size.endswith(unit):
+            return int(float(size[:-len(unit)]) * factor)
+    return int(size)
@@ -8,6 +8,7 @@ from core.handlers.Handler import HandlerChain, Handler
 from loss.LossFactory import LossFactory
 from utils import ModuleFindTool
 from utils.DatasetUtils import FLDataset
+from utils.DeviceDataset import DeviceTensorDataset, DeviceBatchLoader
 from utils.ModuleFindTool import load_model_from_config
 from utils.Tools import random_seed_set
 
@@ -52,7 +53,14 @@ class TrainDatasetInit(Handler):
         client = request.get('client')
         transform, target_transform = self._get_transform(config)
         client.fl_train_ds = FLDataset(client.train_ds, list(client.index_list), transform, target_transform)
-        client.train_dl = DataLoader(client.fl_train_ds, batch_size=client.batch_size, shuffle=True, drop_last=True)
+        if config.get("device_dataset", False) and DeviceTensorDataset.supports(client.train_ds):
+            # 预加载的数据集常驻设备, 按index_list直接切片取batch
+            client.train_dl = DeviceBatchLoader(client.fl_train_ds, DeviceTensorDataset.of(client.train_ds, client.dev),
+                                                client.batch_size, shuffle=True, drop_last=True,
+                                                batch_transform=config.get("batch_transform", False))
+        else:
+            client.train_dl = DataLoader(client.fl_train_ds, batch_size=client.batch_size, shuffle=True,
+                                         drop_last=True)
         return request
 
     def _get_transform(self, config):
@@ -0,0 +1,172 @@
+import queue
+
+import torch
+
+from clientmanager.WorkerPoolClientManager import WorkerPoolClientManager, ClientWorker
+from core.handlers.CohortTrainHandler import CohortTrainHandler, CohortTrain
+from core.handlers.ModelTrainHandler import ClientTrainHandler
+
+
+class CohortClientManager(WorkerPoolClientManager):
+    r"""
+    The worker pool in cohort training mode: a worker takes up to cohort_size queued clients at once and runs their
+    local SGD in lockstep with torch.func (see CohortTrain), which fills the device much better than training
+    small models one after another.
+    config:
+        workers: the number of workers, one per client device by default
+        cohort_size: the largest cohort, on cuda it is further limited by the measured memory of the last cohort
+    Clients which cannot be vectorized (an optimizer other than SGD, a lr scheduler, a custom train function or
+    a model with buffers such as BatchNorm) are trained one by one as in WorkerPoolClientManager.
+    """
+
+    def __init__(self, whole_config):
+        super().__init__(whole_config)
+        self.cohort_size = whole_config["client_manager"].get("cohort_size", 8)
+
+    def create_worker(self, worker_id, dev):
+        return CohortWorker(worker_id, self, worker_id, dev, self.cohort_size)
+
+
+class CohortWorker(ClientWorker):
+    def __init__(self, worker_id, pool, first_client_id, dev, cohort_size):
+        super().__init__(worker_id, pool, first_client_id, dev)
+        self.cohort_size = cohort_size
+        self.cohort_limit = cohort_size
+        self.cohort_handler = None
+
+    def init(self):
+        super().init()
+        shell = self.shell
+        handler = CohortTrainHandler()
+        if self.vectorizable() and replace_handler(shell.handler_chain, handler, ClientTrainHandler):
+            self.cohort_handler = handler
+        else:
+            print(f"Worker {self.worker_id}: the client can not be trained as a cohort, training one by one")
+
+    def vectorizable(self):
+        shell = self.shell
+        return (type(self.optimizer) is torch.optim.SGD and len(self.optimizer.param_groups) == 1
+                and shell.lr_scheduler is None and 'train_func' not in shell.config and not hasattr(shell, 'train')
+                and len(list(shell.model.buffers())) == 0)
+
+    def run(self):
+        self.init()
+        while True:
+            client_id = self.pool.tasks.get()
+            if client_id is None:
+                break
+            cohort = [client_id]
+            while self.cohort_handler is not None and len(cohort) < self.cohort_limit:
+                try:
+                    client_id = self.pool.tasks.get_nowait()
+                except queue.Empty:
+                    break
+                if client_id is None:
+                    # the stop signal of some worker, left for the next get
+                    self.pool.tasks.put(None)
+                    break
+                cohort.append(client_id)
+            cohort = [c for c in cohort if not self.pool.stop_event_list[c].is_set()]
+            if len(cohort) == 1 or self.cohort_handler is None:
+                for c in cohort:
+                    self.train(c)
+            elif cohort:
+                self.train_cohort(cohort)
+
+    def train_cohort(self, cohort):
+        shell = self.shell
+        # receive the weights of every client, the chains stop at the cohort handler
+        entries = []
+        self.cohort_handler.collecting = True
+        try:
+            for client_id in cohort:
+                self.bind(client_id)
+                self.delay, self.upload = 0, None
+                try:
+                    shell.execute_chain()
+                    request = self.cohort_handler.take()
+                    if request is not None:
+                        entries.append((client_id, request, {n: p.detach().clone() for n, p in
+                                                             shell.model.named_parameters()},
+                                        self.momentum(), shell.train_dl))
+                finally:
+                    self.unbind(client_id)
+                if request is None:
+                    self.finish(client_id)
+        finally:
+            self.cohort_handler.collecting = False
+        if not entries:
+            return
+
+        results = self.vectorized_train(entries)
+
+        # resume every chain with its own result
+        for (client_id, request, _, _, _), (data_sum, weights, momentum) in zip(entries, results):
+            self.bind(client_id)
+            self.delay, self.upload = 0, None
+            try:
+                state_dict = shell.model.state_dict()
+                with torch.no_grad():
+                    for k, v in weights.items():
+                        state_dict[k].copy_(v)
+                for n, p in shell.model.named_parameters():
+                    if momentum.get(n) is not None:
+                        self.optimizer.state[p]['momentum_buffer'] = momentum[n].clone()
+                request['train_res'] = (data_sum, shell.model.state_dict())
+                self.cohort_handler.resume(request)
+            finally:
+                self.unbind(client_id)
+            self.finish(client_id)
+
+    def vectorized_train(self, entries):
+        shell = self.shell
+        cuda = str(self.dev).startswith('cuda')
+        if cuda:
+            torch.cuda.reset_peak_memory_stats(self.dev)
+            base = torch.cuda.memory_allocated(self.dev)
+        try:
+            results = CohortTrain(shell.model, shell.loss_func, [e[2] for e in entries], [e[3] for e in entries],
+                                  [e[4] for e in entries], shell.epoch, self.dev, self.optimizer.param_groups[0],
+                                  shell.mu)
+        except torch.cuda.OutOfMemoryError:
+            if len(entries) == 1:
+                raise
+            torch.cuda.empty_cache()
+            self.cohort_limit = max(1, len(entries) // 2)
+            print(f"Worker {self.worker_id}: out of memory, cohort size reduced to {self.cohort_limit}")
+            half = len(entries) // 2
+            return self.vectorized_train(entries[:half]) + self.vectorized_train(entries[half:])
+        if cuda:
+            # the memory of one client in the last cohort decides how many fit into the free memory
+            used = max(torch.cuda.max_memory_allocated(self.dev) - base, 1)
+            free = torch.cuda.mem_get_info(self.dev)[0]
+            per_client = used / len(entries)
+            self.cohort_limit = min(self.cohort_size, max(1, int(0.9 * (free + used) / per_client)))
+        return results
+
+    def momentum(self):
+        momentum = {}
+        for n, p in self.shell.model.named_parameters():
+            buf = self.optimizer.state[p].get('momentum_buffer') if p in self.optimizer.state else None
+            momentum[n] = buf.clone() if buf is not None else None
+        return momentum
+
+
+def replace_handler(chain, handler, target_cls):
+    """
+    Puts handler in place of the first target_cls of the top level chain and returns True.
+    Unlike exchange_handler it links the handler itself, without a FunctionHandler around it, so that the handler
+    decides whether the chain goes on.
+    """
+    prev, it = None, chain._head
+    while it is not None:
+        if isinstance(it, target_cls) or isinstance(getattr(it, 'handle_func', None), target_cls):
+            handler.set_next(it.next_handler)
+            if prev is None:
+                chain.set_chain(handler)
+            else:
+                prev.set_next(handler)
+                chain.invalidate()
+            return True
+        prev, it = it, it.next_handler
+    return False
@@ -0,0 +1,395 @@
+import copy
+import heapq
+import itertools
+import queue
+import threading
+import time
+
+import torch
+
+from client.mixin.DataStore import DataStore
+from client.mixin.InitHandler import RandomSeedInit, DatasetLoader, ModelInit, OptimizerInit, SchedulerInit, \
+    RegisterHandler
+from clientmanager.NormalClientManager import NormalClientManager
+from core.MessageQueue import MessageQueueFactory, EventFactory
+from core.Runtime import running_mode
+from core.handlers.Handler import Handler, HandlerChain
+from utils import ModuleFindTool
+from utils.GlobalVarGetter import GlobalVarGetter
+from utils.Tools import to_cpu
+
+# these init handlers build what a worker shares between its clients, the others build the state of one client
+WORKER_INIT_HANDLERS = (RandomSeedInit, DatasetLoader, ModelInit, OptimizerInit, SchedulerInit, RegisterHandler)
+
+
+class WorkerPoolClientManager(NormalClientManager):
+    r"""
+    Runs the clients on a fixed pool of worker threads instead of one thread per client.
+    Selecting a client queues a training task, a free worker binds the client to its own model and optimizer,
+    restores the client's state from the data_proxy, runs the client's handler chain and saves the state back.
+    So the number of models and optimizers scales with the number of workers, not with the number of clients.
+    The delay of a client does not occupy a worker, the upload is held back until it has elapsed
+    (or until the virtual clock releases it).
+    config:
+        workers: the number of workers, one per client device by default
+    Only the thread mode is supported.
+    """
+
+    def __init__(self, whole_config):
+        super().__init__(whole_config)
+        mode, _ = running_mode(whole_config)
+        if mode != 'thread':
+            raise ValueError("WorkerPoolClientManager is only supported in thread mode")
+        config = whole_config["client_manager"]
+        self.devices = sorted(set(self.client_dev))
+        self.worker_num = config.get("workers", len(self.devices))
+        self.message_queue = MessageQueueFactory.create_message_queue()
+        if self.global_var.get('data_proxy', None) is None:
+            self.global_var['data_proxy'] = DataStore()
+        self.data_proxy = self.global_var['data_proxy']
+        self.tasks = queue.Queue()
+        self.sender = DelayedSender()
+        self.stopped = False
+        self.workers = []
+        self.selected_event_list = [TaskEvent(i, self) for i in range(self.client_num)]
+        self.global_var['selected_event_list'] = self.selected_event_list
+
+    def start_all_clients(self):
+        self.client_id_list = list(range(self.client_num))
+        for client_id in self.client_id_list:
+            self.message_queue.set_training_status(client_id, False)
+        worker_num = min(self.worker_num, self.client_num)
+        self.workers = [self.create_worker(i, self.devices[i % len(self.devices)]) for i in range(worker_num)]
+        self.client_list = self.workers
+        self.global_var['client_list'] = self.client_list
+        self.global_var['client_id_list'] = self.client_id_list
+        print(f"Starting {worker_num} workers for {self.client_num} clients")
+        self.sender.start()
+        for worker in self.workers:
+            worker.start()
+
+    def create_worker(self, worker_id, dev):
+        return ClientWorker(worker_id, self, worker_id, dev)
+
+    def submit(self, client_id):
+        if self.stopped or self.stop_event_list[client_id].is_set():
+            return
+        self.message_queue.set_training_status(client_id, True)
+        self.tasks.put(client_id)
+
+    def schedule_upload(self, client_id, delay, callback):
+        clock = GlobalVarGetter.get().get('virtual_clock')
+        if clock is None:
+            self.sender.schedule(client_id, delay, callback)
+        else:
+            clock.schedule(client_id, delay, callback)
+
+    def stop_all_clients(self):
+        self.stopped = True
+        super().stop_all_clients()
+        for _ in self.workers:
+            self.tasks.put(None)
+        self.sender.stop()
+
+    def create_and_start_new_client(self, dev='cpu'):
+        client_id = self.client_num
+        self.stop_event_list.append(EventFactory.create_Event())
+        self.selected_event_list.append(TaskEvent(client_id, self))
+        self.message_queue.set_training_status(client_id, False)
+        self.client_id_list.append(client_id)
+        self.client_num += 1
+
+    def client_join(self):
+        for worker in self.workers:
+            worker.join()
+        self.sender.join()
+
+
+class TaskEvent:
+    r"""
+    Takes the place of the selected event of a client, setting it queues a training task of the client.
+    """
+
+    def __init__(self, client_id, pool):
+        self.client_id = client_id
+        self.pool = pool
+
+    def set(self):
+        self.pool.submit(self.client_id)
+
+    def clear(self):
+        pass
+
+    def is_set(self):
+        return False
+
+    def wait(self, timeout=None):
+        return False
+
+
+class ClientWorker(threading.Thread):
+    r"""
+    One worker of the pool: a single client instance (the shell) which is rebound to the client of every task.
+    Every attribute of the shell except worker_attrs belongs to the bound client, as does the state of the handlers
+    of its handler chain (e.g. PersonalUpdateReceiver.is_init), the optimizer state, the lr scheduler state and the
+    buffers of the model. They are saved to the data_proxy after every task, a new client starts from a copy of the
+    state the shell had before its init chain ran.
+    """
+    # attributes of the shell which the worker shares between its clients
+    worker_attrs = frozenset(('model', 'training_params', 'train_ds', 'lr_scheduler', 'message_queue', 'data_proxy',
+                              'global_var', 'handler_chain', 'init_chain', 'finals', 'event', 'stop_event',
+                              'client_id', 'delay', 'dev', 'config', 'update_dict', 'defer_delay'))
+
+    def __init__(self, worker_id, pool, first_client_id, dev):
+        super().__init__(daemon=True)
+        self.worker_id = worker_id
+        self.pool = pool
+        self.first_client_id = first_client_id
+        self.dev = dev
+        self.data_proxy = pool.data_proxy
+        self.message_queue = pool.message_queue
+        self.shell = None
+        self.client_init_chain = None
+        self.optimizer = None
+        self.handlers = []
+        self.initial_state = None
+        self.initial_optimizer_state = None
+        self.initial_scheduler_state = None
+        self.initial_buffers = {}
+        self.delay = 0
+        self.upload = None
+
+    def run(self):
+        self.init()
+        while True:
+            client_id = self.pool.tasks.get()
+            if client_id is None:
+                break
+            if self.pool.stop_event_list[client_id].is_set():
+                continue
+            self.train(client_id)
+
+    def init(self):
+        pool = self.pool
+        c_id = self.first_client_id
+        client_class = ModuleFindTool.find_class_by_path(pool.whole_config["client"]["path"])
+        try:
+            shell = client_class(c_id, pool.stop_event_list[c_id], pool.selected_event_list[c_id],
+                                 pool.client_staleness_list[c_id], pool.index_list[c_id], pool.client_config,
+                                 self.dev, data_proxy=self.data_proxy)
+        except TypeError:
+            shell = client_class(c_id, pool.stop_event_list[c_id], pool.selected_event_list[c_id],
+                                 pool.client_staleness_list[c_id], pool.index_list[c_id], pool.client_config,
+                                 self.dev)
+            shell.data_proxy = self.data_proxy
+        shell.message_queue = DeferredUplink(self)
+        shell.defer_delay = self.defer_delay
+        self.shell = shell
+        shell.create_handler_chain()
+        self.handlers = chain_handlers(shell.handler_chain)
+        self.initial_state = copy.deepcopy(self.client_state())
+        shell.init()
+        self.client_init_chain = client_init_chain(shell.init_chain)
+        self.optimizer = shell.optimizer
+        self.initial_optimizer_state = to_cpu(copy.deepcopy(self.optimizer.state_dict()))
+        if shell.lr_scheduler is not None:
+            self.initial_scheduler_state = copy.deepcopy(shell.lr_scheduler.state_dict())
+        self.initial_buffers = self.buffers()
+        self.unbind(c_id)
+
+    def train(self, client_id):
+        self.bind(client_id)
+        self.delay, self.upload = 0, None
+        try:
+            self.shell.execute_chain()
+        finally:
+            self.unbind(client_id)
+        self.finish(client_id)
+
+    def finish(self, client_id):
+        if self.upload is None:
+            self.message_queue.set_training_status(client_id, False)
+        else:
+            # scheduled after the state is saved, so that the next task of the client sees it
+            item, key = self.upload
+            self.pool.schedule_upload(client_id, self.delay, lambda: self.release(client_id, item, key))
+
+    def release(self, client_id, item, key):
+        self.message_queue.put_into_uplink(item, key)
+        self.message_queue.set_training_status(client_id, False)
+
+    def defer_delay(self, delay):
+        self.delay = delay
+
+    def defer_upload(self, item, key):
+        # the weights may still be views of the shell model, which the next task overwrites
+        self.upload = (copy.deepcopy(item), key)
+
+    def bind(self, client_id):
+        pool, shell = self.pool, self.shell
+        shell.client_id = client_id
+        shell.event = pool.selected_event_list[client_id]
+        shell.stop_event = pool.stop_event_list[client_id]
+        shell.delay = pool.client_staleness_list[client_id]
+        shell.update_dict = {}
+        shell.optimizer = self.optimizer
+        optimizer_state = self.data_proxy.get(client_id, 'optimizer_state')
+        if optimizer_state is None:
+            self.optimizer.state.clear()
+            optimizer_state = self.initial_optimizer_state
+        self.optimizer.load_state_dict(optimizer_state)
+        if shell.lr_scheduler is not None:
+            shell.lr_scheduler.load_state_dict(self.data_proxy.get(client_id, 'scheduler_state',
+                                                                   self.initial_scheduler_state))
+        state = self.data_proxy.get(client_id, 'client_state')
+        if state is None:
+            self.load_client_state(copy.deepcopy(self.initial_state))
+            shell.index_list = pool.index_list[client_id]
+            shell.time_stamp, shell.schedule_t = 0, None
+            self.client_init_chain.handle({"global_var": shell.global_var, "client": shell, "config": shell.config})
+        else:
+            self.load_client_state(state)
+        self.load_buffers(self.data_proxy.get(client_id, 'buffers', self.initial_buffers))
+
+    def unbind(self, client_id):
+        shell = self.shell
+        # the attributes are rebound by the next bind, so the client keeps its own objects without a copy
+        self.data_proxy.set(client_id, 'client_state', self.client_state())
+        self.data_proxy.set(client_id, 'optimizer_state', to_cpu(copy.deepcopy(self.optimizer.state_dict())))
+        if shell.lr_scheduler is not None:
+            self.data_proxy.set(client_id, 'scheduler_state', shell.lr_scheduler.state_dict())
+        self.data_proxy.set(client_id, 'buffers', self.buffers())
+        self.data_proxy.set(client_id, 'optimizer', None)
+
+    def client_state(self):
+        return {'attrs': {k: v for k, v in vars(self.shell).items() if k not in self.worker_attrs},
+                'handlers': [handler_state(handler) for handler in self.handlers]}
+
+    def load_client_state(self, state):
+        shell, attrs = self.shell, state['attrs']
+        # the attributes another client has added since
+        for k in [k for k in vars(shell) if k not in self.worker_attrs and k not in attrs]:
+            delattr(shell, k)
+        vars(shell).update(attrs)
+        for handler, handler_vars in zip(self.handlers, state['handlers']):
+            vars(handler).update(handler_vars)
+
+    def buffers(self):
+        # the weights the server does not send, e.g. the running stats of BatchNorm
+        shell = self.shell
+        return {k: v.detach().to('cpu', copy=True) for k, v in shell.model.state_dict().items()
+                if not shell.training_params[k]}
+
+    def load_buffers(self, buffers):
+        state_dict = self.shell.model.state_dict()
+        with torch.no_grad():
+            for k, v in buffers.items():
+                state_dict[k].copy_(v)
+
+
+class DeferredUplink:
+    r"""
+    The message queue of a shell client: uploads are handed to the worker, everything else goes to the message queue.
+    """
+
+    def __init__(self, worker):
+        self.worker = worker
+        self.message_queue = worker.message_queue
+
+    def put_into_uplink(self, item, key='update'):
+        if key == 'update':
+            self.worker.defer_upload(item, key)
+        else:
+            self.message_queue.put_into_uplink(item, key)
+
+    def __getattr__(self, name):
+        return getattr(self.message_queue, name)
+
+
+class DelayedSender(threading.Thread):
+    r"""
+    Calls the scheduled callbacks once their delay has elapsed, in the order of their release time.
+    """
+
+    def __init__(self):
+        super().__init__(daemon=True)
+        self.condition = threading.Condition()
+        self.heap = []
+        self.counter = itertools.count()
+        self.stopped = False
+
+    def schedule(self, client_id, delay, callback):
+        with self.condition:
+            heapq.heappush(self.heap, (time.time() + delay, next(self.counter), callback))
+            self.condition.notify()
+
+    def run(self):
+        while True:
+            with self.condition:
+                while not self.stopped:
+                    timeout = self.heap[0][0] - time.time() if self.heap else None
+                    if timeout is not None and timeout <= 0:
+                        break
+                    self.condition.wait(timeout)
+                if self.stopped:
+                    return
+                _, _, callback = heapq.heappop(self.heap)
+            callback()
+
+    def stop(self):
+        with self.condition:
+            self.stopped = True
+            self.heap = []
+            self.condition.notify()
+
+
+def chain_handlers(chain):
+    """
+    The handlers of a handler chain, nested chains included.
+    """
+    handlers = []
+
+    def collect(it):
+        while it is not None:
+            if isinstance(it, HandlerChain):
+                collect(it._head)
+            else:
+                handlers.append(it)
+                inner = getattr(it, 'handle_func', None)
+                if isinstance(inner, Handler):
+                    collect(inner)
+                for child in getattr(it, 'children', []):
+                    collect(child)
+            it = it.next_handler
+
+    collect(chain._head)
+    return handlers
+
+
+def handler_state(handler):
+    # the links between the handlers belong to the chain
+    return {k: v for k, v in vars(handler).items()
+            if k not in ('has_run', 'handle_func', 'children') and not isinstance(v, Handler)}
+
+
+def client_init_chain(init_chain):
+    """
+    The handlers of the init chain which build the state of one client, as a new chain.
+    """
+    handlers = []
+
+    def collect(chain):
+        it = chain._head
+        while it is not None:
+            if isinstance(it, HandlerChain):
+                collect(it)
+            elif not isinstance(it, WORKER_INIT_HANDLERS):
+                handlers.append(it)
+            it = it.next_handler
+
+    collect(init_chain)
+    chain = HandlerChain()
+    for handler in handlers:
+        handler.next_handler = None
+        chain.add_handler(handler)
+    return chain
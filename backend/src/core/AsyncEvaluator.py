@@ -0,0 +1,129 @@
+import copy
+import threading
+import traceback
+from collections import deque
+
+import torch
+
+
+class AsyncEvaluator(threading.Thread):
+    r"""
+    Tests the global model off the critical path of the updater: submit takes an immutable snapshot of the model
+    with its epoch and returns at once, a thread loads the snapshot into its own copy of the model and runs the
+    test function, on a separate cuda stream or on another cuda device. The results are kept in epoch order until
+    ServerPostTestHandler drains them.
+    config (updater.async_test, True or a dict):
+        max_pending: the snapshots waiting for the evaluator, default 1
+        policy: what submit does when max_pending snapshots are waiting
+            coalesce: the newest waiting snapshot is replaced (default), so the latest model is always tested
+            skip: the new snapshot is dropped
+            block: the updater waits for the evaluator
+        dev: the device of the evaluation, by default the last cuda device if there are several, else the device
+            of the updater
+    """
+
+    def __init__(self, updater, test_func, config):
+        super().__init__(daemon=True)
+        self.updater = updater
+        self.test_func = test_func
+        self.max_pending = max(1, config.get('max_pending', 1))
+        self.policy = config.get('policy', 'coalesce')
+        if self.policy not in ('coalesce', 'skip', 'block'):
+            raise ValueError(f"unknown async_test policy {self.policy}")
+        default_dev = updater.dev
+        if torch.cuda.is_available() and torch.cuda.device_count() > 1:
+            default_dev = f'cuda:{torch.cuda.device_count() - 1}'
+        self.dev = config.get('dev', default_dev)
+        self.model = copy.deepcopy(updater.model).to(self.dev)
+        self.stream = torch.cuda.Stream(self.dev) if str(self.dev).startswith('cuda') else None
+        self.condition = threading.Condition()
+        self.pending = deque()
+        self.results = []
+        self.running = False
+        self.stopped = False
+        self.skipped = []
+
+    def submit(self, epoch, model):
+        # the snapshot is taken on the device of the model, the live model is updated in place
+        snapshot = {k: v.detach().clone() for k, v in model.state_dict().items()}
+        with self.condition:
+            if len(self.pending) >= self.max_pending:
+                if self.policy == 'skip':
+                    self.skipped.append(epoch)
+                    return False
+                if self.policy == 'coalesce':
+                    self.skipped.append(self.pending.pop()[0])
+                else:
+                    while len(self.pending) >= self.max_pending and not self.stopped:
+                        self.condition.wait()
+            self.pending.append((epoch, snapshot))
+            self.condition.notify_all()
+        return True
+
+    def run(self):
+        while True:
+            with self.condition:
+                while not self.pending and not self.stopped:
+                    self.condition.wait()
+                if not self.pending:
+                    return
+                epoch, snapshot = self.pending.popleft()
+                self.running = True
+                self.condition.notify_all()
+            try:
+                test_res = self.evaluate(epoch, snapshot)
+            except Exception:
+                traceback.print_exc()
+                with self.condition:
+                    # the later snapshots would fail the same way
+                    self.pending.clear()
+                    self.stopped = True
+                    self.running = False
+                    self.condition.notify_all()
+                return
+            with self.condition:
+                self.results.append((epoch, test_res))
+                self.running = False
+                self.condition.notify_all()
+
+    def evaluate(self, epoch, snapshot):
+        if self.stream is not None:
+            # the copy to the evaluation device waits for the updater stream which produced the snapshot
+            self.stream.wait_stream(torch.cuda.current_stream(snapshot_device(snapshot)))
+            with torch.cuda.stream(self.stream):
+                self.model.load_state_dict(snapshot)
+                test_res = self.test_func(self.updater.test_dl, self.model, self.updater.loss_func, self.dev, epoch,
+                                          self.updater)
+            self.stream.synchronize()
+            return test_res
+        self.model.load_state_dict(snapshot)
+        return self.test_func(self.updater.test_dl, self.model, self.updater.loss_func, self.dev, epoch,
+                              self.updater)
+
+    def drain(self):
+        """
+        Returns the finished (epoch, test_res) in epoch order.
+        """
+        with self.condition:
+            results, self.results = self.results, []
+        return results
+
+    def flush(self):
+        """
+        Waits until every submitted snapshot is tested, then stops the thread.
+        """
+        with self.condition:
+            while self.pending or self.running:
+                self.condition.wait()
+            self.stopped = True
+            self.condition.notify_all()
+        self.join()
+        if self.skipped:
+            print(f"Async test skipped {len(self.skipped)} epochs as the evaluation fell behind")
+
+
+def snapshot_device(snapshot):
+    for v in snapshot.values():
+        if isinstance(v, torch.Tensor) and v.is_cuda:
+            return v.device
+    return None
@@ -0,0 +1,242 @@
+import random
+import threading
+from collections.abc import Sequence
+
+
+class _Fenwick:
+    def __init__(self, values):
+        self.n = len(values)
+        self.tree = [0] * (self.n + 1)
+        for i, v in enumerate(values):
+            self.tree[i + 1] += v
+            j = i + 1 + ((i + 1) & -(i + 1))
+            if j <= self.n:
+                self.tree[j] += self.tree[i + 1]
+
+    def add(self, i, delta):
+        i += 1
+        while i <= self.n:
+            self.tree[i] += delta
+            i += i & -i
+
+    def total(self):
+        return self.prefix(self.n)
+
+    def prefix(self, i):
+        s = 0
+        while i > 0:
+            s += self.tree[i]
+            i -= i & -i
+        return s
+
+    def search(self, target):
+        """
+        The smallest index whose prefix sum (inclusive) exceeds target.
+        """
+        pos = 0
+        step = 1 << self.n.bit_length()
+        while step:
+            nxt = pos + step
+            if nxt <= self.n and self.tree[nxt] <= target:
+                pos = nxt
+                target -= self.tree[nxt]
+            step >>= 1
+        return pos
+
+
+class ClientRegistry:
+    r"""
+    The idle/busy state of the clients, kept up to date by set_training_status, so the scheduler does not rebuild
+    the list of idle clients every round. The registered clients (client_id_list) are indexed in the order of the
+    list by a Fenwick tree over the idle ones: updating a client is O(log n), the j-th idle client is found in
+    O(log n), so drawing k clients costs O(k log n) and gives the same clients as indexing the old list. A second
+    tree over the client weights supports weighted sampling without replacement. Counting the idle clients and
+    drawing from them happen under one lock (sample_idle, weighted_sample), as the clients change their status
+    meanwhile.
+    A client which has not reported a status yet is idle, as before. A client which is not registered keeps its
+    status but is never drawn.
+    """
+
+    def __init__(self):
+        # a condition, so that a scheduler can wait for clients to become idle
+        self.lock = threading.Condition()
+        self.ids = []
+        self.index = {}
+        self.idle = []
+        self.weights = []
+        self.registered = []
+        self.idle_tree = _Fenwick([])
+        self.weight_tree = _Fenwick([])
+
+    def __slot(self, client_id):
+        slot = self.index.get(client_id)
+        if slot is not None:
+            return slot
+        # not registered, so it is not in the trees
+        slot = self.index[client_id] = len(self.ids)
+        self.ids.append(client_id)
+        self.idle.append(True)
+        self.weights.append(1.0)
+        self.registered.append(False)
+        if len(self.ids) > self.idle_tree.n:
+            # the capacity is doubled, so the rebuilds are amortized O(1)
+            self.__rebuild(2 * len(self.ids))
+        return slot
+
+    def __rebuild(self, capacity=None):
+        capacity = max(capacity or self.idle_tree.n, len(self.ids), 16)
+        padding = capacity - len(self.ids)
+        drawn = [v and r for v, r in zip(self.idle, self.registered)]
+        self.idle_tree = _Fenwick([int(v) for v in drawn] + [0] * padding)
+        self.weight_tree = _Fenwick([w if v else 0.0 for v, w in zip(drawn, self.weights)] + [0.0] * padding)
+
+    def register(self, client_ids):
+        """
+        The clients which are drawn from are exactly client_ids, in this order.
+        """
+        with self.lock:
+            client_ids = list(dict.fromkeys(client_ids))
+            members = set(client_ids)
+            status = {c: (self.idle[i], self.weights[i]) for i, c in enumerate(self.ids)}
+            self.ids = client_ids + [c for c in self.ids if c not in members]
+            self.index = {c: i for i, c in enumerate(self.ids)}
+            self.idle = [status.get(c, (True, 1.0))[0] for c in self.ids]
+            self.weights = [status.get(c, (True, 1.0))[1] for c in self.ids]
+            self.registered = [i < len(client_ids) for i in range(len(self.ids))]
+            self.__rebuild(2 * len(self.ids))
+            self.lock.notify_all()
+
+    def set_status(self, client_id, training):
+        with self.lock:
+            slot = self.__slot(client_id)
+            idle = not training
+            if self.idle[slot] != idle:
+                self.idle[slot] = idle
+                if not self.registered[slot]:
+                    return
+                self.idle_tree.add(slot, 1 if idle else -1)
+                self.weight_tree.add(slot, self.weights[slot] if idle else -self.weights[slot])
+                if idle:
+                    self.lock.notify_all()
+
+    def set_weights(self, weights):
+        with self.lock:
+            for client_id, weight in weights.items():
+                slot = self.__slot(client_id)
+                if self.idle[slot] and self.registered[slot]:
+                    self.weight_tree.add(slot, weight - self.weights[slot])
+                self.weights[slot] = weight
+
+    def drawn(self, slot):
+        return self.idle[slot] and self.registered[slot]
+
+    def is_idle(self, client_id):
+        slot = self.index.get(client_id)
+        return slot is None or self.idle[slot]
+
+    def idle_count(self):
+        with self.lock:
+            return self.idle_tree.total()
+
+    def wait_idle(self, count, timeout=None):
+        """
+        Waits until more than count clients are idle or the timeout elapses, returns the number of idle clients.
+        """
+        with self.lock:
+            self.lock.wait_for(lambda: self.idle_tree.total() > count, timeout)
+            return self.idle_tree.total()
+
+    def idle_at(self, positions):
+        """
+        The idle clients at the given positions of the idle clients in registration order. The positions beyond the clients
+        which are still idle are skipped.
+        """
+        with self.lock:
+            total = self.idle_tree.total()
+            return [self.ids[self.idle_tree.search(j)] for j in positions if 0 <= j < total]
+
+    def sample_idle(self, ratio, state):
+        """
+        Draws int(ratio * n) of the n idle clients uniformly without replacement. The draw continues the random
+        state of the caller, so it selects the same clients as random.sample on the list of the idle clients.
+        Returns n, the clients and the new random state.
+        """
+        rng = random.Random()
+        rng.setstate(state)
+        with self.lock:
+            n = self.idle_tree.total()
+            positions = rng.sample(range(n), int(ratio * n))
+            return n, [self.ids[self.idle_tree.search(j)] for j in positions], rng.getstate()
+
+    def filter_idle(self, client_ids):
+        with self.lock:
+            return [client_id for client_id in client_ids if self.is_idle(client_id)]
+
+    def weighted_sample(self, draws):
+        """
+        Draws len(draws) idle clients without replacement with probability proportional to their weights,
+        draws are uniform numbers in [0, 1) so that the random state stays with the caller.
+        """
+        with self.lock:
+            selected = []
+            taken = set()
+            for u in draws:
+                total = self.weight_tree.total()
+                if total <= 0:
+                    break
+                slot = min(self.weight_tree.search(u * total), len(self.ids) - 1)
+                if not self.drawn(slot) or slot in taken:
+                    # float rounding may land on a removed slot
+                    slot = min(self.weight_tree.search(0.0), len(self.ids) - 1)
+                    if not self.drawn(slot) or slot in taken:
+                        break
+                selected.append(slot)
+                taken.add(slot)
+                self.weight_tree.add(slot, -self.weights[slot])
+            for slot in selected:
+                self.weight_tree.add(slot, self.weights[slot])
+            return [self.ids[slot] for slot in selected]
+
+
+class IdleClients(Sequence):
+    r"""
+    The idle clients as a read-only sequence in the order of client_id_list, backed by the ClientRegistry of the message
+    queue. Only the accessed clients are fetched, with one call per access even if the queue is proxied.
+    """
+
+    def __init__(self, message_queue):
+        self.message_queue = message_queue
+        self.size = message_queue.idle_client_num()
+
+    def __len__(self):
+        return self.size
+
+    def __getitem__(self, item):
+        if isinstance(item, slice):
+            return self.take(range(*item.indices(self.size)))
+        if item < 0:
+            item += self.size
+        if not 0 <= item < self.size:
+            raise IndexError(item)
+        return self.take([item])[0]
+
+    def __iter__(self):
+        return iter(self.take(range(self.size)))
+
+    def take(self, positions):
+        return self.message_queue.get_idle_clients(list(positions))
+
+    def sample(self, ratio):
+        """
+        Draws int(ratio * n) of the n clients which are idle now with the global random state, returns n and the
+        clients.
+        """
+        n, clients, state = self.message_queue.sample_idle_clients(ratio, random.getstate())
+        random.setstate(state)
+        return n, clients
+
+    def weighted_sample(self, num):
+        return self.message_queue.weighted_sample_idle_clients([random.random() for _ in range(num)])
+
+    def set_weights(self, weights):
+        self.message_queue.set_client_weights(weights)
@@ -1,14 +1,15 @@
-import copy
 import multiprocessing as mp
+import os
 import pickle
 import sys
 import threading
 from copy import deepcopy
 from multiprocessing.managers import SyncManager
-from queue import Queue
+from queue import Queue, Empty
 from threading import Thread
-from time import sleep
 
+from core.ClientRegistry import ClientRegistry
+from core.SharedTensor import SlabPool, StaleSharedItemError
 from utils.GlobalVarGetter import GlobalVarGetter
 from utils.MQTT import MQTTClientSingleton
 
@@ -91,20 +92,33 @@ class ManagerWrapper:
 
 # this thread works in main process
 class DataGetter(Thread):
-    def __init__(self):
+    def __init__(self, timeout=0.5):
         super().__init__()
         self.is_end = False
         self.queue_manager = None
+        # the timeout only bounds how long kill() takes effect, updates are forwarded as soon as they arrive
+        self.timeout = timeout
         self.message_queue = MessageQueueFactory.create_message_queue()
 
     def run(self) -> None:
         self.queue_manager = GlobalVarGetter.get()['queue_manager']
+        model_version_store = GlobalVarGetter.get().get('model_version_store')
+        clock = GlobalVarGetter.get().get('virtual_clock')
+        # e.g. ThroughputSchedule, which measures the latency of the clients
+        upload_listeners = GlobalVarGetter.get().get('upload_listeners', [])
         while not self.is_end:
-            while not self.message_queue.uplink_empty():
-                update = copy.deepcopy(self.message_queue.get_from_uplink())
-                self.queue_manager.put(update)
-            # Give up cpu to other threads
-            sleep(0.1)
+            # block on the uplink instead of polling it
+            # get_from_uplink has already returned a private copy
+            update = self.message_queue.get_from_uplink(timeout=self.timeout)
+            if update is None:
+                continue
+            if model_version_store is not None and 'client_id' in update:
+                model_version_store.release(update['client_id'])
+            for listener in upload_listeners:
+                listener(update)
+            self.queue_manager.put(update)
+            if clock is not None:
+                clock.arrive(update.get('client_id'))
 
     def kill(self):
         self.is_end = True
@@ -119,14 +133,31 @@ class MessageQueue:
     uplink = {'update': Queue()}
     downlink = {'time_stamp': {}, 'weights': {}, 'schedule_time_stamp': {}, 'group_id': {}}
     training_status = {}
+    # idle/busy index of training_status for the scheduler
+    client_registry = ClientRegistry()
     config = {}
     latest_model = None
     current_t = None
-
-    @staticmethod
-    def get_from_uplink(key='update'):
-        with MessageQueue.__uplink_lock:
-            return deepcopy(MessageQueue.uplink[key].get())
+    model_snapshots = {}
+
+    @staticmethod
+    def get_from_uplink(key='update', timeout=None):
+        """
+        If timeout is None, behaves as before.
+        Otherwise, blocks until an item arrives or the timeout expires, in which case None is returned.
+        """
+        if timeout is None:
+            with MessageQueue.__uplink_lock:
+                return deepcopy(MessageQueue.uplink[key].get())
+        if key not in MessageQueue.uplink:
+            with MessageQueue.__uplink_lock:
+                if key not in MessageQueue.uplink:
+                    MessageQueue.uplink[key] = Queue()
+        # the queue is thread-safe, holding the lock here would block the producers
+        try:
+            return deepcopy(MessageQueue.uplink[key].get(timeout=timeout))
+        except Empty:
+            return None
 
     @staticmethod
     def put_into_uplink(item, key='update'):
@@ -171,6 +202,21 @@ class MessageQueue:
             else:
                 MessageQueue.downlink[key][client_id] = item
 
+    @staticmethod
+    def put_model_snapshot(version, weights):
+        with MessageQueue.__downlink_lock:
+            MessageQueue.model_snapshots[version] = weights
+
+    @staticmethod
+    def get_model_snapshot(version):
+        # snapshots are immutable, so there is no need to copy them
+        return MessageQueue.model_snapshots.get(version)
+
+    @staticmethod
+    def del_model_snapshot(version):
+        with MessageQueue.__downlink_lock:
+            MessageQueue.model_snapshots.pop(version, None)
+
     @staticmethod
     def uplink_empty(key='update'):
         return not MessageQueue.uplink[key].qsize()
@@ -182,6 +228,39 @@ class MessageQueue:
     @staticmethod
     def set_training_status(client_id, value):
         MessageQueue.training_status[client_id] = value
+        MessageQueue.client_registry.set_status(client_id, value)
+
+    @staticmethod
+    def register_clients(client_ids):
+        MessageQueue.client_registry.register(client_ids)
+
+    @staticmethod
+    def idle_client_num():
+        return MessageQueue.client_registry.idle_count()
+
+    @staticmethod
+    def wait_idle_clients(count, timeout=None):
+        return MessageQueue.client_registry.wait_idle(count, timeout)
+
+    @staticmethod
+    def get_idle_clients(positions):
+        return MessageQueue.client_registry.idle_at(positions)
+
+    @staticmethod
+    def filter_idle_clients(client_ids):
+        return MessageQueue.client_registry.filter_idle(client_ids)
+
+    @staticmethod
+    def sample_idle_clients(ratio, state):
+        return MessageQueue.client_registry.sample_idle(ratio, state)
+
+    @staticmethod
+    def set_client_weights(weights):
+        MessageQueue.client_registry.set_weights(weights)
+
+    @staticmethod
+    def weighted_sample_idle_clients(draws):
+        return MessageQueue.client_registry.weighted_sample(draws)
 
     @staticmethod
     def get_training_status():
@@ -293,6 +372,12 @@ class MessageQueueWrapperForMQTT:
                     cls.message_queue.set_train_dataset(msg)
                 elif topic == f'{cls.uid}/mq/test_dataset':
                     cls.message_queue.set_test_dataset(msg)
+                elif topic == f'{cls.uid}/mq/model_snapshot':
+                    version, weights = msg
+                    if weights is None:
+                        cls.message_queue.del_model_snapshot(version)
+                    else:
+                        cls.message_queue.put_model_snapshot(version, weights)
                 else:
                     topic, client_id = topic.split('/')[-2:]
                     key, item = msg
@@ -307,6 +392,8 @@ class MessageQueueWrapperForMQTT:
                 cls.client.subscribe(f'{cls.uid}/mq/test_dataset') if 'test_dataset' not in cls.mask_list else None
                 cls.client.subscribe(f'{cls.uid}/mq/latest_model') if 'latest_model' not in cls.mask_list else None
                 cls.client.subscribe(f'{cls.uid}/mq/config') if 'config' not in cls.mask_list else None
+                cls.client.subscribe(
+                    f'{cls.uid}/mq/model_snapshot') if 'model_snapshot' not in cls.mask_list else None
             # server
             else:
                 cls.client.subscribe(f'{cls.uid}/mq/uplink') if 'uplink' not in cls.mask_list else None
@@ -322,8 +409,8 @@ class MessageQueueWrapperForMQTT:
         return super().__new__(cls)
 
     @staticmethod
-    def get_from_uplink(key='update'):
-        return MessageQueueWrapperForMQTT.message_queue.get_from_uplink(key)
+    def get_from_uplink(key='update', timeout=None):
+        return MessageQueueWrapperForMQTT.message_queue.get_from_uplink(key, timeout)
 
     @staticmethod
     def put_into_uplink(item, key='update'):
@@ -351,6 +438,24 @@ class MessageQueueWrapperForMQTT:
                                                       pickle.dumps((key, item)))
         return MessageQueueWrapperForMQTT.message_queue.put_into_downlink(client_id, key, item)
 
+    @staticmethod
+    def put_model_snapshot(version, weights):
+        if 'model_snapshot' not in MessageQueueWrapperForMQTT.mask_list:
+            MessageQueueWrapperForMQTT.client.publish(f'{MessageQueueWrapperForMQTT.uid}/mq/model_snapshot',
+                                                      pickle.dumps((version, weights)))
+        return MessageQueueWrapperForMQTT.message_queue.put_model_snapshot(version, weights)
+
+    @staticmethod
+    def get_model_snapshot(version):
+        return MessageQueueWrapperForMQTT.message_queue.get_model_snapshot(version)
+
+    @staticmethod
+    def del_model_snapshot(version):
+        if 'model_snapshot' not in MessageQueueWrapperForMQTT.mask_list:
+            MessageQueueWrapperForMQTT.client.publish(f'{MessageQueueWrapperForMQTT.uid}/mq/model_snapshot',
+                                                      pickle.dumps((version, None)))
+        return MessageQueueWrapperForMQTT.message_queue.del_model_snapshot(version)
+
     @staticmethod
     def uplink_empty(key='update'):
         return MessageQueueWrapperForMQTT.message_queue.uplink_empty(key)
@@ -370,6 +475,38 @@ class MessageQueueWrapperForMQTT:
     def get_training_status():
         return MessageQueueWrapperForMQTT.message_queue.get_training_status()
 
+    @staticmethod
+    def register_clients(client_ids):
+        return MessageQueueWrapperForMQTT.message_queue.register_clients(client_ids)
+
+    @staticmethod
+    def idle_client_num():
+        return MessageQueueWrapperForMQTT.message_queue.idle_client_num()
+
+    @staticmethod
+    def wait_idle_clients(count, timeout=None):
+        return MessageQueueWrapperForMQTT.message_queue.wait_idle_clients(count, timeout)
+
+    @staticmethod
+    def get_idle_clients(positions):
+        return MessageQueueWrapperForMQTT.message_queue.get_idle_clients(positions)
+
+    @staticmethod
+    def filter_idle_clients(client_ids):
+        return MessageQueueWrapperForMQTT.message_queue.filter_idle_clients(client_ids)
+
+    @staticmethod
+    def sample_idle_clients(ratio, state):
+        return MessageQueueWrapperForMQTT.message_queue.sample_idle_clients(ratio, state)
+
+    @staticmethod
+    def set_client_weights(weights):
+        return MessageQueueWrapperForMQTT.message_queue.set_client_weights(weights)
+
+    @staticmethod
+    def weighted_sample_idle_clients(draws):
+        return MessageQueueWrapperForMQTT.message_queue.weighted_sample_idle_clients(draws)
+
     @staticmethod
     def get_registered_client_num():
         return MessageQueueWrapperForMQTT.message_queue.get_registered_client_num()
@@ -433,15 +570,240 @@ class MessageQueueWrapperForMQTT:
         return MessageQueueWrapperForMQTT.message_queue.get_test_dataset()
 
 
+class MessageQueueWrapperForSharedMemory:
+    r"""
+    MessageQueueWrapperForSharedMemory is a transport backend for the process mode.
+    Tensors are packed into shared memory slabs and only small handles go through the SyncManager,
+    so the state_dict is neither pickled through the socket nor deep-copied by the manager.
+    Uplink slabs are released by the consumer once the update is materialized.
+    Downlink slabs are released by the producer once no client key refers to them any more.
+    """
+    message_queue = None
+    pool = None
+    pid = None
+    retry = 3
+    downlink_items = {}
+    model_snapshots = {}
+    latest_model = None
+    __lock = threading.Lock()
+
+    def __init__(self, main_process=False):
+        pass
+
+    def __new__(cls, *args, **kwargs):
+        with cls.__lock:
+            # the state is per process, since the slabs are owned by the process which creates them
+            if cls.pid != os.getpid():
+                config = GlobalVarGetter.get()['config']['global'].get('message_queue', {})
+                cls.message_queue = ManagerWrapper.get_manager(kwargs.get('main_process', False)).MessageQueue()
+                cls.pool = SlabPool.get_pool(config.get('min_slab_size', 1 << 20))
+                cls.retry = config.get('retry', 3)
+                cls.downlink_items = {}
+                cls.model_snapshots = {}
+                cls.latest_model = None
+                cls.pid = os.getpid()
+        return super().__new__(cls)
+
+    @staticmethod
+    def get_from_uplink(key='update', timeout=None):
+        item = MessageQueueWrapperForSharedMemory.message_queue.get_from_uplink(key, timeout)
+        return MessageQueueWrapperForSharedMemory.pool.unpack(item)
+
+    @staticmethod
+    def put_into_uplink(item, key='update'):
+        item = MessageQueueWrapperForSharedMemory.pool.pack(item)
+        return MessageQueueWrapperForSharedMemory.message_queue.put_into_uplink(item, key)
+
+    @staticmethod
+    def create_uplink(key, dtype=dict):
+        return MessageQueueWrapperForSharedMemory.message_queue.create_uplink(key, dtype)
+
+    @staticmethod
+    def create_downlink(key, dtype=dict):
+        return MessageQueueWrapperForSharedMemory.message_queue.create_downlink(key, dtype)
+
+    @staticmethod
+    def get_from_downlink(client_id, key):
+        cls = MessageQueueWrapperForSharedMemory
+        for _ in range(cls.retry):
+            item = cls.message_queue.get_from_downlink(client_id, key)
+            try:
+                return cls.pool.unpack(item)
+            except StaleSharedItemError:
+                # the slab has been reused by a newer item, fetch the handle again
+                continue
+        raise StaleSharedItemError(f'{key} of client {client_id}')
+
+    @staticmethod
+    def put_into_downlink(client_id, key, item):
+        cls = MessageQueueWrapperForSharedMemory
+        with cls.__lock:
+            item = cls.pool.pack(item, release=False)
+            items = cls.downlink_items.setdefault(key, {})
+            if client_id == 'all':
+                old_items = list(items.values())
+                items.clear()
+            else:
+                old_items = [items[client_id]] if client_id in items else []
+            items[client_id] = item
+            cls.message_queue.put_into_downlink(client_id, key, item)
+            cls.__release_unreferenced(old_items, items.values())
+
+    @staticmethod
+    def __release_unreferenced(old_items, live_items):
+        live = {(i.name, i.generation) for i in live_items if hasattr(i, 'generation')}
+        for i in old_items:
+            if hasattr(i, 'generation') and (i.name, i.generation) not in live:
+                MessageQueueWrapperForSharedMemory.pool.release(i)
+                live.add((i.name, i.generation))
+
+    @staticmethod
+    def put_model_snapshot(version, weights):
+        cls = MessageQueueWrapperForSharedMemory
+        with cls.__lock:
+            weights = cls.pool.pack(weights, release=False)
+            cls.model_snapshots[version] = weights
+            cls.message_queue.put_model_snapshot(version, weights)
+
+    @staticmethod
+    def get_model_snapshot(version):
+        cls = MessageQueueWrapperForSharedMemory
+        # an evicted snapshot may be reused by a newer one, in which case None is returned
+        try:
+            return cls.pool.unpack(cls.message_queue.get_model_snapshot(version))
+        except StaleSharedItemError:
+            return None
+
+    @staticmethod
+    def del_model_snapshot(version):
+        cls = MessageQueueWrapperForSharedMemory
+        with cls.__lock:
+            cls.message_queue.del_model_snapshot(version)
+            if version in cls.model_snapshots:
+                cls.pool.release(cls.model_snapshots.pop(version))
+
+    @staticmethod
+    def uplink_empty(key='update'):
+        return MessageQueueWrapperForSharedMemory.message_queue.uplink_empty(key)
+
+    @staticmethod
+    def downlink_empty(client_id, key):
+        return MessageQueueWrapperForSharedMemory.message_queue.downlink_empty(client_id, key)
+
+    @staticmethod
+    def set_training_status(client_id, value):
+        return MessageQueueWrapperForSharedMemory.message_queue.set_training_status(client_id, value)
+
+    @staticmethod
+    def get_training_status():
+        return MessageQueueWrapperForSharedMemory.message_queue.get_training_status()
+
+    @staticmethod
+    def register_clients(client_ids):
+        return MessageQueueWrapperForSharedMemory.message_queue.register_clients(client_ids)
+
+    @staticmethod
+    def idle_client_num():
+        return MessageQueueWrapperForSharedMemory.message_queue.idle_client_num()
+
+    @staticmethod
+    def wait_idle_clients(count, timeout=None):
+        return MessageQueueWrapperForSharedMemory.message_queue.wait_idle_clients(count, timeout)
+
+    @staticmethod
+    def get_idle_clients(positions):
+        return MessageQueueWrapperForSharedMemory.message_queue.get_idle_clients(positions)
+
+    @staticmethod
+    def filter_idle_clients(client_ids):
+        return MessageQueueWrapperForSharedMemory.message_queue.filter_idle_clients(client_ids)
+
+    @staticmethod
+    def sample_idle_clients(ratio, state):
+        return MessageQueueWrapperForSharedMemory.message_queue.sample_idle_clients(ratio, state)
+
+    @staticmethod
+    def set_client_weights(weights):
+        return MessageQueueWrapperForSharedMemory.message_queue.set_client_weights(weights)
+
+    @staticmethod
+    def weighted_sample_idle_clients(draws):
+        return MessageQueueWrapperForSharedMemory.message_queue.weighted_sample_idle_clients(draws)
+
+    @staticmethod
+    def get_registered_client_num():
+        return MessageQueueWrapperForSharedMemory.message_queue.get_registered_client_num()
+
+    @staticmethod
+    def get_training_client_num():
+        return MessageQueueWrapperForSharedMemory.message_queue.get_training_client_num()
+
+    @staticmethod
+    def set_config(config):
+        return MessageQueueWrapperForSharedMemory.message_queue.set_config(config)
+
+    @staticmethod
+    def set_config_by_key(k, v):
+        return MessageQueueWrapperForSharedMemory.message_queue.set_config_by_key(k, v)
+
+    @staticmethod
+    def get_config():
+        return MessageQueueWrapperForSharedMemory.message_queue.get_config()
+
+    @staticmethod
+    def get_config_by_key(key):
+        return MessageQueueWrapperForSharedMemory.message_queue.get_config_by_key(key)
+
+    @staticmethod
+    def set_latest_model(model, current_t):
+        cls = MessageQueueWrapperForSharedMemory
+        with cls.__lock:
+            model = cls.pool.pack(model, release=False)
+            cls.message_queue.set_latest_model(model, current_t)
+            if cls.latest_model is not None:
+                cls.__release_unreferenced([cls.latest_model], [model])
+            cls.latest_model = model
+
+    @staticmethod
+    def get_latest_model():
+        cls = MessageQueueWrapperForSharedMemory
+        for _ in range(cls.retry):
+            model, current_t = cls.message_queue.get_latest_model()
+            try:
+                return cls.pool.unpack(model), current_t
+            except StaleSharedItemError:
+                continue
+        raise StaleSharedItemError('latest_model')
+
+    @staticmethod
+    def set_train_dataset(train_dataset):
+        return MessageQueueWrapperForSharedMemory.message_queue.set_train_dataset(train_dataset)
+
+    @staticmethod
+    def get_train_dataset():
+        return MessageQueueWrapperForSharedMemory.message_queue.get_train_dataset()
+
+    @staticmethod
+    def set_test_dataset(test_dataset):
+        return MessageQueueWrapperForSharedMemory.message_queue.set_test_dataset(test_dataset)
+
+    @staticmethod
+    def get_test_dataset():
+        return MessageQueueWrapperForSharedMemory.message_queue.get_test_dataset()
+
+
 class MessageQueueFactory:
     @staticmethod
     def create_message_queue(main_process=False):
         config = GlobalVarGetter.get()['config']['global']
+        mode = running_mode_for_mq()
         if 'message_queue' in config:
             if 'type' in config['message_queue']:
                 if config['message_queue']['type'] == 'mqtt':
                     return MessageQueueWrapperForMQTT(main_process=main_process)
-        mode = running_mode_for_mq()
+                # shared memory only makes sense when the queue is proxied by the SyncManager
+                elif config['message_queue']['type'] == 'shm' and mode == 'process':
+                    return MessageQueueWrapperForSharedMemory(main_process=main_process)
         if mode == 'thread':
             return MessageQueue()
         elif mode == 'process':
@@ -0,0 +1,85 @@
+import threading
+
+import torch
+
+
+class ModelVersionStore:
+    r"""
+    ModelVersionStore keeps one immutable snapshot of the global model per version.
+    The version is advanced by every write of the global model (GlobalModelOptimization), not by current_t,
+    so different weights are never published under the same version.
+    The snapshot is published into the message queue once, and the downlink only carries the version id.
+    A snapshot is referenced by every client which is dispatched with it and has not uploaded yet,
+    and it is evicted as soon as it is neither the latest version nor referenced by any in-flight client.
+    The snapshots of the clients which never upload are freed by clear at the end of the run.
+    """
+
+    def __init__(self, message_queue):
+        self.message_queue = message_queue
+        self.lock = threading.Lock()
+        self.ref_count = {}
+        self.in_flight = {}
+        self.latest_version = None
+        self.model_version = 0
+
+    def advance(self):
+        """
+        Called after the global model is written, returns the version of the new weights.
+        """
+        with self.lock:
+            self.model_version += 1
+            return self.model_version
+
+    def current_version(self):
+        with self.lock:
+            return self.model_version
+
+    def publish(self, weights, version=None):
+        with self.lock:
+            if version is None:
+                version = self.model_version
+            if version not in self.ref_count:
+                # the snapshot must not alias the live model, which is updated in place
+                snapshot = {k: v.detach().to('cpu', copy=True) if isinstance(v, torch.Tensor) else v
+                            for k, v in weights.items()}
+                self.message_queue.put_model_snapshot(version, snapshot)
+                self.ref_count[version] = 0
+            previous_version, self.latest_version = self.latest_version, version
+            if previous_version != version:
+                self.__evict(previous_version)
+        return version
+
+    def acquire(self, client_id, version):
+        with self.lock:
+            old_version = self.in_flight.get(client_id)
+            self.in_flight[client_id] = version
+            self.ref_count[version] += 1
+            if old_version is not None:
+                self.ref_count[old_version] -= 1
+                self.__evict(old_version)
+
+    def release(self, client_id):
+        with self.lock:
+            version = self.in_flight.pop(client_id, None)
+            if version is not None:
+                self.ref_count[version] -= 1
+                self.__evict(version)
+
+    def clear(self):
+        with self.lock:
+            for version in list(self.ref_count):
+                self.message_queue.del_model_snapshot(version)
+            self.ref_count.clear()
+            self.in_flight.clear()
+            self.latest_version = None
+
+    def size(self):
+        with self.lock:
+            return len(self.ref_count)
+
+    def __evict(self, version):
+        if version is None or version == self.latest_version:
+            return
+        if self.ref_count.get(version, 1) <= 0:
+            self.ref_count.pop(version)
+            self.message_queue.del_model_snapshot(version)
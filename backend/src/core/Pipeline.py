@@ -0,0 +1,121 @@
+import queue
+import threading
+import time
+from collections import defaultdict, deque
+from contextlib import contextmanager
+
+
+class StageMeter:
+    r"""
+    The time a pipeline stage spends in each state:
+        busy: working on a round
+        starved: waiting for its input queue
+        blocked: waiting for the staleness window or for space in its output queue
+    The stage with the highest busy share is the bottleneck, the stages before it are blocked and the ones after
+    it are starved. A meter is only used by the thread of its stage.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.rounds = 0
+        self.times = {'busy': 0.0, 'starved': 0.0, 'blocked': 0.0}
+        self.start_time = None
+        self.end_time = None
+
+    def begin(self):
+        self.start_time = time.perf_counter()
+
+    def end(self):
+        self.end_time = time.perf_counter()
+
+    @contextmanager
+    def timing(self, state):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.times[state] += time.perf_counter() - start
+
+    def report(self):
+        if self.start_time is None:
+            return None
+        elapsed = max((self.end_time or time.perf_counter()) - self.start_time, 1e-9)
+        report = {'rounds': self.rounds, 'elapsed_s': elapsed}
+        for state, t in self.times.items():
+            report[f'{state}_s'] = t
+            report[state] = t / elapsed
+        return report
+
+
+class Pipeline:
+    r"""
+    The state shared by the stages of PipelineServer:
+        dispatch (scheduler thread) -> dispatched -> collect (collector thread) -> collected -> aggregate (updater)
+    Round t may be dispatched while at most staleness_window earlier rounds are not aggregated yet. The clients
+    of a round are idle when it is selected, so an update belongs to the oldest open round of its client.
+    """
+
+    def __init__(self, config):
+        self.window = config.get('staleness_window', 1)
+        size = config.get('queue_size', self.window + 1)
+        self.dispatched = queue.Queue(size)
+        self.collected = queue.Queue(size)
+        self.progress = threading.Condition()
+        self.meters = {name: StageMeter(name) for name in ('dispatch', 'collect', 'aggregate')}
+        # client id -> its updates which have arrived, oldest first
+        self.arrived = defaultdict(deque)
+        self.queue_manager = None
+        self.collector = threading.Thread(target=self.collect, daemon=True)
+
+    def start(self, queue_manager):
+        self.queue_manager = queue_manager
+        self.collector.start()
+
+    def wait_window(self, round_t, current_t):
+        """
+        Blocks until round_t is at most window rounds ahead of the aggregation, current_t is the next round to
+        aggregate.
+        """
+        with self.progress:
+            self.progress.wait_for(lambda: round_t <= current_t.get_time() + self.window)
+
+    def aggregated(self):
+        with self.progress:
+            self.progress.notify_all()
+
+    def collect(self):
+        meter = self.meters['collect']
+        meter.begin()
+        while True:
+            with meter.timing('starved'):
+                item = self.dispatched.get()
+            if item is None:
+                break
+            round_t, selected = item
+            with meter.timing('busy'):
+                update_list = self.receive(selected)
+            meter.rounds += 1
+            with meter.timing('blocked'):
+                self.collected.put((round_t, update_list))
+        meter.end()
+        self.collected.put(None)
+
+    def receive(self, selected):
+        queue_manager = self.queue_manager
+
+        def complete():
+            while not queue_manager.empty():
+                update = queue_manager.get()
+                self.arrived[update['client_id']].append(update)
+            return all(self.arrived[client_id] for client_id in selected)
+
+        queue_manager.receiver.wait_until(complete)
+        return [self.arrived[client_id].popleft() for client_id in selected]
+
+    def report(self):
+        reports = {name: meter.report() for name, meter in self.meters.items()}
+        print(f"{'stage':<12}{'rounds':>8}{'busy':>8}{'starved':>9}{'blocked':>9}")
+        for name, r in reports.items():
+            if r is not None:
+                print(f"{name:<12}{r['rounds']:>8}{r['busy']:>8.1%}{r['starved']:>9.1%}{r['blocked']:>9.1%}")
+        return reports
@@ -0,0 +1,262 @@
+import atexit
+import copy
+import os
+import threading
+from multiprocessing import resource_tracker
+from multiprocessing.shared_memory import SharedMemory
+
+import torch
+
+from utils.ParamVector import ParamVector
+
+_HEADER_SIZE = 64
+_ALIGN = 64
+
+
+def _align(n):
+    return (n + _ALIGN - 1) // _ALIGN * _ALIGN
+
+
+def _dtype_from_str(name):
+    return getattr(torch, name.split('.')[-1])
+
+
+class TensorHandle:
+    """
+    Placeholder of a tensor inside a shared item.
+    """
+    __slots__ = ('index',)
+
+    def __init__(self, index):
+        self.index = index
+
+    def __getstate__(self):
+        return self.index
+
+    def __setstate__(self, state):
+        self.index = state
+
+
+class SharedItem:
+    """
+    SharedItem is what actually goes through the message queue.
+    It only carries the skeleton of the original item and the location of its tensors.
+    layout: [(dtype, shape, offset, nbytes), ...]
+    """
+    __slots__ = ('skeleton', 'name', 'generation', 'layout', 'release')
+
+    def __init__(self, skeleton, name, generation, layout, release):
+        self.skeleton = skeleton
+        self.name = name
+        self.generation = generation
+        self.layout = layout
+        self.release = release
+
+    def __getstate__(self):
+        return self.skeleton, self.name, self.generation, self.layout, self.release
+
+    def __setstate__(self, state):
+        self.skeleton, self.name, self.generation, self.layout, self.release = state
+
+
+class StaleSharedItemError(Exception):
+    pass
+
+
+class Slab:
+    r"""
+    A shared memory segment with a small header.
+    header: [generation, busy]
+    The generation works as a seqlock: it is odd while the producer is writing and is bumped every time the slab is
+    reused, so that a reader holding an outdated handle can detect it.
+    """
+
+    def __init__(self, size=None, name=None):
+        if name is None:
+            self.shm = SharedMemory(create=True, size=size)
+            self.owner = True
+        else:
+            self.shm = SharedMemory(name=name)
+            self.owner = False
+            # the segment is owned by the producer, the reader should not unlink it at exit
+            try:
+                resource_tracker.unregister(self.shm._name, 'shared_memory')
+            except Exception:
+                pass
+        self.name = self.shm.name
+        self.capacity = self.shm.size - _HEADER_SIZE
+        self.header = torch.frombuffer(self.shm.buf, dtype=torch.int64, count=2)
+        self.body = torch.frombuffer(self.shm.buf, dtype=torch.uint8, offset=_HEADER_SIZE)
+        if self.owner:
+            self.header.zero_()
+
+    @property
+    def generation(self):
+        return int(self.header[0])
+
+    @property
+    def busy(self):
+        return bool(self.header[1])
+
+    def acquire(self):
+        self.header[1] = 1
+
+    def release(self):
+        self.header[1] = 0
+
+    def write(self, tensors):
+        layout = []
+        self.header[0] += 1
+        offset = 0
+        for t in tensors:
+            nbytes = t.numel() * t.element_size()
+            if nbytes:
+                self.body[offset:offset + nbytes].view(t.dtype).view(t.shape).copy_(t)
+            layout.append((str(t.dtype), tuple(t.shape), offset, nbytes))
+            offset = _align(offset + nbytes)
+        self.header[0] += 1
+        return self.generation, layout
+
+    def read(self, generation, layout):
+        if self.generation != generation:
+            raise StaleSharedItemError(self.name)
+        tensors = []
+        for dtype, shape, offset, nbytes in layout:
+            dtype = _dtype_from_str(dtype)
+            if nbytes:
+                t = self.body[offset:offset + nbytes].view(dtype).view(shape).clone()
+            else:
+                t = torch.empty(shape, dtype=dtype)
+            tensors.append(t)
+        if self.generation != generation:
+            raise StaleSharedItemError(self.name)
+        return tensors
+
+    def close(self):
+        del self.header
+        del self.body
+        self.shm.close()
+        if self.owner:
+            try:
+                self.shm.unlink()
+            except FileNotFoundError:
+                pass
+
+
+class SlabPool:
+    r"""
+    A per-process slab allocator.
+    Slabs created by this process are reused once they are released; the size of a slab is rounded up to a power
+    of two so that models of the same size always hit the same slab class.
+    Slabs created by other processes are attached lazily and cached.
+    """
+    _pools = {}
+    _pools_lock = threading.Lock()
+
+    def __init__(self, min_slab_size=1 << 20):
+        self.min_slab_size = min_slab_size
+        self.lock = threading.Lock()
+        self.own_slabs = []
+        self.attached_slabs = {}
+        atexit.register(self.close)
+
+    @staticmethod
+    def get_pool(min_slab_size=1 << 20):
+        pid = os.getpid()
+        with SlabPool._pools_lock:
+            if pid not in SlabPool._pools:
+                SlabPool._pools[pid] = SlabPool(min_slab_size)
+            return SlabPool._pools[pid]
+
+    def allocate(self, nbytes):
+        with self.lock:
+            for slab in self.own_slabs:
+                if not slab.busy and slab.capacity >= nbytes:
+                    slab.acquire()
+                    return slab
+            size = self.min_slab_size
+            while size - _HEADER_SIZE < nbytes:
+                size <<= 1
+            slab = Slab(size)
+            slab.acquire()
+            self.own_slabs.append(slab)
+            return slab
+
+    def attach(self, name):
+        with self.lock:
+            for slab in self.own_slabs:
+                if slab.name == name:
+                    return slab
+            if name not in self.attached_slabs:
+                self.attached_slabs[name] = Slab(name=name)
+            return self.attached_slabs[name]
+
+    def pack(self, item, release=True):
+        tensors = []
+        skeleton = _extract(item, tensors)
+        if not tensors:
+            return item
+        nbytes = sum(_align(t.numel() * t.element_size()) for t in tensors)
+        slab = self.allocate(nbytes)
+        generation, layout = slab.write(tensors)
+        return SharedItem(skeleton, slab.name, generation, layout, release)
+
+    def unpack(self, item):
+        if not isinstance(item, SharedItem):
+            return item
+        slab = self.attach(item.name)
+        tensors = slab.read(item.generation, item.layout)
+        if item.release:
+            slab.release()
+        return _restore(item.skeleton, tensors)
+
+    def release(self, item):
+        if isinstance(item, SharedItem):
+            self.attach(item.name).release()
+
+    def close(self):
+        with self.lock:
+            for slab in self.own_slabs:
+                slab.close()
+            for slab in self.attached_slabs.values():
+                slab.close()
+            self.own_slabs = []
+            self.attached_slabs = {}
+
+
+def _extract(item, tensors):
+    if isinstance(item, torch.Tensor):
+        tensors.append(item.detach().cpu().contiguous())
+        return TensorHandle(len(tensors) - 1)
+    elif isinstance(item, ParamVector):
+        # the packed vector is transferred as one tensor
+        return ParamVector(item.layout, _extract(item.data, tensors))
+    elif isinstance(item, dict):
+        skeleton = copy.copy(item)
+        for k, v in item.items():
+            skeleton[k] = _extract(v, tensors)
+        return skeleton
+    elif isinstance(item, list):
+        return [_extract(v, tensors) for v in item]
+    elif isinstance(item, tuple):
+        return tuple(_extract(v, tensors) for v in item)
+    else:
+        return item
+
+
+def _restore(skeleton, tensors):
+    if isinstance(skeleton, TensorHandle):
+        return tensors[skeleton.index]
+    elif isinstance(skeleton, ParamVector):
+        return ParamVector(skeleton.layout, _restore(skeleton.data, tensors))
+    elif isinstance(skeleton, dict):
+        item = copy.copy(skeleton)
+        for k, v in skeleton.items():
+            item[k] = _restore(v, tensors)
+        return item
+    elif isinstance(skeleton, list):
+        return [_restore(v, tensors) for v in skeleton]
+    elif isinstance(skeleton, tuple):
+        return tuple(_restore(v, tensors) for v in skeleton)
+    else:
+        return skeleton
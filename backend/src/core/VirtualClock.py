@@ -0,0 +1,96 @@
+import heapq
+import threading
+from collections import Counter
+
+
+class VirtualClock:
+    r"""
+    The clock of the discrete-event simulation mode (global.virtual_clock), not supported in process mode.
+    A client does not sleep for its delay: it registers its completion at now + delay and waits until the clock
+    releases it. Training runs back-to-back at full speed, and the clock only advances when the server is waiting
+    for updates, every dispatched client has registered its completion and the last released update has arrived.
+    So the arrival order only depends on the simulated timestamps, ties are broken by client id.
+    The clients are tracked by id: a dispatched client which uploads without going through the clock (e.g.
+    ActiveClient, which sleeps for its own delay) is settled by its upload, and the uploads of clients which were
+    not dispatched do not count.
+    """
+
+    def __init__(self, poll_interval=0.1):
+        self.condition = threading.Condition()
+        self.poll_interval = poll_interval
+        self.time = 0.0
+        # (completion time, client id, callback)
+        self.events = []
+        # client id -> dispatches which have not registered their completion yet
+        self.pending = Counter()
+        # client id -> released updates which have not reached the queue manager yet
+        self.in_flight = Counter()
+        self.stopped = False
+
+    def now(self):
+        with self.condition:
+            return self.time
+
+    def dispatch(self, client_ids):
+        with self.condition:
+            self.pending.update(client_ids)
+
+    def sleep(self, client_id, delay):
+        event = threading.Event()
+        if self.schedule(client_id, delay, event.set):
+            event.wait()
+
+    def schedule(self, client_id, delay, callback):
+        """
+        Registers the completion of a dispatched client, callback is called when the clock releases it.
+        """
+        with self.condition:
+            if self.stopped:
+                return False
+            heapq.heappush(self.events, (self.time + delay, client_id, callback))
+            self.__settle(self.pending, client_id)
+            self.condition.notify_all()
+        return True
+
+    def arrive(self, client_id):
+        """
+        Called for every update which reaches the queue manager.
+        """
+        with self.condition:
+            if self.__settle(self.in_flight, client_id) or self.__settle(self.pending, client_id):
+                self.condition.notify_all()
+
+    @staticmethod
+    def __settle(counter, client_id):
+        if counter[client_id] <= 0:
+            return False
+        counter[client_id] -= 1
+        if counter[client_id] == 0:
+            del counter[client_id]
+        return True
+
+    def advance(self, predicate):
+        """
+        Called by the waiting server. Returns True once predicate holds, otherwise releases the next client in
+        virtual time order and returns False.
+        """
+        with self.condition:
+            ready = lambda: self.stopped or (not self.pending and not self.in_flight and (self.events or predicate()))
+            while not ready():
+                # updates which do not go through the clock are still noticed
+                self.condition.wait(self.poll_interval)
+            if self.stopped or predicate():
+                return True
+            completion_time, client_id, callback = heapq.heappop(self.events)
+            self.time = max(self.time, completion_time)
+            self.in_flight[client_id] += 1
+        callback()
+        return False
+
+    def stop(self):
+        with self.condition:
+            self.stopped = True
+            events, self.events = self.events, []
+            self.condition.notify_all()
+        for _, _, callback in events:
+            callback()
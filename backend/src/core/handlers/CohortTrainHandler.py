@@ -0,0 +1,122 @@
+import torch
+from torch.func import functional_call, grad, vmap
+
+from core.handlers.Handler import Handler
+from core.handlers.ModelTrainHandler import ClientTrainHandler
+
+
+class CohortTrainHandler(Handler):
+    r"""
+    Takes the place of ClientTrainHandler for the clients trained as a cohort.
+    While collecting, it keeps the request and ends the chain there, the cohort worker trains all the collected
+    clients at once and resumes every chain from the next handler. Otherwise it trains the client as usual.
+    """
+
+    def __init__(self, handler=None):
+        super().__init__(handler)
+        self.train_handler = ClientTrainHandler()
+        self.collecting = False
+        self.request = None
+
+    def handle(self, request):
+        if self.collecting:
+            self.request = request
+            return request
+        return super().handle(request)
+
+    def _handle(self, request):
+        return self.train_handler.handle(request)
+
+    def take(self):
+        request, self.request = self.request, None
+        return request
+
+    def resume(self, request):
+        if self.next_handler is not None:
+            return self.next_handler.handle(request)
+        return request
+
+
+def CohortTrain(model, loss_func, params_list, momentum_list, train_dls, epoch, dev, sgd_config, mu=0):
+    """
+    Runs the local SGD of several clients in lockstep: the parameters of the clients are stacked and every step
+    is one vmap over the clients. Every client iterates its own train_dl, a client whose loader is exhausted keeps
+    its parameters until the others finish the epoch, so each client takes the same steps as BasicTrain.
+    sgd_config is the param group of a torch.optim.SGD, momentum_list holds the momentum buffers by name (or None).
+    Returns [(data_sum, params, momentum)] per client.
+    """
+    m = len(params_list)
+    trainable = [n for n, p in model.named_parameters() if p.requires_grad]
+    params = {n: torch.stack([p[n] for p in params_list]).to(dev) for n in trainable}
+    frozen = {n: torch.stack([p[n] for p in params_list]).to(dev) for n in params_list[0] if n not in params}
+    initial = {n: v.clone() for n, v in params.items()} if mu != 0 else None
+    buffers, has_buffer = {}, {}
+    for n, v in params.items():
+        bufs = [momentum[n] if momentum.get(n) is not None else None for momentum in momentum_list]
+        buffers[n] = torch.stack([b.to(dev) if b is not None else torch.zeros_like(v[0]) for b in bufs])
+        has_buffer[n] = torch.tensor([b is not None for b in bufs], device=dev)
+
+    def compute_loss(p, f, p0, data, label):
+        preds = functional_call(model, {**p, **f}, (data,))
+        loss = loss_func(preds, label)
+        if mu != 0:
+            proximal_term = 0.0
+            for k in p:
+                proximal_term += (p[k] - p0[k]).norm(2)
+            loss = loss + (mu / 2) * proximal_term
+        return loss
+
+    step_grad = vmap(grad(compute_loss), in_dims=(0, 0, 0 if initial is not None else None, 0, 0),
+                     randomness='different')
+    model.train()
+    data_sum = [0] * m
+    for _ in range(epoch):
+        iters = [iter(dl) for dl in train_dls]
+        while True:
+            batches = []
+            for i, it in enumerate(iters):
+                batch = next(it, None) if it is not None else None
+                if batch is None:
+                    iters[i] = None
+                batches.append(batch)
+            active = [b is not None for b in batches]
+            if not any(active):
+                break
+            # the exhausted clients compute on a borrowed batch, their step is masked out
+            template = next(b for b in batches if b is not None)
+            data = torch.stack([(b if b is not None else template)[0] for b in batches]).to(dev)
+            label = torch.stack([(b if b is not None else template)[1] for b in batches]).to(dev)
+            for i, b in enumerate(batches):
+                if b is not None:
+                    data_sum[i] += b[1].size(0)
+            grads = step_grad(params, frozen, initial, data, label)
+            sgd_step(params, grads, buffers, has_buffer, torch.tensor(active, device=dev), sgd_config)
+
+    results = []
+    for i in range(m):
+        weights = {n: v[i] for n, v in frozen.items()}
+        weights.update({n: v[i] for n, v in params.items()})
+        momentum = {n: buffers[n][i] if has_buffer[n][i] else None for n in params}
+        results.append((data_sum[i], weights, momentum))
+    return results
+
+
+def sgd_step(params, grads, buffers, has_buffer, active, group):
+    """
+    The update of torch.optim.SGD on the stacked parameters, only applied to the active clients.
+    """
+    lr, momentum, dampening = group['lr'], group.get('momentum', 0), group.get('dampening', 0)
+    weight_decay, nesterov, maximize = group.get('weight_decay', 0), group.get('nesterov', False), \
+        group.get('maximize', False)
+    for n, p in params.items():
+        mask = active.view(-1, *([1] * (p.dim() - 1)))
+        d_p = -grads[n] if maximize else grads[n]
+        if weight_decay != 0:
+            d_p = d_p.add(p, alpha=weight_decay)
+        if momentum != 0:
+            has = has_buffer[n].view(-1, *([1] * (p.dim() - 1)))
+            buf = torch.where(has, torch.add(buffers[n] * momentum, d_p, alpha=1 - dampening), d_p)
+            buffers[n] = torch.where(mask, buf, buffers[n])
+            has_buffer[n] = has_buffer[n] | active
+            d_p = d_p.add(buf, alpha=momentum) if nesterov else buf
+        params[n] = torch.where(mask, p.add(d_p, alpha=-lr), p)
@@ -2,6 +2,8 @@ import warnings
 from abc import abstractmethod, ABC
 from typing import Optional
 
+from core.handlers.HandlerProfiler import HandlerProfiler
+
 
 def _function_wrapper(handler):
     if callable(handler):
@@ -11,6 +13,9 @@ def _function_wrapper(handler):
     return new_handler
 
 
+_CALL, _FILTER, _BRANCH, _HANDLE = 'call', 'filter', 'branch', 'handle'
+
+
 class Handler:
     """抽象处理程序"""
 
@@ -39,11 +44,16 @@ class Handler:
     def _handle(self, request):
         pass
 
+    def _run(self, request):
+        profiler = HandlerProfiler.active
+        return self._handle(request) if profiler is None else profiler.call(self, request)
+
     def handle(self, request):
         if not self.has_run:
             self.run_once(request)
             self.has_run = True
-        response = self._handle(request)
+        profiler = HandlerProfiler.active
+        response = self._handle(request) if profiler is None else profiler.call(self, request)
         if self.next_handler:
             return self.next_handler.handle(response)
         return response
@@ -75,20 +85,42 @@ class Filter(Handler, ABC):
         super().insert_next(handler)
 
     def handle(self, request):
-        if self._handle(request):
-            self.next_handler = self.real_next
-            return request
-        else:
-            self.next_handler = None
-            return request
+        # next_handler is not changed, so a filter may run in several threads
+        if self._run(request) and self.real_next is not None:
+            return self.real_next.handle(request)
+        return request
 
 
 class HandlerChain(Handler):
+    # the handlers inside are profiled as part of this chain
+    profile_scope = True
+
     def __init__(self, chain=None):
         super().__init__()
         self._head = chain
+        self._program = None
+
+    def invalidate(self):
+        self._program = None
+
+    def compile(self):
+        """
+        Flattens the chain into a tuple of steps (kind, handler, bound method, target), executed by a loop in
+        _handle, which runs the same handlers as following next_handler does:
+        - _CALL runs a plain handler, a FunctionHandler around a plain handler (as added by add_handler_*) is
+          replaced by the handler. A nested HandlerChain is one step running its own program.
+        - _FILTER runs Filter._run, the chain goes on with real_next if it passes and ends otherwise. A Filter
+          wrapped by add_handler_* never ends the chain, as before.
+        - _BRANCH runs TreeFilter._run and ends with the precompiled program of the chosen child.
+        - _HANDLE calls handle of any other handler which overrides it, which decides itself how the chain goes on.
+        The program is rebuilt after the chain is edited by its own methods (add_handler_*, exchange_handler,
+        remove_handler, set_chain), relinking the handlers otherwise needs invalidate().
+        """
+        self._program = _compile(self._head)
+        return self._program
 
     def add_handler_after(self, handler, target_cls):
+        self._program = None
         handler = _function_wrapper(handler)
 
         if self._head is None:
@@ -103,6 +135,7 @@ class HandlerChain(Handler):
                 it = it.next_handler
 
     def add_handler_before(self, handler, target_cls):
+        self._program = None
         handler = _function_wrapper(handler)
 
         if self._head is None:
@@ -122,6 +155,7 @@ class HandlerChain(Handler):
                     it = it.next_handler
 
     def exchange_handler(self, handler, target_cls):
+        self._program = None
         handler = _function_wrapper(handler)
         if self._head is None:
             warnings.warn("The head is None, the handler will be set as the head.")
@@ -140,6 +174,7 @@ class HandlerChain(Handler):
                     it = it.next_handler
 
     def remove_handler(self, target_cls):
+        self._program = None
         if self._head is None:
             warnings.warn("The head is None, the handler will be set as the head.")
         else:
@@ -154,6 +189,7 @@ class HandlerChain(Handler):
                     it = it.next_handler
 
     def add_handler(self, handler):
+        self._program = None
         handler = _function_wrapper(handler)
         if self._head is None:
             self._head = handler
@@ -164,12 +200,14 @@ class HandlerChain(Handler):
             it.next_handler = handler
 
     def _handle(self, request):
-        if self._head is None:
-            return request
-        return self._head.handle(request)
+        program = self._program
+        if program is None:
+            program = self.compile()
+        return _execute(program, request)
 
     def set_chain(self, handler) -> "Handler":
         self._head = handler
+        self._program = None
         return handler
 
 
@@ -182,6 +220,66 @@ class TreeFilter(Handler, ABC):
         self.children.append(child)
 
     def handle(self, request):
-        res = self._handle(request)
+        res = self._run(request)
         return self.children[res].handle(request)
 
+
+def _is_plain(handler):
+    # a handler whose handle only runs _handle and goes on with next_handler
+    return isinstance(handler, Handler) and type(handler).handle is Handler.handle
+
+
+def _is_own(handler, cls):
+    # a Filter or TreeFilter which keeps the handle of the base class
+    return isinstance(handler, cls) and type(handler).handle is cls.handle
+
+
+def _compile(head):
+    program = []
+    it = head
+    while it is not None:
+        node = it
+        func = getattr(node, 'handle_func', None)
+        if isinstance(node, FunctionHandler) and _is_plain(func) and func.next_handler is None:
+            node = func
+        if isinstance(node, FunctionHandler) and _is_own(func, Filter) and func.real_next is None:
+            # the result of a wrapped filter is ignored, the chain goes on after the FunctionHandler
+            program.append((_FILTER, func, func._run, False))
+        elif _is_own(node, Filter):
+            program.append((_FILTER, node, node._run, True))
+            # real_next is the handler after the filter, even if next_handler was changed
+            it = node.real_next
+            continue
+        elif _is_own(node, TreeFilter):
+            program.append((_BRANCH, node, node._run, tuple(_compile(child) for child in node.children)))
+            break
+        elif not _is_plain(node):
+            program.append((_HANDLE, node, node.handle, None))
+            break
+        else:
+            program.append((_CALL, node, node._handle, None))
+        it = it.next_handler
+    return tuple(program)
+
+
+def _execute(program, request):
+    profiler = HandlerProfiler.active
+    response = request
+    for kind, node, func, target in program:
+        if kind is _CALL:
+            if not node.has_run:
+                node.run_once(response)
+                node.has_run = True
+            response = func(response) if profiler is None else profiler.call(node, response)
+        elif kind is _FILTER:
+            if not func(response) and target:
+                return response
+        elif kind is _BRANCH:
+            res = func(response)
+            if len(target) != len(node.children):
+                # a child was added after compiling
+                return node.children[res].handle(response)
+            return _execute(target[res], response)
+        else:
+            return func(response)
+    return response
@@ -0,0 +1,151 @@
+import collections
+import json
+import os
+import threading
+import time
+
+import torch
+
+
+class HandlerProfiler:
+    r"""
+    Records every Handler._handle call: the wall time and, on cuda, the GPU time (cuda events, read without
+    blocking once they have completed) and the change of the allocated memory. Calls are keyed by the chain they
+    run in, the handler class and the epoch of the request. The time of a HandlerChain includes its handlers.
+    Enabled by global.handler_profile, True or a dict:
+        cuda: record the cuda time and memory, default True when cuda is available
+        window: the number of latest calls per handler used for the percentiles, default 1000
+        max_events: the number of calls kept for the chrome trace, default 100000
+    When it is disabled, Handler.handle only checks HandlerProfiler.active.
+    """
+    active = None
+
+    def __init__(self, config):
+        self.cuda = config.get('cuda', True) and torch.cuda.is_available()
+        self.window = config.get('window', 1000)
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.events = collections.deque(maxlen=config.get('max_events', 100000))
+        self.windows = collections.defaultdict(lambda: collections.deque(maxlen=self.window))
+        self.rounds = collections.defaultdict(dict)
+        self.pending = collections.deque()
+        self.origin = time.perf_counter()
+
+    @staticmethod
+    def from_config(global_config):
+        config = global_config.get('handler_profile', False)
+        HandlerProfiler.active = HandlerProfiler(config if isinstance(config, dict) else {}) if config else None
+        return HandlerProfiler.active
+
+    def call(self, handler, request):
+        chains = getattr(self.local, 'chains', None)
+        if chains is None:
+            chains = self.local.chains = []
+        chain = chains[-1] if chains else '-'
+        func = getattr(handler, 'handle_func', None)
+        if func is not None and hasattr(func, '_handle'):
+            # the FunctionHandler added around a handler, the handler records itself
+            return handler._handle(request)
+        name = type(handler).__name__ if func is None else getattr(func, '__name__', type(func).__name__)
+        scope = getattr(handler, 'profile_scope', False)
+        if scope:
+            if name == 'HandlerChain' and not chains:
+                # a plain top level chain is named after its thread (scheduler, updater, client)
+                name = type(threading.current_thread()).__name__
+            chains.append(name)
+        if self.cuda:
+            start_event, end_event = torch.cuda.Event(enable_timing=True), torch.cuda.Event(enable_timing=True)
+            allocated = torch.cuda.memory_allocated()
+            start_event.record()
+        start = time.perf_counter()
+        try:
+            return handler._handle(request)
+        finally:
+            end = time.perf_counter()
+            if scope:
+                chains.pop()
+            epoch = request.get('epoch') if isinstance(request, dict) else None
+            alloc = 0
+            cuda_events = None
+            if self.cuda:
+                end_event.record()
+                alloc = torch.cuda.memory_allocated() - allocated
+                cuda_events = (start_event, end_event)
+            self.record(chain, name, epoch, start, end, alloc, cuda_events)
+
+    def record(self, chain, name, epoch, start, end, alloc, cuda_events):
+        key = f'{chain}/{name}'
+        wall_ms = (end - start) * 1000
+        event = {'name': name, 'cat': chain, 'ph': 'X', 'ts': (start - self.origin) * 1e6, 'dur': wall_ms * 1000,
+                 'pid': os.getpid(), 'tid': threading.get_ident(),
+                 'args': {'epoch': epoch, 'alloc_bytes': alloc}}
+        with self.lock:
+            self.events.append(event)
+            self.windows[key].append(wall_ms)
+            entry = self.rounds[epoch].get(key)
+            if entry is None:
+                entry = self.rounds[epoch][key] = {'calls': 0, 'wall_ms': 0.0, 'cuda_ms': 0.0, 'alloc_bytes': 0}
+            entry['calls'] += 1
+            entry['wall_ms'] += wall_ms
+            entry['alloc_bytes'] += alloc
+            if cuda_events is not None:
+                self.pending.append((entry, event, cuda_events))
+                self.resolve(block=False)
+
+    def resolve(self, block=True):
+        # the caller holds the lock
+        while self.pending:
+            entry, event, (start_event, end_event) = self.pending[0]
+            if not block and not end_event.query():
+                break
+            end_event.synchronize()
+            cuda_ms = start_event.elapsed_time(end_event)
+            entry['cuda_ms'] += cuda_ms
+            event['args']['cuda_ms'] = cuda_ms
+            self.pending.popleft()
+
+    def breakdown(self):
+        """
+        {epoch: {chain/handler: {calls, wall_ms, cuda_ms, alloc_bytes}}}
+        """
+        with self.lock:
+            self.resolve()
+            return {str(epoch): {k: dict(v) for k, v in entries.items()} for epoch, entries in self.rounds.items()}
+
+    def summary(self):
+        """
+        Percentiles of the wall time (ms) over the latest window calls of every chain/handler.
+        """
+        with self.lock:
+            windows = {k: sorted(v) for k, v in self.windows.items()}
+        result = {}
+        for key, values in windows.items():
+            if not values:
+                continue
+            percentile = lambda q: values[min(len(values) - 1, int(q * len(values)))]
+            result[key] = {'count': len(values), 'mean_ms': sum(values) / len(values), 'p50_ms': percentile(0.5),
+                           'p90_ms': percentile(0.9), 'p99_ms': percentile(0.99), 'max_ms': values[-1]}
+        return result
+
+    def chrome_trace(self):
+        with self.lock:
+            self.resolve()
+            return {'traceEvents': list(self.events), 'displayTimeUnit': 'ms'}
+
+    def export(self, path):
+        os.makedirs(path, exist_ok=True)
+        with open(os.path.join(path, 'handler_rounds.json'), 'w') as f:
+            json.dump(self.breakdown(), f, indent=4)
+        summary = self.summary()
+        with open(os.path.join(path, 'handler_summary.json'), 'w') as f:
+            json.dump(summary, f, indent=4)
+        with open(os.path.join(path, 'handler_trace.json'), 'w') as f:
+            json.dump(self.chrome_trace(), f)
+        self.print_summary(summary)
+
+    def print_summary(self, summary=None):
+        summary = self.summary() if summary is None else summary
+        print(f"{'handler':<60}{'count':>8}{'mean':>10}{'p50':>10}{'p90':>10}{'p99':>10}")
+        for key, s in sorted(summary.items(), key=lambda kv: -kv[1]['mean_ms'] * kv[1]['count']):
+            print(f"{key:<60}{s['count']:>8}{s['mean_ms']:>10.2f}{s['p50_ms']:>10.2f}{s['p90_ms']:>10.2f}"
+                  f"{s['p99_ms']:>10.2f}")
@@ -4,6 +4,7 @@ import numpy as np
 import torch
 import wandb
 
+from core.AsyncEvaluator import AsyncEvaluator
 from core.handlers.Handler import Handler
 from utils import ModuleFindTool
 from utils.GlobalVarGetter import GlobalVarGetter
@@ -69,9 +70,19 @@ class ClientPostTestHandler(Handler):
 
 
 class ServerTestHandler(Handler):
+    def __init__(self):
+        super().__init__()
+        global_var = GlobalVarGetter.get()
+        updater_config = global_var['config']['server']['updater']
+        self.test_every = updater_config.get('test_every', 1)
+        # async_test: 在独立线程上测试全局模型快照, 见AsyncEvaluator
+        self.async_config = updater_config.get('async_test', False)
+
     def _handle(self, request):
         updater = request.get('updater')
         epoch = request.get('epoch')
+        if epoch % self.test_every != 0:
+            return request
         config = updater.config
         if 'test' in config:
             test_func = ModuleFindTool.find_class_by_path(config['test'])
@@ -80,6 +91,13 @@ class ServerTestHandler(Handler):
             return request
         else:
             test_func = BasicTest
+        if self.async_config:
+            if updater.evaluator is None:
+                updater.evaluator = AsyncEvaluator(updater, test_func,
+                                                   self.async_config if isinstance(self.async_config, dict) else {})
+                updater.evaluator.start()
+            updater.evaluator.submit(epoch, updater.model)
+            return request
         request['test_res'] = test_func(updater.test_dl, updater.model, updater.loss_func, updater.dev, epoch, updater)
         return request
 
@@ -94,10 +112,18 @@ class ServerPostTestHandler(Handler):
         self.loss_list = []
 
     def _handle(self, request):
+        updater = request.get('updater')
+        if updater.evaluator is not None:
+            # the results of the async evaluator, in epoch order
+            for epoch, test_res in updater.evaluator.drain():
+                self.record(epoch, test_res)
         if 'test_res' not in request:
             return request
-        acc, loss = request.get('test_res')
-        epoch = request.get('epoch')
+        self.record(request.get('epoch'), request.get('test_res'))
+        return request
+
+    def record(self, epoch, test_res):
+        acc, loss = test_res
 
         # 处理并记录精度
         if isinstance(acc, dict):
@@ -129,11 +155,17 @@ class ServerPostTestHandler(Handler):
         self.accuracy_list.append(acc)
         self.loss_list.append(loss)
 
-        return request
+    def flush(self, updater):
+        if updater.evaluator is not None:
+            updater.evaluator.flush()
+            for epoch, test_res in updater.evaluator.drain():
+                self.record(epoch, test_res)
 
     def run_once(self, request):
+        updater = request.get('updater')
+        # the async results are recorded before they are saved
+        updater.add_final_callback(self.flush, updater)
         if self.file_enabled:
-            updater = request.get('updater')
             experiment = request.get('global_var')['config']['global']['experiment']
             path1 = os.path.join('../results', experiment, f'accuracy.txt')
             path2 = os.path.join('../results', experiment, f'loss.txt')
@@ -142,18 +174,8 @@ class ServerPostTestHandler(Handler):
 
 
 def BasicTest(test_dl, model, loss_func, dev, epoch, obj=None):
-    test_correct = 0
-    test_loss = 0
-    total_samples = 0  # 添加样本计数
-    with torch.no_grad():
-        for data in test_dl:
-            inputs, labels = data
-            inputs, labels = inputs.to(dev), labels.to(dev)
-            outputs = model(inputs)
-            _, id = torch.max(outputs.data, 1)
-            test_correct += torch.sum(id == labels.data).cpu().numpy()
-            test_loss += loss_func(outputs, labels).detach().item()
-            total_samples += labels.size(0)  # 累加每个批次的实际样本数
+    test_correct, total_samples, test_loss, _ = evaluate(test_dl, model, loss_func, dev,
+                                                         autocast=_autocast_enabled(obj))
     accuracy = (test_correct * 100) / total_samples
     loss = test_loss / len(test_dl)
     # 创建精度字典，与其他测试函数保持一致的格式
@@ -162,36 +184,17 @@ def BasicTest(test_dl, model, loss_func, dev, epoch, obj=None):
 
 
 def TestEachClass(test_dl, model, loss_func, dev, epoch, obj=None):
-    test_correct = 0
-    test_loss = 0
-    total_samples = 0  # 添加样本计数
-    num_classes = len(set(obj.test_ds.targets.data.numpy()))
-    class_accuracies = np.zeros(num_classes)
-    class_total = np.zeros(num_classes)
-    with torch.no_grad():
-        for data in test_dl:
-            inputs, labels = data
-            inputs, labels = inputs.to(dev), labels.to(dev)
-            outputs = model(inputs)
-            _, id = torch.max(outputs.data, 1)
-            test_loss += loss_func(outputs, labels).detach().item()
-            test_correct += torch.sum(id == labels.data).cpu().numpy()
-            c = (id == labels).squeeze()
-            for i in range(len(labels)):
-                label = labels[i]
-                class_accuracies[label] += c[i].item()
-                class_total[label] += 1
-            total_samples += labels.size(0)  # 累加每个批次的实际样本数
-        accuracy = test_correct / total_samples  # 使用总样本数
-        loss = test_loss / len(test_dl)
-
-        # 创建包含总精度和各类别精度的字典
-        accuracy_dict = {'total': float(accuracy) * 100}
-        for i in range(num_classes):
-            acc = class_accuracies[i] / class_total[i]
-            accuracy_dict[f'class_{i}'] = float(acc) * 100
-            print(f"acc on class {i}: {acc * 100:.2f}")
+    num_classes = len(np.unique(np.asarray(obj.test_ds.targets)))
+    test_correct, total_samples, test_loss, confusion = evaluate(test_dl, model, loss_func, dev, num_classes,
+                                                                 autocast=_autocast_enabled(obj))
+    accuracy = test_correct / total_samples  # 使用总样本数
+    loss = test_loss / len(test_dl)
 
+    # 创建包含总精度和各类别精度的字典
+    accuracy_dict = {'total': float(accuracy) * 100}
+    for i, acc in enumerate(_class_accuracies(confusion, num_classes)):
+        accuracy_dict[f'class_{i}'] = float(acc) * 100
+        print(f"acc on class {i}: {acc * 100:.2f}")
     return accuracy_dict, loss
 
 
@@ -203,8 +206,12 @@ def TestMultiTask(test_dl, model, loss_func, dev, epoch, obj=None):
     accuracy_dict = {}
     loss_dict = {}
 
+    # every task is tested on the same test_dl with the same model, so one pass serves all of them
+    metrics = None
     for task, task_list in enumerate(obj.test_index_list):
-        acc, loss = _sub_test_for_multi_task(test_dl, model, loss_func, dev, epoch, task, obj)
+        if metrics is None:
+            metrics = _multi_task_metrics(test_dl, model, loss_func, dev, obj)
+        acc, loss = _sub_test_for_multi_task(test_dl, epoch, task, metrics)
         accuracy_dict[f'task_{task}'] = float(acc)
         loss_dict[f'task_{task}'] = float(loss)
         avg_acc += acc / len(obj.test_index_list)
@@ -216,35 +223,81 @@ def TestMultiTask(test_dl, model, loss_func, dev, epoch, obj=None):
     return accuracy_dict, loss_dict
 
 
-def _sub_test_for_multi_task(test_dl, model, loss_func, dev, epoch, task, obj=None):
-    test_correct = 0
-    test_loss = 0
-    total_samples = 0  # 添加样本计数
-    classes = set(obj.test_ds.targets.data.numpy())
+def _multi_task_metrics(test_dl, model, loss_func, dev, obj):
+    classes = np.unique(np.asarray(obj.test_ds.targets))
+    label_lut = None
     if obj.label_mapping is not None:
-        num_classes = len(set(obj.label_mapping[i] for i in classes))
+        num_classes = len(set(obj.label_mapping[i] for i in classes.tolist()))
+        label_lut = label_lookup(obj.label_mapping)
     else:
-        num_classes = len(set(obj.test_ds.targets.data.numpy()))
-    class_accuracies = np.zeros(num_classes)
-    class_total = np.zeros(num_classes)
-    with torch.no_grad():
+        num_classes = len(classes)
+    return evaluate(test_dl, model, loss_func, dev, num_classes, label_lut, _autocast_enabled(obj)) + (num_classes,)
+
+
+def _sub_test_for_multi_task(test_dl, epoch, task, metrics):
+    test_correct, total_samples, test_loss, confusion, num_classes = metrics
+    accuracy = test_correct / total_samples  # 使用总样本数
+    loss = test_loss / len(test_dl)
+    print(f'Epoch(t): {epoch}-{task} accuracy: {accuracy * 100:.2f}{loss}')
+    for i, acc in enumerate(_class_accuracies(confusion, num_classes)):
+        print(f"acc on class {i}: {acc * 100:.2f}")
+    return accuracy * 100, loss
+
+
+def evaluate(test_dl, model, loss_func, dev, num_classes=None, label_lut=None, autocast=False):
+    """
+    Runs the model over test_dl in inference mode. The correct count, the loss sum and, if num_classes is given,
+    the confusion matrix (rows are labels, columns predictions, via bincount) are accumulated on the device and
+    read back once at the end.
+    label_lut maps the raw labels to the labels of the model, see label_lookup.
+    Returns (correct, total, loss_sum, confusion), confusion is a numpy array of num_classes rows or None.
+    """
+    correct = torch.zeros((), dtype=torch.long, device=dev)
+    # the batch losses are summed in float64 as the python floats were
+    loss_sum = torch.zeros((), dtype=torch.float64, device=dev)
+    confusion = None
+    width = None
+    total = 0
+    if label_lut is not None:
+        label_lut = label_lut.to(dev)
+    with torch.inference_mode(), torch.autocast(torch.device(dev).type, enabled=autocast):
         for inputs, labels in test_dl:
-            if obj.label_mapping is not None:
-                labels = torch.LongTensor([obj.label_mapping[i.item()] for i in labels])
             inputs, labels = inputs.to(dev), labels.to(dev)
+            if label_lut is not None:
+                labels = label_lut[labels]
             outputs = model(inputs)
-            _, id = torch.max(outputs.data, 1)
-            test_loss += loss_func(outputs, labels).detach().item()
-            test_correct += torch.sum(id == labels.data).cpu().numpy()
-            c = (id == labels).squeeze()
-            for i in range(len(labels)):
-                label = labels[i]
-                class_accuracies[label] += c[i].item()
-                class_total[label] += 1
-            total_samples += labels.size(0)  # 累加每个批次的实际样本数
-        accuracy = test_correct / total_samples  # 使用总样本数
-        loss = test_loss / len(test_dl)
-        print(f'Epoch(t): {epoch}-{task} accuracy: {accuracy * 100:.2f}{loss}')
-        for i in range(num_classes):
-            print(f"acc on class {i}: {class_accuracies[i] / class_total[i] * 100:.2f}")
-    return accuracy * 100, loss
+            _, predicted = torch.max(outputs, 1)
+            correct += torch.sum(predicted == labels)
+            loss_sum += loss_func(outputs, labels).detach().double()
+            total += labels.size(0)
+            if num_classes is not None:
+                if width is None:
+                    width = max(num_classes, outputs.size(1))
+                    confusion = torch.zeros(width * width, dtype=torch.long, device=dev)
+                confusion += torch.bincount(labels * width + predicted, minlength=width * width)
+    if confusion is not None:
+        confusion = confusion.cpu().numpy().reshape(width, width)[:num_classes]
+    return correct.item(), total, loss_sum.item(), confusion
+
+
+def label_lookup(label_mapping):
+    """
+    The label_mapping dict as a tensor indexed by the raw label.
+    """
+    keys = [int(k) for k in label_mapping]
+    lut = torch.full((max(keys) + 1,), -1, dtype=torch.long)
+    lut[torch.tensor(keys)] = torch.tensor([int(label_mapping[k]) for k in label_mapping])
+    return lut
+
+
+def _class_accuracies(confusion, num_classes):
+    if confusion is None:
+        return np.full(num_classes, np.nan)
+    confusion = confusion.astype(np.float64)
+    return np.diag(confusion) / confusion.sum(axis=1)
+
+
+def _autocast_enabled(obj):
+    # config.test_autocast: 测试时使用混合精度, 默认关闭以保持精度不变
+    config = getattr(obj, 'config', None)
+    return isinstance(config, dict) and config.get('test_autocast', False)
@@ -1,3 +1,4 @@
+from core.ClientRegistry import IdleClients
 from core.handlers.Handler import Handler
 from utils.Tools import to_dev, to_cpu
 
@@ -9,9 +10,13 @@ class ClientUpdateGetter(Handler):
         update_list = []
         global_var = request.get('global_var')
         queue_manager = global_var['queue_manager']
-        # receive all updates
-        while not queue_manager.empty():
-            update_list.append(queue_manager.get())
+        if queue_manager.stream is not None:
+            # the weights have been folded by the queue manager already
+            update_list, request['stream_acc'] = queue_manager.take_folded()
+        else:
+            # receive all updates
+            while not queue_manager.empty():
+                update_list.append(queue_manager.get())
         request['update_list'] = update_list
         return request
 
@@ -23,7 +28,8 @@ class Aggregation(Handler):
         update_list = request.get('update_list')
         updater = request.get('updater')
         epoch = request.get('epoch')
-        global_model, delivery_weights = updater.update_caller.update_server_weights(epoch, update_list)
+        global_model, delivery_weights = updater.update_caller.update_server_weights(epoch, update_list,
+                                                                                     request.get('stream_acc'))
         request['weights'] = global_model
         request['delivery_weights'] = delivery_weights
         global_var = request.get('global_var')
@@ -54,10 +60,17 @@ class GlobalModelOptimization(Handler):
         else:
             updater.model.load_state_dict(new_model)
         request['weights'] = to_cpu(updater.model.state_dict())
+        model_version_store = global_var.get('model_version_store')
+        if model_version_store is not None:
+            request['weights_version'] = model_version_store.advance()
         return request
 
 
 class ClientSelector(Handler):
+    def __init__(self):
+        super().__init__()
+        self.registered = []
+
     def _handle(self, request):
         global_var = request.get('global_var')
         scheduler = global_var['scheduler']
@@ -65,11 +78,12 @@ class ClientSelector(Handler):
         if hasattr(scheduler, 'client_select'):
             selected_clients = scheduler.client_select()
         else:
-            client_list = global_var['client_id_list']
-            training_status = scheduler.message_queue.get_training_status()
-            client_list = [client_id for client_id in client_list if
-                           client_id not in training_status or not training_status[client_id]]
-            selected_clients = scheduler.schedule_caller.schedule(client_list)
+            client_list = list(global_var['client_id_list'])
+            if client_list != self.registered:
+                # the list may be extended or replaced, the clients which have not reported a status yet are idle
+                scheduler.message_queue.register_clients(client_list)
+                self.registered = client_list
+            selected_clients = scheduler.schedule_caller.schedule(IdleClients(scheduler.message_queue))
         request['selected_clients'] = selected_clients
         global_var['selected_clients'] = selected_clients
         print(f"| current_epoch {epoch}, schedule_epoch {scheduler.schedule_t.get_time()} |")
@@ -93,7 +107,22 @@ class ContentDispatcher(Handler):
         delivery_weights = global_var['delivery_weights']
         updater = global_var['updater']
         weights = request.get('weights', updater.model.state_dict())
-        if delivery_weights is not None and len(delivery_weights) > 0:
+        model_version_store = global_var.get('model_version_store')
+        if model_version_store is not None:
+            # the snapshot is published once per version, clients only receive the version id
+            version = request.get('weights_version')
+            if version is None and 'weights' in request:
+                # weights of unknown origin get a version of their own
+                version = model_version_store.advance()
+            version = model_version_store.publish(weights, version)
+            for client_id in selected_clients:
+                if delivery_weights and client_id in delivery_weights:
+                    scheduler.download_item(client_id, 'weights', delivery_weights[client_id])
+                    scheduler.download_item(client_id, 'weights_version', None)
+                else:
+                    model_version_store.acquire(client_id, version)
+                    scheduler.download_item(client_id, 'weights_version', version)
+        elif delivery_weights is not None and len(delivery_weights) > 0:
             for client_id in selected_clients:
                 if client_id in delivery_weights:
                     scheduler.download_item(client_id, 'weights', delivery_weights[client_id])
@@ -106,6 +135,14 @@ class ContentDispatcher(Handler):
     @staticmethod
     def handle_selected_event(request, scheduler):
         selected_clients = request.get('selected_clients')
+        global_var = request.get('global_var')
+        # e.g. SpillingDataStore brings the state of the selected clients back before they run
+        data_proxy = global_var.get('data_proxy')
+        if data_proxy is not None and hasattr(data_proxy, 'prefetch'):
+            data_proxy.prefetch(selected_clients)
+        clock = global_var.get('virtual_clock')
+        if clock is not None:
+            clock.dispatch(selected_clients)
         for client_id in selected_clients:
             scheduler.selected_event_list[client_id].set()
 
@@ -2,8 +2,11 @@ import os
 
 import numpy as np
 
+from partitioner.StreamData import publish_label_mapping
 from utils import ModuleFindTool
+from utils.GlobalVarGetter import GlobalVarGetter
 from utils.IID import generate_data, print_dist
+from utils.PartitionCache import PartitionCache
 
 
 class BaseDataset:
@@ -30,8 +33,26 @@ class BaseDataset:
         self.test_data = test_dataset.data
 
         self.train_data_size = self.train_data.shape[0]
-        self.index_list = self.generate_data(clients, self.train_labels, train_dataset)
-        self.test_index_list = self.generate_data(1, self.test_labels,test_dataset, train=False)
+        cache = self.partition_cache(clients)
+        cached = cache.load() if cache is not None else None
+        if cached is None:
+            self.index_list = self.generate_data(clients, self.train_labels, train_dataset)
+            self.test_index_list = self.generate_data(1, self.test_labels,test_dataset, train=False)
+            if cache is not None:
+                cache.save(self.index_list, self.test_index_list, GlobalVarGetter.get().get('label_mapping'))
+        else:
+            self.index_list, self.test_index_list, label_mapping = cached
+            if label_mapping is not None:
+                publish_label_mapping(label_mapping, clients)
+
+    def partition_cache(self, clients):
+        # global.partition_cache: 划分结果的缓存目录
+        global_config = GlobalVarGetter.get().get('global_config', {})
+        if not global_config.get('partition_cache'):
+            return None
+        key = PartitionCache.key(global_config.get('dataset'), self.config, clients, global_config.get('seed'),
+                                 self.train_labels)
+        return PartitionCache(global_config['partition_cache'], key)
 
     def get_test_dataset(self):
         return self.test_dataset
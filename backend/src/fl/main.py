@@ -13,6 +13,7 @@ sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 from utils.GlobalVarGetter import GlobalVarGetter
 from core.MessageQueue import MessageQueueFactory
 from core.Runtime import running_mode
+from core.handlers.HandlerProfiler import HandlerProfiler
 from utils.Tools import *
 from utils import ModuleFindTool
 import argparse
@@ -131,6 +132,7 @@ def main():
                          'client_manager_config': client_manager_config,
                          'queue_manager_config': queue_manager_config})
     global_var = GlobalVarGetter.get()
+    HandlerProfiler.from_config(global_config)
     message_queue = MessageQueueFactory.create_message_queue(True)
     message_queue.set_config(global_var)
 
@@ -158,7 +160,7 @@ def main():
         dp_conf = config["data_proxy"]
         DataProxyClass = ModuleFindTool.find_class_by_path(dp_conf["path"])
         data_proxy = DataProxyClass(**dp_conf.get("params", {}))
-        GlobalVarGetter.set({"data_proxy": data_proxy})
+        global_var['data_proxy'] = data_proxy
 
     running_mode(config, output=True)
     client_manager_class = ModuleFindTool.find_class_by_path(client_manager_config["path"])
@@ -173,6 +175,13 @@ def main():
     client_manager.stop_all_clients()
     client_manager.client_join()
 
+    if HandlerProfiler.active is not None:
+        if is_cover:
+            HandlerProfiler.active.export(
+                os.path.join(os.path.dirname(os.path.abspath(__file__)), "../results/", global_config["experiment"]))
+        else:
+            HandlerProfiler.active.print_summary()
+
     del server
 
     print("Time used:")
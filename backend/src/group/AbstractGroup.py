@@ -9,3 +9,13 @@ class AbstractGroup:
     @abstractmethod
     def check_update(self, *args, **kwargs):
         pass
+
+    # regrouping in the background, only implemented by the groups which depend on the client updates
+    def record(self, update_list):
+        pass
+
+    def submit(self):
+        return False
+
+    def poll(self):
+        return None
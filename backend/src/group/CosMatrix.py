@@ -1,43 +1,122 @@
-import numpy as np
+import threading
+
 import torch
 from sklearn.cluster import KMeans
 
 from group.AbstractGroup import AbstractGroup
 from utils.GlobalVarGetter import GlobalVarGetter
+from utils.ParamVector import ParamVector
 
 
 class CosMatrix(AbstractGroup):
+    r"""
+    Groups the clients by the cosine similarity of their weights, every row of the similarity matrix is the feature
+    of one client.
+    config:
+        n: the number of groups
+        chunk_size: computes the gram matrix in column chunks of this size, None computes it at once
+        sketch_dim: compares random projections of this dimension instead of the full weights
+        record_dim: the dimension of the sketches kept for the regrouping, default sketch_dim or 256
+    The same grouping can run in the background: record() hands the latest weights of the clients to a thread,
+    which keeps a sketch of record_dim per client, submit() starts a regrouping without blocking the caller and
+    poll() returns its result once it is ready.
+    """
+
     def __init__(self, group_manager, config):
         self.group_manager = group_manager
         self.n = config["n"]
+        self.chunk_size = config.get("chunk_size", None)
+        self.sketch_dim = config.get("sketch_dim", None)
+        self.seed = config.get("seed", 0)
+        self.record_dim = config.get("record_dim", self.sketch_dim or 256)
         self.training_params = GlobalVarGetter.get()['training_params']
+        self.lock = threading.Lock()
+        self.latest = {}
+        self.worker = None
+        self.result = None
+        # client id -> weights waiting for the sketch thread, only the latest weights of a client are kept
+        self.pending = {}
+        self.recorder = None
 
     def group(self, client_list, latency_list, *args, **kwargs):
         if len(args) == 0:
             return [client_list], 1
-        weight_list = args[0]
-        weight_list = [update['weights'] for update in weight_list]
-        n = len(weight_list)
-        for i in range(n):
-            weight_list[i] = torch.cat([p.view(-1) for _, p in weight_list[i].items()])
-        sim_matrix = np.zeros((n, n))
-        for i in range(n):
-            sim_matrix[i, i] = 1.0
-            for j in range(i + 1, n):
-                sim = cos_sim(weight_list[i], weight_list[j])
-                sim_matrix[i, j] = sim
-                sim_matrix[j, i] = sim
-        X = sim_matrix.reshape(-1, 1)
-        # KMeans聚类
-        kmeans = KMeans(n_clusters=self.n)
-        kmeans.fit(X)
-        labels = kmeans.labels_
-        col_labels = labels % sim_matrix.shape[1]
-        groups = [[] for i in range(max(labels) + 1)]
-        for i in range(len(weight_list)):
-            groups[col_labels[i]].append(i)
+        update_list = args[0]
+        ids = [update.get('client_id', i) for i, update in enumerate(update_list)]
+        features = self.features([update['weights'] for update in update_list])
+        return self.cluster(ids, features)
+
+    def features(self, weight_list):
+        _, matrix = ParamVector.stack(weight_list)
+        if self.sketch_dim is not None:
+            matrix = sketch(matrix, self.sketch_dim, self.chunk_size, self.seed)
+        return matrix
+
+    def cluster(self, ids, features):
+        sim_matrix = cos_sim_matrix(features, self.chunk_size)
+        n_clusters = min(self.n, len(ids))
+        labels = KMeans(n_clusters=n_clusters, n_init="auto", random_state=0).fit_predict(sim_matrix.cpu().numpy())
+        groups = [[] for _ in range(n_clusters)]
+        for client_id, label in zip(ids, labels):
+            groups[label].append(client_id)
+        groups = [g for g in groups if g]
         return groups, len(groups)
 
+    def record(self, update_list):
+        """
+        Hands the latest weights of the clients to the sketch thread, it returns at once.
+        The updates whose weights were folded by the streaming aggregation are skipped.
+        """
+        with self.lock:
+            for update in update_list:
+                if 'weights' in update and 'client_id' in update:
+                    self.pending[update['client_id']] = update['weights']
+            if not self.pending:
+                return
+            if self.recorder is None or not self.recorder.is_alive():
+                self.recorder = threading.Thread(target=self.__record, daemon=True)
+                self.recorder.start()
+
+    def __record(self):
+        while True:
+            with self.lock:
+                if not self.pending:
+                    self.recorder = None
+                    return
+                client_id = next(iter(self.pending))
+                weights = self.pending.pop(client_id)
+            _, matrix = ParamVector.stack([weights])
+            del weights
+            feature = sketch(matrix, self.record_dim, self.chunk_size, self.seed)[0].cpu()
+            with self.lock:
+                self.latest[client_id] = feature
+
+    def submit(self):
+        """
+        Starts a regrouping over the recorded clients in the background, does nothing if one is still running.
+        """
+        with self.lock:
+            if (self.worker is not None and self.worker.is_alive()) or len(self.latest) < self.n:
+                return False
+            ids = list(self.latest.keys())
+            features = torch.stack([self.latest[i] for i in ids])
+            self.worker = threading.Thread(target=self.__regroup, args=(ids, features), daemon=True)
+            self.worker.start()
+            return True
+
+    def __regroup(self, ids, features):
+        result = self.cluster(ids, features)
+        with self.lock:
+            self.result = result
+
+    def poll(self):
+        """
+        Returns the groups of the last finished regrouping once, or None.
+        """
+        with self.lock:
+            result, self.result = self.result, None
+        return result
+
     def check_update(self):
         return
 
@@ -51,3 +130,36 @@ class CosMatrix(AbstractGroup):
 
 def cos_sim(a, b):
     return (a * b).sum() / (a.norm() * b.norm())
+
+
+def cos_sim_matrix(features, chunk_size=None):
+    """
+    Cosine similarity between the rows of features, as one normalized gram matrix.
+    """
+    if chunk_size is None:
+        features = features.double()
+        gram = features @ features.T
+    else:
+        gram = torch.zeros(features.shape[0], features.shape[0], dtype=torch.float64, device=features.device)
+        for start in range(0, features.shape[1], chunk_size):
+            chunk = features[:, start:start + chunk_size].double()
+            gram += chunk @ chunk.T
+    norms = gram.diagonal().clamp_min(1e-12).sqrt()
+    return gram / torch.outer(norms, norms)
+
+
+def sketch(features, dim, chunk_size=None, seed=0):
+    """
+    Gaussian random projection of the rows of features to dim dimensions, which approximately keeps their inner
+    products. The projection matrix is generated chunk by chunk from the seed and is never materialized at once.
+    """
+    n, size = features.shape
+    chunk_size = chunk_size if chunk_size is not None else max(1, (1 << 24) // dim)
+    result = torch.zeros(n, dim, dtype=features.dtype, device=features.device)
+    generator = torch.Generator(device='cpu')
+    for start in range(0, size, chunk_size):
+        chunk = features[:, start:start + chunk_size]
+        generator.manual_seed(seed * 1000003 + start)
+        projection = torch.randn(chunk.shape[1], dim, generator=generator, dtype=features.dtype)
+        result += chunk @ projection.to(features.device)
+    return result / dim ** 0.5
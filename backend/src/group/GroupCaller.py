@@ -13,3 +13,12 @@ class GroupCaller:
 
     def check_update(self, *args, **kwargs):
         return self.group_manager.group_method.check_update()
+
+    def record(self, update_list):
+        return self.group_manager.group_method.record(update_list)
+
+    def submit(self):
+        return self.group_manager.group_method.submit()
+
+    def poll(self):
+        return self.group_manager.group_method.poll()
@@ -17,3 +17,12 @@ class BaseGroupManager:
 
     def update(self, *args, **kwargs):
         pass
+
+    def record(self, *args, **kwargs):
+        pass
+
+    def submit(self, *args, **kwargs):
+        return False
+
+    def poll(self, *args, **kwargs):
+        return False
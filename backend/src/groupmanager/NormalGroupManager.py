@@ -1,3 +1,5 @@
+import threading
+
 from group.GroupCaller import GroupCaller
 from groupmanager.BaseGroupManager import BaseGroupManager
 from utils import ModuleFindTool
@@ -13,18 +15,47 @@ class NormalGroupManager(BaseGroupManager):
         self.group_method = ModuleFindTool.find_class_by_path(self.config["group_method"]["path"])(self, self.config[
             "group_method"]["params"])
         self.group_caller = GroupCaller(self)
+        # the scheduler swaps the groups while the updater reads them
+        self.lock = threading.Lock()
         self.group_list, self.group_num = self.group_caller.group(self.client_list, self.latency_list)
         self.epoch_list = [0] * len(self.client_list)
+        # regroup the clients in the background with their latest updates
+        self.regroup = self.config.get("regroup", False)
 
     def __group(self, client_list, latency_list, *args, **kwargs):
-        self.group_list, self.group_num = self.group_caller.group(client_list, latency_list, *args, **kwargs)
-        return self.group_list, self.group_num
+        group_list, group_num = self.group_caller.group(client_list, latency_list, *args, **kwargs)
+        with self.lock:
+            self.group_list, self.group_num = group_list, group_num
+        return group_list, group_num
 
     def get_group_num(self):
-        return self.group_num
+        with self.lock:
+            return self.group_num
 
     def get_group_list(self):
-        return self.group_list
+        with self.lock:
+            return self.group_list
 
     def update(self, *args, **kwargs):
         return self.__group(self.client_list, self.latency_list, *args, **kwargs)
+
+    def record(self, update_list):
+        if self.regroup:
+            self.group_caller.record(update_list)
+
+    def submit(self):
+        return self.regroup and self.group_caller.submit()
+
+    def poll(self):
+        """
+        Applies the result of a finished regrouping. The number of groups can not change while the groups are in
+        flight, so a result with another number of groups is dropped.
+        """
+        if not self.regroup:
+            return False
+        result = self.group_caller.poll()
+        with self.lock:
+            if result is None or result[1] != self.group_num:
+                return False
+            self.group_list, self.group_num = result
+        return True
@@ -1,6 +1,8 @@
 import random
 from collections import Counter
 
+import numpy as np
+
 from core.MessageQueue import MessageQueueFactory
 from partitioner.AbstractPartitioner import AbstractPartitioner
 from utils.GlobalVarGetter import GlobalVarGetter
@@ -48,8 +50,10 @@ class ClientTaskPartition(_StreamData):
         index_list_for_task = []
         for i in range(client_num):
             index_list_for_task.append([])
+            client_index = np.asarray(index_list[i], dtype=np.int64)
+            client_labels = labels[client_index]
             for j in range(task_num):
-                res = [index for index in index_list[i] if labels[index] in self.label_list[j]]
+                res = client_index[np.isin(client_labels, self.label_list[j])].tolist()
                 index_list_for_task[i].append(res)
         print_dist(index_list_for_task, labels)
         return index_list_for_task
@@ -73,10 +77,7 @@ class ClientTaskPartitionWithMapping(ClientTaskPartition):
     def generate_data(self, iid_config, labels, client_num, dataset):
         _StreamData.generate_data(self,iid_config, labels, client_num, dataset)
         index_list, label_mapping = self.generate_data_for_training(labels, client_num)
-        mq = MessageQueueFactory.create_message_queue()
-        for i in range(client_num):
-            mq.put_into_downlink(i, "label_mapping", label_mapping)
-        GlobalVarGetter.get()["label_mapping"] = label_mapping
+        publish_label_mapping(label_mapping, client_num)
         return index_list
 
     def generate_data_for_training(self, labels, client_num):
@@ -98,11 +99,11 @@ class TaskClientPartition(ClientTaskPartition):
         self.label_list = label_list_for_task
         index_label_list_for_task = []
         for label_list in label_list_for_task:
-            index_label_list_for_task.append([i for i, label in enumerate(labels) if label in label_list])
+            index_label_list_for_task.append(np.flatnonzero(np.isin(labels, label_list)))
         index_lists = [[] for _ in range(client_num)]
         for index_label_list in index_label_list_for_task:
             results = split_data(self.config['iid'], labels[index_label_list], client_num)
-            index_list = [[index_label_list[i] for i in result] for result in results]
+            index_list = [index_label_list[np.asarray(result, dtype=np.int64)].tolist() for result in results]
             for i in range(client_num):
                 index_lists[i].append(index_list[i])
         print_dist(index_lists, labels)
@@ -117,10 +118,7 @@ class TaskClientPartitionWithMapping(TaskClientPartition):
     def generate_data(self, iid_config, labels, client_num, dataset):
         _StreamData.generate_data(self, iid_config, labels, client_num, dataset)
         index_list, label_mapping = self.generate_data_for_training(labels, client_num)
-        mq = MessageQueueFactory.create_message_queue()
-        for i in range(client_num):
-            mq.put_into_downlink(i, "label_mapping", label_mapping)
-        GlobalVarGetter.get()["label_mapping"] = label_mapping
+        publish_label_mapping(label_mapping, client_num)
         return index_list
 
     def generate_data_for_training(self, labels, client_num):
@@ -133,6 +131,13 @@ class TaskClientPartitionWithMapping(TaskClientPartition):
         return index_list_for_task
 
 
+def publish_label_mapping(label_mapping, client_num):
+    mq = MessageQueueFactory.create_message_queue()
+    for i in range(client_num):
+        mq.put_into_downlink(i, "label_mapping", label_mapping)
+    GlobalVarGetter.get()["label_mapping"] = label_mapping
+
+
 def split_list(rsc, sublist_length, sublist_num, is_sort=True, allow_duplicates=False):
     if is_sort:
         rsc = sorted(rsc)
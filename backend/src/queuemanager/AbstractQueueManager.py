@@ -34,6 +34,10 @@ class AbstractQueueManager(metaclass=Meta):
     def receive(self, *args, **kwargs):
         pass
 
+    @abstractmethod
+    def wait_for(self, n, timeout=None, *args, **kwargs):
+        pass
+
     @abstractmethod
     def check(self, *args, **kwargs):
         pass
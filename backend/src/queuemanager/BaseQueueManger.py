@@ -14,9 +14,13 @@ class BaseQueueManager(AbstractQueueManager):
         self.global_var = GlobalVarGetter.get()
         self.pre_queue = None
         self.lock = threading.Lock()
+        # notified every time the queue changes, receivers wait on it instead of polling
+        self.condition = threading.Condition(self.lock)
         self.queue = Queue()
         self.receiver = None
         self.checker = None
+        # StreamAggregator, set by the updater when streaming aggregation is enabled
+        self.stream = None
 
     # Automatically triggered when new data is uploaded
     @abstractmethod
@@ -36,9 +40,48 @@ class BaseQueueManager(AbstractQueueManager):
         pass
 
     def set(self, *args, **kwargs):
-        self.lock.acquire()
-        self.queue = self.pre_queue
-        self.lock.release()
+        with self.condition:
+            self.queue = self.pre_queue
+            self.condition.notify_all()
+
+    def wait_for(self, n, timeout=None, *args, **kwargs):
+        """
+        Blocks until at least n updates are in the queue.
+        Returns False if the timeout expires first.
+        """
+        return self.wait_until(lambda: self.size(*args, **kwargs) >= n, timeout)
+
+    def wait_until(self, predicate, timeout=None):
+        with self.condition:
+            return self.condition.wait_for(predicate, timeout)
+
+    def notify(self):
+        with self.condition:
+            self.condition.notify_all()
+
+    def set_stream(self, stream):
+        with self.lock:
+            self.stream = stream
+
+    def fold(self, update):
+        """
+        Folds an accepted update into the stream aggregator and returns it without weights.
+        Must be called under self.lock.
+        """
+        if self.stream is None:
+            return update
+        return self.stream.fold(update)
+
+    def take_folded(self, nums=None, *args, **kwargs):
+        """
+        Takes nums updates (all if None) and the accumulator of their weights at once.
+        """
+        update_list = []
+        with self.lock:
+            while not self.empty(*args, **kwargs) and (nums is None or len(update_list) < nums):
+                update_list.append(self.get(*args, **kwargs))
+            acc = self.stream.take(len(update_list))
+        return update_list, acc
 
     @abstractmethod
     def size(self, *args, **kwargs):
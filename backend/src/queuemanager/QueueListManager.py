@@ -23,10 +23,10 @@ class QueueListManager(BaseQueueManager):
 
     # Automatically triggered when new data is uploaded
     def put(self, update, *args, **kwargs):
-        self.lock.acquire()
-        if self.checker_caller.check(update):
-            self.queue[update["group_id"]].put(update)
-        self.lock.release()
+        with self.condition:
+            if self.checker_caller.check(update):
+                self.queue[update["group_id"]].put(update)
+            self.condition.notify_all()
 
     def receive(self, nums, *args, **kwargs):
         self.group_ready_num = self.receiver_caller.receive(self.queue, nums, *args, **kwargs)
@@ -19,15 +19,10 @@ class SingleQueueManager(BaseQueueManager):
 
     # Automatically triggered when new data is uploaded
     def put(self, update, *args, **kwargs):
-        self.lock.acquire()
-        if self.checker_caller.check(update):
-            self.queue.put(update)
-        self.lock.release()
-
-    def set(self, *args, **kwargs):
-        self.lock.acquire()
-        self.queue = self.pre_queue
-        self.lock.release()
+        with self.condition:
+            if self.checker_caller.check(update):
+                self.queue.put(self.fold(update))
+            self.condition.notify_all()
 
     def receive(self, nums, *args, **kwargs):
         self.receiver_caller.receive(self.queue, nums, *args, **kwargs)
@@ -3,6 +3,7 @@ import copy
 import torch
 
 from queuemanager.SingleQueueManager import SingleQueueManager
+from utils.ParamVector import ParamVector
 from utils.Tools import to_dev, to_cpu
 
 
@@ -85,6 +86,9 @@ class VCM_Direct:
         self.existing_versions_model = exising_version_model
 
     def correct(self, latest_model, update_dict):
+        # the corrections are applied key by key
+        if isinstance(update_dict["weights"], ParamVector):
+            update_dict["weights"] = update_dict["weights"].to_state_dict()
         self.correct_update(latest_model, update_dict)
         self.correct_data_sum(update_dict)
 
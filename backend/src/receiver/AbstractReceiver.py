@@ -1,9 +1,32 @@
+import time
 from abc import abstractmethod
 
+from utils.GlobalVarGetter import GlobalVarGetter
+
 
 class AbstractReceiver:
     def __init__(self, config):
         self.config = config
+        self.queue_manager = None
+
+    def bind(self, queue_manager):
+        """
+        The queue manager notifies its receiver on every put,
+        so that a receiver can block instead of polling the queue.
+        """
+        self.queue_manager = queue_manager
+
+    def wait_until(self, predicate, interval=0.01):
+        clock = GlobalVarGetter.get().get('virtual_clock')
+        if clock is not None:
+            # the simulated clients are released one by one, in virtual time order
+            while not clock.advance(predicate):
+                pass
+        elif self.queue_manager is not None and hasattr(self.queue_manager, 'wait_until'):
+            self.queue_manager.wait_until(predicate)
+        else:
+            while not predicate():
+                time.sleep(interval)
 
     @abstractmethod
     def receive(self, *args, **kwargs):
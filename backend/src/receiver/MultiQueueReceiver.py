@@ -1,5 +1,3 @@
-import time
-
 from receiver.AbstractReceiver import AbstractReceiver
 
 
@@ -9,10 +7,16 @@ class MultiQueueReceiver(AbstractReceiver):
 
     def receive(self, queue, nums):
         # 第i组/层全都上传完成
-        while True:
+        ready = []
+
+        def group_ready():
             for i in range(len(nums)):
                 if nums[i] == 0:
                     continue
                 if queue[i].qsize() == nums[i]:
-                    return i
-            time.sleep(0.1)
+                    ready.append(i)
+                    return True
+            return False
+
+        self.wait_until(group_ready, 0.1)
+        return ready[0]
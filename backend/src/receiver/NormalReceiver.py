@@ -1,5 +1,3 @@
-import time
-
 from receiver.AbstractReceiver import AbstractReceiver
 
 
@@ -9,5 +7,4 @@ class NormalReceiver(AbstractReceiver):
 
     # to support any queue_manger
     def receive(self, queue, nums):
-        while queue.qsize() < nums:
-            time.sleep(0.01)
+        self.wait_until(lambda: queue.qsize() >= nums)
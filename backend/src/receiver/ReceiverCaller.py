@@ -4,6 +4,8 @@ from receiver.NoneReceiver import NoneReceiver
 class ReceiverCaller:
     def __init__(self, queue_manager):
         self.queue_manager = queue_manager
+        if hasattr(queue_manager.receiver, 'bind'):
+            queue_manager.receiver.bind(queue_manager)
 
     def receive(self, queue, nums, *args, **kwargs):
         if isinstance(self.queue_manager.receiver, NoneReceiver):
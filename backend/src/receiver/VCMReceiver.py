@@ -1,5 +1,3 @@
-from time import sleep
-
 from receiver.AbstractReceiver import AbstractReceiver
 
 
@@ -8,5 +6,4 @@ class VCMReceiver(AbstractReceiver):
         super().__init__(config)
 
     def receive(self, queue_manager, nums):
-        while queue_manager.client_num < nums:
-            sleep(0.01)
+        self.wait_until(lambda: queue_manager.client_num >= nums)
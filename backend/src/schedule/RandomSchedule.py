@@ -1,16 +1,60 @@
 import random
 
+from core.ClientRegistry import IdleClients
 from schedule.AbstractSchedule import AbstractSchedule
+from utils.GlobalVarGetter import GlobalVarGetter
 
 
 class RandomSchedule(AbstractSchedule):
+    r"""
+    Selects c_ratio of the idle clients at random.
+    config:
+        c_ratio: the ratio of the idle clients to select
+        weighted: draws the clients without replacement with probabilities proportional to their number of
+                  samples instead of uniformly, False by default
+    """
+    # client_list may be an IdleClients view
+    indexed = True
+
     def __init__(self, config):
         super().__init__(config)
         self.c_ratio = config["c_ratio"]
+        self.weighted = config.get("weighted", False)
+        self.weights = None
 
     def schedule(self, client_list):
+        if isinstance(client_list, IdleClients) and not self.weighted:
+            # counted and drawn in one call, the clients change their status meanwhile.
+            # the clients are drawn exactly as random.sample draws them from the list of the idle clients
+            client_num, selected_client_threads = client_list.sample(self.c_ratio)
+            print("Current clients:", client_num, ", select:", len(selected_client_threads))
+            return selected_client_threads
         select_num = int(self.c_ratio * len(client_list))
 
         print("Current clients:", len(client_list), ", select:", select_num)
+        if self.weighted:
+            return self.weighted_schedule(client_list, select_num)
         selected_client_threads = random.sample(client_list, select_num)
         return selected_client_threads
+
+    def weighted_schedule(self, client_list, select_num):
+        if self.weights is None:
+            self.weights = self.client_weights()
+            if isinstance(client_list, IdleClients):
+                client_list.set_weights(self.weights)
+        if isinstance(client_list, IdleClients):
+            return client_list.weighted_sample(select_num)
+        # A-ES: the select_num largest u^(1/w)
+        keys = []
+        for client_id in client_list:
+            weight = self.weights.get(client_id, 1.0)
+            if weight > 0:
+                keys.append((random.random() ** (1 / weight), client_id))
+        keys.sort(reverse=True)
+        return [client_id for _, client_id in keys[:select_num]]
+
+    @staticmethod
+    def client_weights():
+        # the number of samples of every client, the clients without data are never selected
+        index_list = GlobalVarGetter.get().get('client_index_list', [])
+        return {client_id: float(len(indexes)) for client_id, indexes in enumerate(index_list)}
@@ -2,6 +2,9 @@ from schedule.AbstractSchedule import AbstractSchedule
 
 
 class RoundRobin(AbstractSchedule):
+    # client_list may be an IdleClients view, only the slices are fetched
+    indexed = True
+
     def __init__(self, config):
         super().__init__(config)
         self.pos = 0
@@ -1,6 +1,13 @@
+from core.ClientRegistry import IdleClients
+
+
 class ScheduleCaller:
     def __init__(self, scheduler):
         self.scheduler = scheduler
 
     def schedule(self, client_list, *args, **kwargs):
-        return self.scheduler.schedule_method.schedule(client_list)
+        schedule_method = self.scheduler.schedule_method
+        if isinstance(client_list, IdleClients) and not getattr(schedule_method, 'indexed', False):
+            # the schedule may use any list operation
+            client_list = list(client_list)
+        return schedule_method.schedule(client_list)
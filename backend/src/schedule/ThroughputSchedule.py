@@ -0,0 +1,134 @@
+import math
+import random
+import threading
+from collections import deque
+
+from schedule.AbstractSchedule import AbstractSchedule
+from utils import Time
+from utils.GlobalVarGetter import GlobalVarGetter
+
+
+class ThroughputSchedule(AbstractSchedule):
+    r"""
+    Selects the clients which are expected to deliver the most useful updates per second, for async and
+    semi-async runs with heavy stragglers.
+    For every client an online estimate (EWMA of the mean and the variance) of its training time, from its
+    dispatch to its upload_time, and of its upload latency, from upload_time to the arrival at the server, is kept.
+    An update is useful if it arrives within the deadline, so a client scores P(T <= deadline) / E[T] updates per
+    second, with T normal with the estimated mean and variance.
+    params:
+        c_ratio: the share of the idle clients selected, as in RandomSchedule
+        deadline: seconds, by default the deadline_quantile of the estimated turnarounds of the measured clients
+        deadline_quantile: default 0.8
+        fair_share: the share of the cohort given to the clients which have waited longest since their last
+            selection, never selected clients first, so that every client keeps being selected and measured,
+            default 0.2
+        alpha: the weight of a new measurement, default 0.3
+    """
+
+    def __init__(self, config):
+        super().__init__(config)
+        self.c_ratio = config["c_ratio"]
+        self.deadline = config.get("deadline")
+        self.deadline_quantile = config.get("deadline_quantile", 0.8)
+        self.fair_share = config.get("fair_share", 0.2)
+        self.alpha = config.get("alpha", 0.3)
+        self.lock = threading.Lock()
+        # client id -> [mean, variance] of the training time and of the upload latency
+        self.train_time = {}
+        self.upload_latency = {}
+        self.dispatched = {}
+        self.last_selected = {}
+        self.rounds = 0
+        GlobalVarGetter.get().setdefault('upload_listeners', []).append(self.on_upload)
+
+    def schedule(self, client_list):
+        select_num = int(self.c_ratio * len(client_list))
+        print("Current clients:", len(client_list), ", select:", select_num)
+        with self.lock:
+            self.rounds += 1
+            deadline = self.current_deadline()
+            prior = self.prior()
+            fair_num = min(select_num, math.ceil(self.fair_share * select_num))
+            # the clients which have waited longest, ties in random order
+            waiting = sorted(client_list, key=lambda c: (self.last_selected.get(c, -1), random.random()))
+            selected = waiting[:fair_num]
+            chosen = set(selected)
+            rest = [c for c in client_list if c not in chosen]
+            scores = {c: self.score(c, deadline, prior) for c in rest}
+            rest.sort(key=lambda c: -scores[c])
+            selected.extend(rest[:select_num - fair_num])
+            now = Time.now()
+            for client_id in selected:
+                self.last_selected[client_id] = self.rounds
+                self.dispatched.setdefault(client_id, deque()).append(now)
+            expected = sum(self.score(c, deadline, prior) for c in selected)
+        print(f"deadline: {deadline if deadline is not None else 'none'}, "
+              f"expected useful updates per second: {expected:.3f}")
+        return selected
+
+    def on_upload(self, update):
+        client_id = update.get('client_id')
+        upload_time = update.get('upload_time')
+        arrival = Time.now()
+        with self.lock:
+            dispatched = self.dispatched.get(client_id)
+            if not dispatched:
+                # not dispatched by this schedule
+                return
+            dispatch_time = dispatched.popleft()
+            if upload_time is None:
+                self.observe(self.train_time, client_id, arrival - dispatch_time)
+                return
+            self.observe(self.train_time, client_id, max(upload_time - dispatch_time, 0.0))
+            self.observe(self.upload_latency, client_id, max(arrival - upload_time, 0.0))
+
+    def observe(self, estimates, client_id, value):
+        estimate = estimates.get(client_id)
+        if estimate is None:
+            estimates[client_id] = [value, 0.0]
+            return
+        mean, var = estimate
+        diff = value - mean
+        mean += self.alpha * diff
+        var = (1 - self.alpha) * (var + self.alpha * diff * diff)
+        estimates[client_id] = [mean, var]
+
+    def turnaround(self, client_id):
+        """
+        (mean, variance) of the time from the dispatch to the arrival, None if the client was never measured.
+        """
+        train = self.train_time.get(client_id)
+        if train is None:
+            return None
+        upload = self.upload_latency.get(client_id, [0.0, 0.0])
+        return train[0] + upload[0], train[1] + upload[1]
+
+    def current_deadline(self):
+        if self.deadline is not None:
+            return self.deadline
+        means = sorted(self.turnaround(c)[0] for c in self.train_time)
+        if not means:
+            return None
+        return means[min(len(means) - 1, int(self.deadline_quantile * len(means)))]
+
+    def prior(self):
+        # an unmeasured client is assumed to be typical
+        means = [self.turnaround(c)[0] for c in self.train_time]
+        return (sum(means) / len(means), 0.0) if means else None
+
+    def score(self, client_id, deadline, prior):
+        estimate = self.turnaround(client_id)
+        if estimate is None:
+            estimate = prior
+        if estimate is None:
+            return 1.0
+        mean, var = estimate
+        mean = max(mean, 1e-6)
+        if deadline is None:
+            return 1.0 / mean
+        if var <= 0:
+            useful = 1.0 if mean <= deadline else 0.0
+        else:
+            useful = 0.5 * (1 + math.erf((deadline - mean) / math.sqrt(2 * var)))
+        return useful / mean
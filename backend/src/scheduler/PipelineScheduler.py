@@ -0,0 +1,67 @@
+from core.handlers.Handler import Handler
+from core.handlers.ServerHandler import ContentDispatcher, UpdateWaiter
+from scheduler.SyncScheduler import SyncScheduler
+
+
+class PipelineScheduler(SyncScheduler):
+    r"""
+    The dispatch stage of PipelineServer: it selects and dispatches round t as soon as round t is within the
+    staleness window, without waiting for the updates, which the collector of the pipeline receives.
+    """
+
+    def __init__(self, server_thread_lock, config, mutex_sem, empty_sem, full_sem):
+        super().__init__(server_thread_lock, config, mutex_sem, empty_sem, full_sem)
+        self.pipeline = None
+
+    def init(self) -> None:
+        super().init()
+        self.pipeline = self.global_var['pipeline']
+
+    def create_handler_chain(self):
+        super().create_handler_chain()
+        self.handler_chain.remove_handler(UpdateWaiter)
+        self.handler_chain.add_handler_before(ModelSnapshot(), ContentDispatcher)
+
+    def _run_iteration(self) -> None:
+        meter = self.pipeline.meters['dispatch']
+        meter.begin()
+        for round_t in range(1, self.T + 1):
+            with meter.timing('blocked'):
+                self.pipeline.wait_window(round_t, self.current_t)
+            with meter.timing('busy'):
+                selected_clients = self.execute_chain(round_t)
+            self.schedule_t.time_add()
+            meter.rounds += 1
+            with meter.timing('blocked'):
+                self.pipeline.dispatched.put((round_t, selected_clients))
+        meter.end()
+        self.pipeline.dispatched.put(None)
+
+    def execute_chain(self, round_t=None):
+        epoch = self.current_t.get_time() if round_t is None else round_t
+        while True:
+            idle_num = self.message_queue.idle_client_num()
+            request = {"epoch": epoch, "updater": self, "global_var": self.global_var,
+                       'scheduler': self.global_var['scheduler']}
+            self.handler_chain.handle(request)
+            if request.get('selected_clients'):
+                return request['selected_clients']
+            # too few clients are idle, the earlier rounds still train the others
+            self.message_queue.wait_idle_clients(idle_num, timeout=1.0)
+
+
+class ModelSnapshot(Handler):
+    """
+    Copies the global model for ContentDispatcher, the updater writes the model while the next round is dispatched.
+    """
+
+    def _handle(self, request):
+        global_var = request.get('global_var')
+        updater = global_var['updater']
+        model_version_store = global_var.get('model_version_store')
+        with updater.server_thread_lock:
+            request['weights'] = {k: v.detach().to('cpu', copy=True) for k, v in updater.model.state_dict().items()}
+            if model_version_store is not None:
+                # the version of this copy, current_t is only advanced after the write
+                request['weights_version'] = model_version_store.current_version()
+        return request
@@ -19,7 +19,14 @@ class SemiAsyncScheduler(SyncScheduler):
 
 
 class GroupUpdater(Handler):
+    """非阻塞的重新分组: 应用已完成的分组结果, 并在后台开始下一次分组"""
+
     def _handle(self, request):
+        scheduler = request.get('scheduler')
+        group_manager = scheduler.group_manager
+        if group_manager.poll():
+            print("regrouped:", group_manager.get_group_list())
+        group_manager.submit()
         return request
 
 
@@ -49,6 +56,9 @@ class GroupClientSelector(Handler):
             client_list = group_manager.get_group_list()[group_id]
             selected_clients = self.handler.handle(
                 {'group_id': group_id, 'client_list': client_list, 'scheduler': scheduler})
+            # the groups may have changed since the first round
+            for j in selected_clients:
+                scheduler.download_item(j, "group_id", group_id)
             group_manager.group_client_num_list[group_id] = len(selected_clients)
             total_selected_clients.extend(selected_clients)
         request['selected_clients'] = total_selected_clients
@@ -60,9 +70,7 @@ class InnerGroupClientSelector(Handler):
         client_list = request.get('client_list')
         group_id = request.get('group_id')
         scheduler = request.get('scheduler')
-        training_status = scheduler.message_queue.get_training_status()
-        client_list = [client_id for client_id in client_list if
-                       client_id not in training_status or not training_status[client_id]]
+        client_list = scheduler.message_queue.filter_idle_clients(client_list)
         selected_clients = scheduler.schedule_caller.schedule(client_list)
         print(f'group {group_id} selected_clients: {selected_clients}')
         return selected_clients
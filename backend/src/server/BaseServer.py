@@ -5,6 +5,9 @@ import torch.cuda
 from torch.multiprocessing import Event
 
 from core.MessageQueue import DataGetter, MessageQueueFactory
+from core.ModelVersionStore import ModelVersionStore
+from core.Runtime import running_mode
+from core.VirtualClock import VirtualClock
 from utils import Time
 from utils.GlobalVarGetter import GlobalVarGetter
 from utils.ModuleFindTool import load_model_from_config
@@ -23,6 +26,15 @@ class BaseServer:
         # 全局存储变量
         self.global_var = GlobalVarGetter.get()
         self.global_var['server'] = self
+        # 全局模型快照, 下行链路只传递版本号
+        if self.global_config.get('model_snapshot', False):
+            self.global_var['model_version_store'] = ModelVersionStore(self.message_queue)
+        # 虚拟时钟, 客户端延迟按模拟时间推进而不真正休眠
+        if self.global_config.get('virtual_clock', False):
+            # the clients must share the clock with the server, so they can not run in other processes
+            if running_mode(config)[0] == 'process':
+                raise ValueError("virtual_clock is not supported in process mode")
+            self.global_var['virtual_clock'] = VirtualClock()
 
         # 全局模型
         self.train_ds = self.message_queue.get_train_dataset()
@@ -70,9 +82,16 @@ class BaseServer:
         print("scheduler_thread joined")
         self.updater_thread.join()
         print("updater_thread joined")
+        if 'virtual_clock' in self.global_var:
+            # release the clients which are still waiting for their simulated completion
+            print("Virtual time:", self.global_var['virtual_clock'].now())
+            self.global_var['virtual_clock'].stop()
         self.data_getter_thread.kill()
         self.data_getter_thread.join()
         print("data_getter_thread joined")
+        if 'model_version_store' in self.global_var:
+            # the snapshots of the clients which never uploaded
+            self.global_var['model_version_store'].clear()
 
         # 队列报告
         self.queue_manager.stop()
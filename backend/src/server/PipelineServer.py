@@ -0,0 +1,37 @@
+from checker.SyncChecker import SyncChecker
+from core.Pipeline import Pipeline
+from scheduler.PipelineScheduler import PipelineScheduler
+from server.NormalServer import NormalServer
+from updater.PipelineUpdater import PipelineUpdater
+
+
+class PipelineServer(NormalServer):
+    r"""
+        pipelined sync server: dispatching, receiving the updates and aggregating run as stages on their own
+        threads connected by bounded queues, so round t+1 is dispatched to the idle clients while round t is
+        received and aggregated.
+        config (server.pipeline):
+            staleness_window: how many rounds the dispatching may run ahead of the aggregation, 0 behaves like
+                NormalServer
+            queue_size: the capacity of the queues between the stages, default staleness_window + 1
+        The scheduler and updater must be PipelineScheduler and PipelineUpdater. A round may be trained on an
+        older model, so the checker must accept old time stamps (e.g. AllChecker), and streaming aggregation is
+        not supported. The utilization of every stage is printed at the end.
+    """
+
+    def __init__(self, config):
+        NormalServer.__init__(self, config)
+        if not isinstance(self.scheduler, PipelineScheduler) or not isinstance(self.updater, PipelineUpdater):
+            raise ValueError("PipelineServer needs PipelineScheduler and PipelineUpdater")
+        if isinstance(getattr(self.queue_manager, 'checker', None), SyncChecker):
+            raise ValueError("PipelineServer receives updates of older models, SyncChecker would drop them")
+        if self.queue_manager.stream is not None:
+            raise ValueError("PipelineServer does not support streaming aggregation")
+        self.pipeline = Pipeline(self.server_config.get('pipeline', {}))
+        self.global_var['pipeline'] = self.pipeline
+
+    def run(self):
+        self.pipeline.start(self.queue_manager)
+        super().run()
+        self.pipeline.collector.join()
+        self.pipeline.report()
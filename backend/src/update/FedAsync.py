@@ -1,8 +1,7 @@
-import torch
-import numpy as np
-
 from update.AbstractUpdate import AbstractUpdate
 from utils.GlobalVarGetter import GlobalVarGetter
+from utils.ParamVector import ParamVector
+from utils.Structures import RunningStats, ScoreArray
 
 
 class FedAsync(AbstractUpdate):
@@ -10,8 +9,11 @@ class FedAsync(AbstractUpdate):
         self.config = config
         self.global_var = GlobalVarGetter.get()
 
-        self.distance_history = []
-        self.trust_scores = {}   # 🔥 NEW: trust score tracking
+        # z-score statistics of the accepted distances, window=None keeps the whole history
+        self.distance_stats = RunningStats(config.get("z_window"), config.get("z_estimator", "welford"),
+                                           config.get("z_ewma_alpha", 0.1))
+        # 🔥 NEW: trust score tracking, indexed by client id
+        self.trust_scores = ScoreArray(1.0, self.global_var["global_config"]["client_num"])
 
         self.hetero_threshold = config.get("hetero_threshold", 5.0)
         self.hetero_penalty = config.get("hetero_penalty", 0.5)
@@ -20,18 +22,17 @@ class FedAsync(AbstractUpdate):
         self.trust_boost = config.get("trust_boost", 0.05)
 
     def compute_distance(self, client_weights, server_weights):
-        total_norm = 0.0
-        for key in server_weights.keys():
-            diff = client_weights[key] - server_weights[key]
-            total_norm += torch.norm(diff).item()
-        return total_norm
+        # sum of the L2 norms of every tensor, computed on the packed vectors
+        server_vector = ParamVector.of(server_weights)
+        client_vector = ParamVector.of(client_weights, server_vector.layout, server_vector.data.device)
+        return server_vector.new(client_vector.data - server_vector.data).segment_norms().double().sum().item()
 
     def is_malicious(self, distance):
-        if len(self.distance_history) < 5:
+        if len(self.distance_stats) < 5:
             return False
 
-        mean = np.mean(self.distance_history)
-        std = np.std(self.distance_history)
+        mean = self.distance_stats.mean
+        std = self.distance_stats.std
 
         if std == 0:
             return False
@@ -58,17 +59,13 @@ class FedAsync(AbstractUpdate):
         r = self.config["r"]
 
         server_weights = self.global_var['updater'].model.state_dict()
-
-        # -------------------------
-        # INITIALIZE TRUST IF NEW
-        # -------------------------
-        if client_id not in self.trust_scores:
-            self.trust_scores[client_id] = 1.0
+        server_vector = ParamVector.of(server_weights)
+        client_vector = ParamVector.of(client_weights, server_vector.layout, server_vector.data.device)
 
         # -------------------------
         # DISTANCE
         # -------------------------
-        distance = self.compute_distance(client_weights, server_weights)
+        distance = self.compute_distance(client_vector, server_vector)
 
         # -------------------------
         # MALICIOUS CHECK
@@ -79,7 +76,7 @@ class FedAsync(AbstractUpdate):
             self.trust_scores[client_id] = max(self.trust_scores[client_id], 0.1)
             return server_weights, None
 
-        self.distance_history.append(distance)
+        self.distance_stats.push(distance)
 
         # -------------------------
         # TRUST BOOST (GOOD UPDATE)
@@ -113,13 +110,10 @@ class FedAsync(AbstractUpdate):
         # -------------------------
         alpha *= self.trust_scores[client_id]
 
-        updated_parameters = {}
-
-        for key in server_weights.keys():
-            updated_parameters[key] = (
-                alpha * client_weights[key] +
-                (1 - alpha) * server_weights[key]
-            )
+        updated_parameters = server_vector.new(
+            alpha * client_vector.data +
+            (1 - alpha) * server_vector.data
+        ).to_state_dict()
 
         print("Robust aggregation (Z-score + Trust + Heterogeneity-aware) applied.")
 
@@ -1,27 +1,34 @@
-import copy
-
 from update.AbstractUpdate import AbstractUpdate
+from update.StreamAggregator import StreamingUpdate
 from utils.GlobalVarGetter import GlobalVarGetter
+from utils.ParamVector import ParamVector
 
 
-class FedAvg(AbstractUpdate):
+class FedAvg(AbstractUpdate, StreamingUpdate):
     def __init__(self, config):
         self.config = config
         self.global_var = GlobalVarGetter.get()
 
     def update_server_weights(self, epoch, update_list):
+        return self.average(update_list).to_state_dict(), None
+
+    def average(self, update_list):
         total_nums = 0
         for update_dict in update_list:
             total_nums += update_dict["data_sum"]
-        updated_parameters = {}
-        for key, var in update_list[0]["weights"].items():
-            updated_parameters[key] = update_list[0]["weights"][key] * update_list[0]["data_sum"] / total_nums
-        for i in range(len(update_list) - 1):
-            update_dict = update_list[i + 1]
-            client_weights = update_dict["weights"]
-            for key, var in client_weights.items():
-                updated_parameters[key] += client_weights[key] * update_dict["data_sum"] / total_nums
-        return updated_parameters, None
+        coefficients = [update_dict["data_sum"] / total_nums for update_dict in update_list]
+        return ParamVector.weighted_sum(coefficients, [update_dict["weights"] for update_dict in update_list])
+
+    def stream_coefficient(self, update):
+        return update["data_sum"]
+
+    def stream_finish(self, epoch, update_list, acc):
+        return self.stream_average(acc).to_state_dict(), None
+
+    @staticmethod
+    def stream_average(acc):
+        weights = acc["weights"]
+        return weights.new(weights.data / acc["data_sum"])
 
 
 class FedAvgWithPrevious(FedAvg):
@@ -30,11 +37,15 @@ class FedAvgWithPrevious(FedAvg):
         self.beta = config["beta"]
 
     def update_server_weights(self, epoch, update_list):
-        global_model = self.global_var["global_model"].state_dict()
-        updated_parameters, _ = super().update_server_weights(epoch, update_list)
-        for key, var in updated_parameters.items():
-            updated_parameters[key] = self.beta * global_model[key] + (1 - self.beta) * updated_parameters[key]
-        return updated_parameters, None
+        return self.with_previous(self.average(update_list)), None
+
+    def stream_finish(self, epoch, update_list, acc):
+        return self.with_previous(self.stream_average(acc)), None
+
+    def with_previous(self, updated_parameters):
+        global_model = ParamVector.of(self.global_var["global_model"].state_dict(), updated_parameters.layout,
+                                      updated_parameters.data.device)
+        return global_model.new(self.beta * global_model.data + (1 - self.beta) * updated_parameters.data).to_state_dict()
 
 
 class FedAvgForGradient(FedAvg):
@@ -43,8 +54,12 @@ class FedAvgForGradient(FedAvg):
         self.lr = config.get("lr", 0.01)
 
     def update_server_weights(self, epoch, update_list):
-        global_model = self.global_var["global_model"].state_dict()
-        updated_parameters, _ = super().update_server_weights(epoch, update_list)
-        for key, var in global_model.items():
-            updated_parameters[key] = var - self.lr * updated_parameters[key]
-        return updated_parameters, None
+        return self.apply_gradient(self.average(update_list)), None
+
+    def stream_finish(self, epoch, update_list, acc):
+        return self.apply_gradient(self.stream_average(acc)), None
+
+    def apply_gradient(self, updated_parameters):
+        global_model = ParamVector.of(self.global_var["global_model"].state_dict(), updated_parameters.layout,
+                                      updated_parameters.data.device)
+        return global_model.new(global_model.data - self.lr * updated_parameters.data).to_state_dict()
@@ -1,10 +1,11 @@
 import copy
 
-import torch.nn.functional as F
+import torch
 from sklearn.cluster import KMeans
 
 from update.AbstractUpdate import AbstractUpdate
 from utils.GlobalVarGetter import GlobalVarGetter
+from utils.ParamVector import ParamVector
 from utils.Tools import to_cpu
 
 
@@ -20,6 +21,8 @@ class FedDL(AbstractUpdate):
     def update_server_weights(self, epoch, update_list):
         self.updater_thread = self.global_var['updater']
         self.client_weights = {'global': copy.deepcopy(self.updater_thread.model.state_dict())}
+        layout, matrix = ParamVector.stack([u["weights"] for u in update_list])
+        n = len(update_list)
         cluster_group = {}
         # 计算kld
         clusters = {0: [k["client_id"] for k in update_list]}
@@ -27,21 +30,31 @@ class FedDL(AbstractUpdate):
         for i in range(len(update_list)):
             id_update_idx_map[update_list[i]["client_id"]] = i
         for key in update_list[0]["weights"].keys():
-            clusters = self.kld_cluster(key, update_list, clusters, id_update_idx_map)
+            shape = layout.shapes[layout.index[key]]
+            if max(len(c) for c in clusters.values()) >= self.config['n_clusters']:
+                kld = pairwise_kld(matrix[:, layout.slice(key)].reshape(n, *shape), self.config.get('kld_chunk', 1 << 26))
+            else:
+                kld = None
+            clusters = self.kld_cluster(kld, clusters, id_update_idx_map)
             cluster_group[key] = clusters
-        # 更新
+        # 更新, 每个簇的加权平均由一次index_add完成
+        data_sum = torch.tensor([u["data_sum"] for u in update_list], dtype=matrix.dtype, device=matrix.device)
         for key, clusters in cluster_group.items():
-            for _, cluster in clusters.items():
-                updated_parameter = None
-                data_sum = 0
+            columns = matrix[:, layout.slice(key)]
+            shape = layout.shapes[layout.index[key]]
+            # kld_cluster skips the labels of empty clusters, the rows are numbered contiguously
+            labels = torch.empty(n, dtype=torch.long)
+            for row, cluster in enumerate(clusters.values()):
                 for i in cluster:
-                    data_sum += update_list[id_update_idx_map[i]]["data_sum"]
-                    if updated_parameter is None:
-                        updated_parameter = update_list[id_update_idx_map[i]]["weights"][key] * update_list[id_update_idx_map[i]]["data_sum"]
-                    else:
-                        updated_parameter += update_list[id_update_idx_map[i]]["weights"][key] * update_list[id_update_idx_map[i]]["data_sum"]
-
-                updated_parameter = updated_parameter / data_sum
+                    labels[id_update_idx_map[i]] = row
+            labels = labels.to(matrix.device)
+            weighted_sum = torch.zeros(len(clusters), columns.shape[1], dtype=matrix.dtype, device=matrix.device)
+            weighted_sum.index_add_(0, labels, columns * data_sum[:, None])
+            cluster_data_sum = torch.zeros(len(clusters), dtype=matrix.dtype, device=matrix.device)
+            cluster_data_sum.index_add_(0, labels, data_sum)
+            updated_parameters = weighted_sum / cluster_data_sum[:, None]
+            for row, cluster in enumerate(clusters.values()):
+                updated_parameter = updated_parameters[row].view(shape)
                 for i in cluster:
                     if i not in self.client_weights.keys():
                         self.client_weights[i] = {}
@@ -49,7 +62,10 @@ class FedDL(AbstractUpdate):
 
         return self.updater_thread.model.state_dict(), self.client_weights
 
-    def kld_cluster(self, key, update_list, clusters: dict, id_update_idx_map):
+    def kld_cluster(self, kld, clusters: dict, id_update_idx_map):
+        """
+        kld: the pairwise kl divergence of all the updates of the key, indexed as update_list.
+        """
         label = 0
         class_num = {}
         new_clusters_dict = {}
@@ -60,25 +76,12 @@ class FedDL(AbstractUpdate):
                 new_clusters_dict[label] = clusters[cls]
                 label += 1
             else:
-                kld = [[0 for _ in range(class_num[cls])] for _ in range(class_num[cls])]
-                index = 0
-                id_idx_map = {}
                 idx_id_map = {}
-                for i in clusters[cls]:
-                    id_idx_map[i] = index
+                for index, i in enumerate(clusters[cls]):
                     idx_id_map[index] = i
-                    index += 1
-                for i in range(class_num[cls]):
-                    for j in range(class_num[cls]):
-                        if i < j:
-                            kld[i][j] = F.kl_div(update_list[id_update_idx_map[idx_id_map[i]]]["weights"][key].softmax(dim=-1).log(), update_list[id_update_idx_map[idx_id_map[j]]]["weights"][key].softmax(dim=-1),
-                                                 reduction='batchmean')
-                            kld[j][i] = kld[i][j]
-                        else:
-                            kld[i][i] = F.kl_div(update_list[id_update_idx_map[idx_id_map[i]]]["weights"][key].softmax(dim=-1).log(), update_list[id_update_idx_map[idx_id_map[i]]]["weights"][key].softmax(dim=-1),
-                                                 reduction='batchmean')
+                idx = torch.tensor([id_update_idx_map[i] for i in clusters[cls]], device=kld.device)
                 # 聚类
-                new_clusters = self.clusterer.fit_predict(to_cpu(kld))
+                new_clusters = self.clusterer.fit_predict(to_cpu(kld[idx][:, idx]).numpy())
                 # 更新
                 for k in range(self.config['n_clusters']):
                     for i in range(len(new_clusters)):
@@ -89,3 +92,25 @@ class FedDL(AbstractUpdate):
                                 new_clusters_dict[label] = [idx_id_map[i]]
                     label += 1
         return new_clusters_dict
+
+
+def pairwise_kld(x, chunk=1 << 26):
+    """
+    kld[i][j] = F.kl_div(x[i].softmax(dim=-1).log(), x[j].softmax(dim=-1), reduction='batchmean') for i <= j,
+    computed with broadcasting in blocks of rows so that a block has at most chunk elements.
+    The lower triangle mirrors the upper one, kld[j][i] = kld[i][j], as the pairwise loop did.
+    """
+    n = x.shape[0]
+    batch_size = x.shape[1] if x.dim() > 1 else 1
+    target = x.softmax(dim=-1)
+    log_input = target.log().reshape(n, -1)
+    target = target.reshape(n, -1)
+    # the same element-wise terms as F.kl_div: xlogy(target, target) - target * input
+    target_entropy = torch.xlogy(target, target)
+    kld = torch.empty(n, n, dtype=target.dtype, device=target.device)
+    rows = max(1, chunk // max(1, n * target.shape[1]))
+    for start in range(0, n, rows):
+        end = min(start + rows, n)
+        kld[start:end] = (target_entropy[None] - target[None] * log_input[start:end, None]).sum(dim=-1) / batch_size
+    upper = kld.triu(1)
+    return upper + upper.T + torch.diag(kld.diagonal())
@@ -1,11 +1,10 @@
-import copy
-
 from update.AbstractUpdate import AbstractUpdate
+from update.StreamAggregator import StreamingUpdate
 from utils.GlobalVarGetter import GlobalVarGetter
-import torch
+from utils.ParamVector import ParamVector
 
 
-class FedNova(AbstractUpdate):
+class FedNova(AbstractUpdate, StreamingUpdate):
     def __init__(self, config):
         self.config = config
         self.global_var = GlobalVarGetter().get()
@@ -17,17 +16,29 @@ class FedNova(AbstractUpdate):
             total_nums += update_dict["data_sum"]
             total_tau += update_dict["data_sum"] * update_dict["tau"]
         pre_param = total_tau / total_nums
-        server_weights = copy.deepcopy(self.global_var['updater'].model.state_dict())
-        updated_parameters = {}
-        for key, var in update_list[0]["weights"].items():
-            updated_parameters[key] = update_list[0]["weights"][key] * update_list[0]["data_sum"] / (total_nums * update_list[0]["tau"])
-        for i in range(len(update_list) - 1):
-            update_dict = update_list[i + 1]
-            client_weights = update_dict["weights"]
-            for key, var in client_weights.items():
-                updated_parameters[key] += client_weights[key] * update_dict["data_sum"] / (total_nums * update_dict["tau"])
-        for key, var in updated_parameters.items():
-            if torch.cuda.is_available():
-                updated_parameters[key] = updated_parameters[key].cuda()
-            updated_parameters[key] = server_weights[key] + updated_parameters[key] * pre_param
-        return updated_parameters, None
+        coefficients = [update_dict["data_sum"] / (total_nums * update_dict["tau"]) for update_dict in update_list]
+        updated_parameters = ParamVector.weighted_sum(coefficients, [u["weights"] for u in update_list])
+        return self.apply_update(updated_parameters, pre_param), None
+
+    def apply_update(self, updated_parameters, pre_param):
+        server_weights = ParamVector.of(self.global_var['updater'].model.state_dict(), updated_parameters.layout)
+        updated_parameters = updated_parameters.to(server_weights.data.device)
+        return server_weights.new(server_weights.data + updated_parameters.data * pre_param).to_state_dict()
+
+    def stream_init(self):
+        acc = super().stream_init()
+        acc["total_tau"] = 0
+        return acc
+
+    def stream_coefficient(self, update):
+        return update["data_sum"] / update["tau"]
+
+    def stream_fold(self, acc, update):
+        super().stream_fold(acc, update)
+        acc["total_tau"] += update["data_sum"] * update["tau"]
+
+    def stream_finish(self, epoch, update_list, acc):
+        total_nums = acc["data_sum"]
+        pre_param = acc["total_tau"] / total_nums
+        weights = acc["weights"]
+        return self.apply_update(weights.new(weights.data / total_nums), pre_param), None
@@ -0,0 +1,162 @@
+from abc import abstractmethod
+
+import torch
+
+from update.AbstractUpdate import AbstractUpdate
+from utils.GlobalVarGetter import GlobalVarGetter
+from utils.ParamVector import ParamVector
+
+
+class RobustAggregation(AbstractUpdate):
+    r"""
+    Base class of the byzantine-robust aggregators.
+    All the updates of a round are viewed as one [n_clients, n_params] matrix, which is processed in column chunks
+    so that the intermediate tensors stay under memory_budget (MB).
+    The updates are packed in place: the weights of every update are replaced by their packed vector one by one,
+    so the packing only holds one extra copy of the model at a time.
+    The packed updates stay in host memory (keeps_host_updates, UpdateCaller does not move them to the device),
+    only the column chunks and the selected rows are moved to the device.
+    """
+    keeps_host_updates = True
+
+    def __init__(self, config):
+        self.config = config
+        self.global_var = GlobalVarGetter.get()
+        self.memory_budget = config.get("memory_budget", 256) * (1 << 20)
+        self.dev = 'cuda' if torch.cuda.is_available() else 'cpu'
+
+    def update_server_weights(self, epoch, update_list):
+        vectors = self.pack(update_list)
+        return vectors[0].new(self.aggregate(vectors, update_list)).to_state_dict(), None
+
+    @abstractmethod
+    def aggregate(self, vectors, update_list):
+        pass
+
+    @staticmethod
+    def pack(update_list):
+        layout = None
+        for update in update_list:
+            # the state_dict is dropped as soon as it is packed, a ParamVector on the host is kept as it is
+            update["weights"] = ParamVector.of(update["weights"], layout, 'cpu')
+            layout = update["weights"].layout
+        return [update["weights"] for update in update_list]
+
+    def chunks(self, vectors, bytes_per_element):
+        """
+        Yields (start, end, chunk), chunk is the [n_clients, end - start] slice of the stacked updates on self.dev.
+        """
+        n, size = len(vectors), vectors[0].data.numel()
+        step = max(1, self.memory_budget // (n * bytes_per_element))
+        for start in range(0, size, step):
+            end = min(start + step, size)
+            yield start, end, torch.stack([v.data[start:end] for v in vectors]).to(self.dev, non_blocking=True)
+
+    def pairwise_distances(self, vectors):
+        """
+        Squared euclidean distances between the updates, accumulated over the column chunks.
+        """
+        n = len(vectors)
+        element_size = vectors[0].data.element_size()
+        distances = torch.zeros(n, n, dtype=torch.float64, device=self.dev)
+        for _, _, chunk in self.chunks(vectors, element_size):
+            distances += torch.cdist(chunk, chunk).double() ** 2
+        return distances
+
+    def coordinate_reduce(self, vectors, reduce):
+        """
+        Reduces every [n_clients, chunk] slice over the clients (dim 0) with reduce.
+        """
+        element_size = vectors[0].data.element_size()
+        result = torch.empty_like(vectors[0].data, device=self.dev)
+        # the chunk, the sorted or selected values and the int64 indices
+        for start, end, chunk in self.chunks(vectors, 2 * element_size + 8):
+            result[start:end] = reduce(chunk)
+        return result
+
+
+class Krum(RobustAggregation):
+    r"""
+    Krum: selects the update with the smallest sum of distances to its n - f - 2 nearest neighbours.
+    f: the number of byzantine clients tolerated.
+    """
+
+    def __init__(self, config):
+        super().__init__(config)
+        self.f = config.get("f", 1)
+
+    def scores(self, vectors):
+        n = len(vectors)
+        if n <= 2:
+            return torch.zeros(n, dtype=torch.float64, device=self.dev)
+        distances = self.pairwise_distances(vectors)
+        k = max(n - self.f - 2, 1)
+        # the smallest distance of each row is the one to itself
+        nearest = torch.topk(distances, min(k + 1, n), dim=1, largest=False).values[:, 1:]
+        return nearest.sum(dim=1)
+
+    def select(self, vectors, m):
+        return torch.topk(self.scores(vectors), m, largest=False).indices.tolist()
+
+    def aggregate(self, vectors, update_list):
+        selected = self.select(vectors, 1)
+        print("Krum selected client", update_list[selected[0]]["client_id"])
+        return vectors[selected[0]].data.to(self.dev)
+
+
+class MultiKrum(Krum):
+    r"""
+    Multi-Krum: averages the m updates with the best Krum scores.
+    """
+
+    def __init__(self, config):
+        super().__init__(config)
+        self.m = config.get("m", None)
+
+    def aggregate(self, vectors, update_list):
+        n = len(vectors)
+        m = self.m if self.m is not None else n - self.f
+        m = min(max(m, 1), n)
+        selected = self.select(vectors, m)
+        print("Multi-Krum selected clients", [update_list[i]["client_id"] for i in selected])
+        # the selected rows are moved one at a time
+        result = torch.zeros_like(vectors[0].data, device=self.dev)
+        for i in selected:
+            result += vectors[i].data.to(self.dev)
+        return result / len(selected)
+
+
+class CoordinateMedian(RobustAggregation):
+    r"""
+    Coordinate-wise median, the two middle values are averaged when the number of updates is even.
+    """
+
+    def aggregate(self, vectors, update_list):
+        n = len(vectors)
+        lo, hi = (n - 1) // 2 + 1, n // 2 + 1
+
+        def median(chunk):
+            values = chunk.kthvalue(lo, dim=0).values
+            if hi != lo:
+                values = (values + chunk.kthvalue(hi, dim=0).values) / 2
+            return values
+
+        return self.coordinate_reduce(vectors, median)
+
+
+class TrimmedMean(RobustAggregation):
+    r"""
+    Coordinate-wise trimmed mean, the k largest and k smallest values of every coordinate are dropped.
+    k = trim if given, otherwise int(trim_ratio * n).
+    """
+
+    def __init__(self, config):
+        super().__init__(config)
+        self.trim = config.get("trim", None)
+        self.trim_ratio = config.get("trim_ratio", 0.1)
+
+    def aggregate(self, vectors, update_list):
+        n = len(vectors)
+        k = self.trim if self.trim is not None else int(self.trim_ratio * n)
+        k = min(k, (n - 1) // 2)
+        return self.coordinate_reduce(vectors, lambda chunk: torch.sort(chunk, dim=0).values[k:n - k].mean(dim=0))
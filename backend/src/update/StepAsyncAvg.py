@@ -1,8 +1,8 @@
-import copy
 import torch
 
 from update.AbstractUpdate import AbstractUpdate
 from utils.GlobalVarGetter import GlobalVarGetter
+from utils.ParamVector import ParamVector
 
 
 class StepAsyncAvg(AbstractUpdate):
@@ -28,32 +28,18 @@ class StepAsyncAvg(AbstractUpdate):
             q.append(self.num_cnt[update_list[i]["client_id"]] / self.sum_cnt)
 
         # 求每个模型与全局模型的偏差λ
-        w_global = torch.cat([p.view(-1) for _, p in server_weights.items()])
-        w_global_norm2 = torch.dot(w_global, w_global)
-        lambda_list = []
-        for i in range(len(update_list)):
-            lambda_list.append(
-                torch.dot(w_global, torch.cat([p.view(-1) for _, p in update_list[i]["weights"].items()]))
-                / w_global_norm2 - 1)
+        w_global = ParamVector.of(server_weights)
+        _, w_clients = ParamVector.stack([u["weights"] for u in update_list], w_global.layout)
+        w_clients = w_clients.to(w_global.data.device)
+        w_global_norm2 = torch.dot(w_global.data, w_global.data)
+        lambda_list = w_clients @ w_global.data / w_global_norm2 - 1
 
         # 求聚合系数和分母
-        aggregation_factor = []
-        aggregation_sum = 0
-        for i in range(len(update_list)):
-            aggregation_factor.append(update_list[i]["data_sum"] * torch.exp(-rho * torch.abs(lambda_list[i] / q[i])))
-            aggregation_sum += aggregation_factor[i]
-        for i in range(len(update_list)):
-            aggregation_factor[i] = aggregation_factor[i] / aggregation_sum
-
-        updated_parameters = {}
-        for key, var in update_list[0]["weights"].items():
-            updated_parameters[key] = update_list[0]["weights"][key] * aggregation_factor[0]
-        for i in range(len(update_list) - 1):
-            for key, var in update_list[i + 1]["weights"].items():
-                updated_parameters[key] += update_list[i + 1]["weights"][key] * aggregation_factor[i + 1]
+        data_sum = torch.tensor([u["data_sum"] for u in update_list], dtype=w_clients.dtype, device=w_clients.device)
+        q = torch.tensor(q, dtype=w_clients.dtype, device=w_clients.device)
+        aggregation_factor = data_sum * torch.exp(-rho * torch.abs(lambda_list / q))
+        aggregation_factor = aggregation_factor / aggregation_factor.sum()
 
         # 异步更新
-        for key, var in server_weights.items():
-            updated_parameters[key] = (alpha * updated_parameters[key] + (1 - alpha) * server_weights[key])
-
-        return updated_parameters, None
+        updated_parameters = aggregation_factor @ w_clients
+        return w_global.new(alpha * updated_parameters + (1 - alpha) * w_global.data).to_state_dict(), None
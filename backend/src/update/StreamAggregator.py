@@ -0,0 +1,85 @@
+from abc import ABC, abstractmethod
+from collections import deque
+
+import torch
+
+from utils.ParamVector import ParamVector
+
+
+class StreamingUpdate(ABC):
+    r"""
+    Mixin for update methods which can aggregate updates one by one.
+    Every update is folded into an accumulator with the coefficient given by stream_coefficient,
+    so that its weights can be freed as soon as it arrives.
+    Subclasses implement stream_coefficient and stream_finish.
+    """
+
+    def stream_init(self):
+        template = ParamVector.of(self.global_var['global_model'].state_dict())
+        return {'weights': template.new(torch.zeros_like(template.data)), 'data_sum': 0}
+
+    @abstractmethod
+    def stream_coefficient(self, update):
+        pass
+
+    def stream_fold(self, acc, update):
+        coefficient = self.stream_coefficient(update)
+        weights = acc['weights']
+        weights.data.add_(ParamVector.of(update['weights'], weights.layout, weights.data.device).data,
+                          alpha=coefficient)
+        acc['data_sum'] += update['data_sum']
+
+    @staticmethod
+    def stream_merge(acc, other):
+        for k, v in other.items():
+            if isinstance(v, ParamVector):
+                acc[k].data.add_(v.data)
+            else:
+                acc[k] += v
+        return acc
+
+    @abstractmethod
+    def stream_finish(self, epoch, update_list, acc):
+        """
+        Must return global_model, delivery_weights as update_server_weights does.
+        """
+        pass
+
+
+class StreamAggregator:
+    r"""
+    StreamAggregator folds the updates accepted by the queue manager into accumulators.
+    The accumulators are kept in FIFO segments of `limit` updates, which matches the number of updates taken by
+    the updater every round. limit=None means that the updater always takes all the updates in the queue.
+    The queue manager calls fold and take under its lock, so the segments always match the queue.
+    """
+
+    def __init__(self, update_method, limit=None):
+        self.update_method = update_method
+        self.limit = limit
+        self.segments = deque()
+
+    def fold(self, update):
+        if not self.segments or (self.limit is not None and self.segments[-1][1] >= self.limit):
+            self.segments.append([self.update_method.stream_init(), 0])
+        segment = self.segments[-1]
+        self.update_method.stream_fold(segment[0], update)
+        segment[1] += 1
+        # the raw weights are not needed any more
+        return {k: v for k, v in update.items() if k != 'weights'}
+
+    def take(self, nums):
+        """
+        The accumulator of the next nums updates, the zero accumulator of stream_init if nums is 0.
+        """
+        if nums == 0:
+            return self.update_method.stream_init()
+        acc = None
+        while nums > 0:
+            if not self.segments or self.segments[0][1] > nums:
+                raise RuntimeError("The updates taken do not match the folded ones, "
+                                   "streaming aggregation needs a fixed number of updates per round.")
+            segment, count = self.segments.popleft()
+            acc = segment if acc is None else self.update_method.stream_merge(acc, segment)
+            nums -= count
+        return acc
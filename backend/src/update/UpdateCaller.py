@@ -8,9 +8,15 @@ class UpdateCaller:
         self.updater = updater
         self.update_method = update_method if update_method is not None else updater.update_method
 
-    def update_server_weights(self, epoch, update_list, *args, **kwargs):
-        # 确保形参进入GPU
-        if torch.cuda.is_available():
+    def update_server_weights(self, epoch, update_list, stream_acc=None, *args, **kwargs):
+        if stream_acc is not None:
+            if not update_list:
+                # 本轮没有收到更新, 跳过聚合, 全局模型保持不变
+                return to_cpu((self.updater.model.state_dict(), None))
+            # 流式聚合, 累加器已经在设备上
+            return to_cpu(self.update_method.stream_finish(epoch, update_list, stream_acc))
+        # 确保形参进入GPU, 鲁棒聚合自己分块搬运, 更新留在内存中
+        if torch.cuda.is_available() and not getattr(self.update_method, 'keeps_host_updates', False):
             update_list = to_dev(update_list, 'cuda')
         # 确保返参进入CPU
         result = self.update_method.update_server_weights(epoch, update_list)
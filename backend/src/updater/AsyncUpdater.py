@@ -24,8 +24,11 @@ class AsyncClientUpdateGetter(Handler):
         queue_manager = request['updater'].queue_manager
         queue_manager.receive(nums)
         update_list = []
+        if queue_manager.stream is not None:
+            update_list, request['stream_acc'] = queue_manager.take_folded(nums)
         for i in range(nums):
-            update_list.append(queue_manager.get())
+            if queue_manager.stream is None:
+                update_list.append(queue_manager.get())
             c_id = update_list[i]["client_id"]
             time_stamp = update_list[i]["time_stamp"]
             self.sum_delay[0] += (epoch - time_stamp)
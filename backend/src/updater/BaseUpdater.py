@@ -6,6 +6,7 @@ from torch.utils.data import DataLoader
 from core.Component import Component
 from core.MessageQueue import MessageQueueFactory
 from loss.LossFactory import LossFactory
+from update.StreamAggregator import StreamAggregator, StreamingUpdate
 from update.UpdateCaller import UpdateCaller
 from utils import ModuleFindTool
 from utils.DatasetUtils import FLDataset
@@ -38,14 +39,27 @@ class BaseUpdater(Component, ABC):
         update_class = ModuleFindTool.find_class_by_path(self.config['update']['path'])
         self.update_method = update_class(self.config['update']['params'])
         self.update_caller = UpdateCaller(self)
+        # streaming aggregation: updates are folded as soon as the queue manager accepts them
+        if self.config.get('stream', False):
+            self.enable_stream()
 
         self.message_queue = MessageQueueFactory.create_message_queue()
         self.optimizer = None
+        # the async server test, created by ServerTestHandler when updater.async_test is set
+        self.evaluator = None
         # server_opt
         if "optimizer" in self.config:
             self.optimizer = ModuleFindTool.find_class_by_path(self.config['optimizer']['path'])(
                 self.model.parameters(), **self.config["optimizer"]["params"])
 
+    def enable_stream(self):
+        if not isinstance(self.update_method, StreamingUpdate):
+            raise ValueError(f"{self.config['update']['path']} does not support streaming aggregation")
+        limit = self.config.get('num_generator')
+        if limit is not None and not isinstance(limit, int):
+            raise ValueError("streaming aggregation needs a static num_generator")
+        self.global_var['queue_manager'].set_stream(StreamAggregator(self.update_method, limit))
+
     def init(self) -> None:
         random_seed_set(self.global_var['global_config']['seed'])
         self.queue_manager = self.global_var['queue_manager']
@@ -0,0 +1,50 @@
+from core.handlers.ServerHandler import ClientUpdateGetter, GlobalModelOptimization
+from updater.SyncUpdater import SyncUpdater
+
+
+class PipelineUpdater(SyncUpdater):
+    r"""
+    The aggregate stage of PipelineServer: it takes the collected rounds in order and aggregates them. The server
+    lock is only held while the global model is written, so the next round is dispatched meanwhile.
+    """
+
+    def __init__(self, server_thread_lock, config, mutex_sem, empty_sem, full_sem):
+        super().__init__(server_thread_lock, config, mutex_sem, empty_sem, full_sem)
+        self.pipeline = None
+
+    def init(self) -> None:
+        super().init()
+        self.pipeline = self.global_var['pipeline']
+
+    def create_handler_chain(self):
+        super().create_handler_chain()
+        self.handler_chain.remove_handler(ClientUpdateGetter)
+        self.handler_chain.exchange_handler(LockedGlobalModelOptimization(), GlobalModelOptimization)
+
+    def _run_iteration(self) -> None:
+        meter = self.pipeline.meters['aggregate']
+        meter.begin()
+        while True:
+            with meter.timing('starved'):
+                item = self.pipeline.collected.get()
+            if item is None:
+                break
+            _, update_list = item
+            with meter.timing('busy'):
+                self.execute_chain(update_list)
+            self.current_t.time_add()
+            meter.rounds += 1
+            self.pipeline.aggregated()
+        meter.end()
+
+    def execute_chain(self, update_list=None):
+        epoch = self.current_t.get_time()
+        request = {"epoch": epoch, "updater": self, "global_var": self.global_var,
+                   'scheduler': self.global_var['scheduler'], 'update_list': update_list}
+        self.handler_chain.handle(request)
+
+
+class LockedGlobalModelOptimization(GlobalModelOptimization):
+    def _handle(self, request):
+        with request.get('updater').server_thread_lock:
+            return super()._handle(request)
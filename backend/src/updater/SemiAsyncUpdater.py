@@ -45,6 +45,7 @@ class InnerGroupAggregation(Aggregation):
         queue_manager = updater.queue_manager
         group_manager.network_list[queue_manager.group_ready_num] = request.get('weights')
         group_manager.epoch_list[queue_manager.group_ready_num] += 1
+        group_manager.record(request.get('update_list'))
         return request
 
 
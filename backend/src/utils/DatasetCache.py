@@ -0,0 +1,127 @@
+import hashlib
+import json
+import os
+import shutil
+import uuid
+
+import numpy as np
+import torch
+
+from utils.DatasetUtils import CustomDataset
+
+MANIFEST = 'manifest.json'
+
+
+class MemmapDataset(CustomDataset):
+    r"""
+    A preloaded dataset opened from the dataset cache. data and targets are copy-on-write memory maps, so all the
+    processes on one host share the page cache. Pickling it only carries the manifest, which is what goes through
+    the message queue (SyncManager or MQTT), the receiver opens the files itself.
+    """
+
+    def __init__(self, manifest):
+        self.manifest = manifest
+        arrays = {name: np.load(os.path.join(manifest['path'], entry['file']), mmap_mode='c')
+                  for name, entry in manifest['files'].items()}
+        super().__init__(torch.from_numpy(arrays['data']), torch.from_numpy(arrays['targets']))
+
+    def __reduce__(self):
+        return MemmapDataset, (self.manifest,)
+
+
+class DatasetCache:
+    r"""
+    Preloaded datasets stored as raw .npy files plus a JSON manifest, one directory per key:
+        <root>/<key>/data.npy, targets.npy, manifest.json
+    The manifest records the dtype, shape, size and mtime of every file and the sha256 of their content.
+    An entry whose files were modified, truncated or removed since it was written is rebuilt. With verify the
+    content is also hashed again on every load, which reads the whole dataset once.
+    """
+
+    def __init__(self, root, verify=False):
+        self.root = root
+        self.verify = verify
+
+    @staticmethod
+    def key(dataset_config, split):
+        description = json.dumps({'dataset': dataset_config, 'split': split}, sort_keys=True, default=str)
+        return hashlib.sha256(description.encode()).hexdigest()[:16]
+
+    def load(self, key):
+        path = os.path.join(self.root, key)
+        manifest_path = os.path.join(path, MANIFEST)
+        if not os.path.exists(manifest_path):
+            return None
+        with open(manifest_path, 'r') as f:
+            manifest = json.load(f)
+        manifest['path'] = path
+        reason = self.check(manifest)
+        if reason is not None:
+            print(f"Dataset cache {key} is stale ({reason}), rebuilding it")
+            shutil.rmtree(path, ignore_errors=True)
+            return None
+        return MemmapDataset(manifest)
+
+    def check(self, manifest):
+        """
+        Returns why the files do not match the manifest, or None.
+        """
+        arrays = []
+        for name, entry in manifest['files'].items():
+            file = os.path.join(manifest['path'], entry['file'])
+            if not os.path.exists(file):
+                return f"{entry['file']} is missing"
+            stat = os.stat(file)
+            if stat.st_size != entry.get('size') or stat.st_mtime_ns != entry.get('mtime_ns'):
+                return f"{entry['file']} was modified"
+            if self.verify:
+                arrays.append((name, np.load(file, mmap_mode='r')))
+        if self.verify and digest_of(arrays) != manifest['hash']:
+            return "the content hash differs"
+        return None
+
+    def load_or_build(self, key, read_data):
+        """
+        Opens the cached dataset, read_data() -> (data, targets) is only called on a cache miss.
+        """
+        dataset = self.load(key)
+        if dataset is None:
+            print(f"Dataset cache miss, writing {key}")
+            data, targets = read_data()
+            self.save(key, data, targets)
+            dataset = self.load(key)
+        else:
+            print(f"Dataset cache hit {key}, hash {dataset.manifest['hash'][:16]}")
+        return dataset
+
+    def save(self, key, data, targets):
+        path = os.path.join(self.root, key)
+        # written aside and renamed, so a reader never sees a partial entry
+        tmp = os.path.join(self.root, f'.{key}.{uuid.uuid4().hex}')
+        os.makedirs(tmp)
+        arrays = []
+        files = {}
+        for name, tensor in (('data', data), ('targets', targets)):
+            array = torch.as_tensor(tensor).numpy()
+            file = os.path.join(tmp, f'{name}.npy')
+            np.save(file, array)
+            arrays.append((name, array))
+            # the rename keeps the size and mtime of the files
+            stat = os.stat(file)
+            files[name] = {'file': f'{name}.npy', 'dtype': str(array.dtype), 'shape': list(array.shape),
+                           'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+        with open(os.path.join(tmp, MANIFEST), 'w') as f:
+            json.dump({'key': key, 'hash': digest_of(arrays), 'files': files}, f, indent=4)
+        try:
+            os.replace(tmp, path)
+        except OSError:
+            # written by another run meanwhile
+            shutil.rmtree(tmp, ignore_errors=True)
+
+
+def digest_of(arrays):
+    digest = hashlib.sha256()
+    for name, array in arrays:
+        digest.update(name.encode())
+        digest.update(np.ascontiguousarray(array).view(np.uint8).reshape(-1).data)
+    return digest.hexdigest()
@@ -0,0 +1,84 @@
+import threading
+
+import numpy as np
+import torch
+
+from utils.DatasetUtils import CustomDataset
+
+
+class DeviceTensorDataset:
+    r"""
+    A preloaded dataset (CustomDataset) copied to one device once and shared by all the clients on that device.
+    """
+    _cache = {}
+    _lock = threading.Lock()
+
+    def __init__(self, data, targets, dev):
+        self.data = torch.as_tensor(data).to(dev)
+        self.targets = torch.as_tensor(targets).to(dev)
+        self.dev = dev
+
+    @staticmethod
+    def supports(dataset):
+        return isinstance(dataset, CustomDataset) and isinstance(dataset.data, torch.Tensor)
+
+    @staticmethod
+    def of(dataset, dev):
+        key = (id(dataset), str(dev))
+        with DeviceTensorDataset._lock:
+            if key not in DeviceTensorDataset._cache:
+                # the dataset is kept with its copy, so that its id is not reused
+                DeviceTensorDataset._cache[key] = (dataset, DeviceTensorDataset(dataset.data, dataset.targets, dev))
+            return DeviceTensorDataset._cache[key][1]
+
+    def __len__(self):
+        return len(self.data)
+
+
+class DeviceBatchLoader:
+    r"""
+    Replaces the DataLoader of a client when the dataset is on the device: every batch is one indexing of the
+    device tensors with a slice of the shuffled index_list, there is no worker and no per-sample collate.
+    The indices are read from the FLDataset on every pass, so change_idxs still works.
+    batch_transform: applies the transforms to the whole batch (they must accept batched tensors and random
+    augmentations then share their parameters within a batch), otherwise they are applied per sample.
+    """
+
+    def __init__(self, fl_dataset, device_dataset, batch_size, shuffle=True, drop_last=True, batch_transform=False):
+        self.dataset = fl_dataset
+        self.device_dataset = device_dataset
+        self.batch_size = batch_size
+        self.shuffle = shuffle
+        self.drop_last = drop_last
+        self.batch_transform = batch_transform
+        self._idxs = None
+        self._index = None
+
+    def indices(self):
+        idxs = self.dataset.idxs
+        if idxs is not self._idxs:
+            self._idxs = idxs
+            self._index = torch.as_tensor(np.asarray(idxs, dtype=np.int64), device=self.device_dataset.dev)
+        return self._index
+
+    def __iter__(self):
+        index = self.indices()
+        if self.shuffle:
+            index = index[torch.randperm(len(index), device=index.device)]
+        n = len(index)
+        end = n - n % self.batch_size if self.drop_last else n
+        for start in range(0, end, self.batch_size):
+            batch = index[start:start + self.batch_size]
+            yield (self._transform(self.device_dataset.data[batch], self.dataset.transform),
+                   self._transform(self.device_dataset.targets[batch], self.dataset.target_transform))
+
+    def _transform(self, batch, transform):
+        if transform is None:
+            return batch
+        if self.batch_transform:
+            return transform(batch)
+        return torch.stack([torch.as_tensor(transform(x)) for x in batch])
+
+    def __len__(self):
+        n = len(self.dataset.idxs)
+        return n // self.batch_size if self.drop_last else (n + self.batch_size - 1) // self.batch_size
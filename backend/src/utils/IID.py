@@ -15,6 +15,45 @@ def print_dist(index_list, labels):
         print(dict(counts))
 
 
+def label_classes(labels):
+    """
+    Equals set(labels), including its iteration order: the set is built from the first occurrence of every label,
+    which leaves the same hash table as inserting every sample, without hashing every sample.
+    """
+    labels = np.asarray(labels)
+    _, first = np.unique(labels, return_index=True)
+    return set(labels[np.sort(first)])
+
+
+class LabelIndex:
+    r"""
+    The indices of the samples grouped by label with one stable argsort,
+    indices(y) equals np.flatnonzero(labels == y).
+    """
+
+    def __init__(self, labels):
+        labels = np.asarray(labels)
+        self.order = np.argsort(labels, kind='stable')
+        self.sorted_labels = labels[self.order]
+
+    def indices(self, y):
+        lo = np.searchsorted(self.sorted_labels, y, side='left')
+        hi = np.searchsorted(self.sorted_labels, y, side='right')
+        return self.order[lo:hi]
+
+    def split(self, classes):
+        return [self.indices(y) for y in classes]
+
+
+def split_by_client(indices, client, clients_num):
+    """
+    Groups indices by their client, keeping their order within every client.
+    """
+    order = np.argsort(client, kind='stable')
+    counts = np.bincount(client, minlength=clients_num)
+    return np.split(indices[order], np.cumsum(counts)[:-1])
+
+
 def generate_data(iid_config, labels, clients_num):
     if isinstance(iid_config, bool):
         print("generating iid data...")
@@ -27,18 +66,20 @@ def generate_data(iid_config, labels, clients_num):
 
 
 def generate_iid_data(labels, clients_num):
-    class_lst = set(labels)
-    class_idx = [np.argwhere(labels == y).flatten() for y in class_lst]
-    client_idx = [[] for _ in range(clients_num + 1)]
-    for c in class_idx:
-        for i, idcs in enumerate(np.array_split(c, clients_num)):
-            client_idx[i] += [idcs]
-    client_idx = [np.concatenate(client_idx[i]) for i in range(clients_num)]
-    return client_idx
+    labels = np.asarray(labels)
+    class_idx = LabelIndex(labels).split(label_classes(labels))
+    sizes = np.array([len(c) for c in class_idx], dtype=np.int64)
+    # the chunk of np.array_split(c, clients_num) every position of every class falls into
+    q, r = np.divmod(sizes, clients_num)
+    q, r = np.repeat(q, sizes), np.repeat(r, sizes)
+    positions = np.arange(sizes.sum()) - np.repeat(np.cumsum(sizes) - sizes, sizes)
+    big = r * (q + 1)
+    client = np.where(positions < big, positions // (q + 1), r + (positions - big) // np.maximum(q, 1))
+    return split_by_client(np.concatenate(class_idx), client, clients_num)
 
 
 def generate_non_iid_data(iid_config, labels, clients_num):
-    classes = set(labels)
+    classes = label_classes(labels)
     if "customize" in iid_config.keys() and iid_config["customize"]:
         label_config = iid_config['label']
         data_config = iid_config['data']
@@ -95,23 +136,27 @@ def customize_distribution(label_config, data_config, labels, clients_num, class
 
 def dirichlet_distribution(beta, labels, clients_num, classes):
     label_distribution = np.random.dirichlet([beta] * clients_num, len(classes))
-    class_idx = [np.argwhere(labels == y).flatten() for y in classes]
-    client_idx = [[] for _ in range(clients_num+1)]
-    for c, fracs in zip(class_idx, label_distribution):
-        # np.split按照比例将类别为k的样本划分为了N个子集
-        # for i, idcs 为遍历第i个client对应样本集合的索引
-        for i, idcs in enumerate(np.split(c, (np.cumsum(fracs) * len(c)).astype(int))):
-            client_idx[i] += [idcs]
-    client_idx = [np.concatenate(idcs) for idcs in client_idx]
-    return client_idx
+    class_idx = LabelIndex(labels).split(classes)
+    sizes = np.array([len(c) for c in class_idx], dtype=np.int64)
+    # np.split(c, (np.cumsum(fracs) * len(c)).astype(int)) of all the classes at once, piece i goes to client i
+    cuts = (np.cumsum(label_distribution, axis=1) * sizes[:, None]).astype(int)
+    cuts = np.minimum(cuts, sizes[:, None])
+    span = sizes.max() + 1 if len(sizes) else 1
+    rows = np.repeat(np.arange(len(sizes)), sizes)
+    positions = np.arange(sizes.sum()) - np.repeat(np.cumsum(sizes) - sizes, sizes)
+    # the rows are shifted apart, so one searchsorted counts the cuts before every position of its own class
+    flat_cuts = (cuts + np.arange(len(sizes))[:, None] * span).reshape(-1)
+    client = np.searchsorted(flat_cuts, positions + rows * span, side='right') - rows * clients_num
+    return split_by_client(np.concatenate(class_idx), client, clients_num + 1)
 
 
 def generate_non_iid_dataset(y, label_lists, data_lists):
+    index = LabelIndex(y)
     client_idx_list = []
     for i in range(len(label_lists)):
         index_list = []
         for j in range(len(label_lists[i])):
-            ids = np.flatnonzero(y == label_lists[i][j])
+            ids = index.indices(label_lists[i][j])
             ids = np.random.choice(ids, data_lists[i][j], replace=False)
             index_list.append(ids)
         index_list = np.hstack(index_list)
@@ -0,0 +1,153 @@
+from collections.abc import Mapping
+
+import torch
+
+
+class ParamLayout:
+    r"""
+    The layout of a state_dict packed into one contiguous vector: names, shapes, dtypes and offsets.
+    Layouts are cached, so that all the state_dicts of the same model share one layout object.
+    The vector uses the widest floating dtype of the state_dict, integer entries (e.g. num_batches_tracked)
+    are stored as floats and cast back when they are unpacked.
+    """
+    __slots__ = ('names', 'shapes', 'dtypes', 'numels', 'offsets', 'index', 'size', 'dtype', '_segment_ids')
+    _cache = {}
+
+    def __init__(self, names, shapes, dtypes):
+        self.names = tuple(names)
+        self.shapes = tuple(tuple(s) for s in shapes)
+        self.dtypes = tuple(dtypes)
+        self.numels = []
+        self.offsets = []
+        offset = 0
+        for shape in self.shapes:
+            numel = 1
+            for s in shape:
+                numel *= s
+            self.offsets.append(offset)
+            self.numels.append(numel)
+            offset += numel
+        self.size = offset
+        self.index = {name: i for i, name in enumerate(self.names)}
+        self.dtype = torch.get_default_dtype()
+        for dtype in self.dtypes:
+            if dtype.is_floating_point:
+                self.dtype = torch.promote_types(self.dtype, dtype)
+        self._segment_ids = {}
+
+    @staticmethod
+    def get(names, shapes, dtypes):
+        key = (tuple(names), tuple(tuple(s) for s in shapes), tuple(dtypes))
+        if key not in ParamLayout._cache:
+            ParamLayout._cache[key] = ParamLayout(*key)
+        return ParamLayout._cache[key]
+
+    @staticmethod
+    def of(state_dict):
+        return ParamLayout.get(state_dict.keys(), [v.shape for v in state_dict.values()],
+                               [v.dtype for v in state_dict.values()])
+
+    def __reduce__(self):
+        return ParamLayout.get, (self.names, self.shapes, self.dtypes)
+
+    def __len__(self):
+        return len(self.names)
+
+    def slice(self, name):
+        i = self.index[name]
+        return slice(self.offsets[i], self.offsets[i] + self.numels[i])
+
+    def segment_ids(self, device):
+        """
+        The index of the tensor each element of the vector belongs to.
+        """
+        device = torch.device(device)
+        if device not in self._segment_ids:
+            self._segment_ids[device] = torch.repeat_interleave(torch.arange(len(self.names), device=device),
+                                                                torch.tensor(self.numels, device=device))
+        return self._segment_ids[device]
+
+
+class ParamVector(Mapping):
+    r"""
+    A state_dict packed into one contiguous tensor.
+    It is a read-only mapping from names to tensors, the tensors are zero-copy views of the vector,
+    so it can be passed anywhere a state_dict is read.
+    """
+    __slots__ = ('layout', 'data')
+
+    def __init__(self, layout, data):
+        self.layout = layout
+        self.data = data
+
+    @staticmethod
+    def of(weights, layout=None, device=None):
+        if isinstance(weights, ParamVector) and (layout is None or weights.layout is layout):
+            return weights if device is None else weights.to(device)
+        if layout is None:
+            layout = ParamLayout.of(weights)
+        if device is None:
+            device = weights[layout.names[0]].device
+        data = torch.cat([weights[k].detach().reshape(-1).to(device=device, dtype=layout.dtype)
+                          for k in layout.names])
+        return ParamVector(layout, data)
+
+    @staticmethod
+    def stack(weights_list, layout=None):
+        """
+        Stacks the weights into a matrix with one row per weights.
+        Returns layout, matrix.
+        """
+        first = ParamVector.of(weights_list[0], layout)
+        vectors = [first] + [ParamVector.of(w, first.layout, first.data.device) for w in weights_list[1:]]
+        return first.layout, torch.stack([v.data for v in vectors])
+
+    @staticmethod
+    def weighted_sum(coefficients, weights_list, layout=None):
+        layout, matrix = ParamVector.stack(weights_list, layout)
+        coefficients = torch.as_tensor(coefficients, dtype=matrix.dtype, device=matrix.device)
+        return ParamVector(layout, coefficients @ matrix)
+
+    def new(self, data):
+        return ParamVector(self.layout, data)
+
+    def segment_norms(self):
+        """
+        L2 norm of every tensor of the state_dict, in one pass over the vector.
+        """
+        data = self.data
+        squares = torch.zeros(len(self.layout), dtype=data.dtype, device=data.device)
+        squares.index_add_(0, self.layout.segment_ids(data.device), data * data)
+        return squares.sqrt()
+
+    def to(self, *args, **kwargs):
+        return ParamVector(self.layout, self.data.to(*args, **kwargs))
+
+    def cpu(self):
+        return ParamVector(self.layout, self.data.cpu())
+
+    def clone(self):
+        return ParamVector(self.layout, self.data.clone())
+
+    def to_state_dict(self):
+        return dict(self.items())
+
+    def __getitem__(self, name):
+        i = self.layout.index[name]
+        offset, numel = self.layout.offsets[i], self.layout.numels[i]
+        t = self.data[offset:offset + numel].view(self.layout.shapes[i])
+        if self.layout.dtypes[i] != self.layout.dtype:
+            t = t.to(self.layout.dtypes[i])
+        return t
+
+    def __iter__(self):
+        return iter(self.layout.names)
+
+    def __len__(self):
+        return len(self.layout)
+
+    def __getstate__(self):
+        return self.layout, self.data
+
+    def __setstate__(self, state):
+        self.layout, self.data = state
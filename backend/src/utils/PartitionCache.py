@@ -0,0 +1,99 @@
+import hashlib
+import json
+import os
+import pickle
+import random
+import shutil
+import uuid
+
+import numpy as np
+
+
+class PartitionCache:
+    r"""
+    Caches the generated index lists of the clients, keyed by the dataset, the iid config, the client number,
+    the seed and the training labels. The nested index lists are stored as one int32 array plus their structure,
+    the label mapping of the stream partitioners as JSON.
+    The python and numpy random states after the generation are stored as well and restored on a hit, so that a
+    cached run draws the same random numbers afterwards as a run which generates the partition.
+    """
+
+    def __init__(self, root, key):
+        self.path = os.path.join(root, key)
+
+    @staticmethod
+    def key(dataset_config, iid_config, client_num, seed, labels):
+        description = json.dumps({'dataset': dataset_config, 'iid': iid_config, 'client_num': client_num,
+                                  'seed': seed}, sort_keys=True, default=str)
+        digest = hashlib.sha256(description.encode())
+        digest.update(np.ascontiguousarray(labels).tobytes())
+        return digest.hexdigest()[:16]
+
+    def load(self):
+        """
+        Returns (index_list, test_index_list, label_mapping) or None.
+        """
+        if not os.path.exists(os.path.join(self.path, 'structure.json')):
+            return None
+        with open(os.path.join(self.path, 'structure.json'), 'r') as f:
+            meta = json.load(f)
+        flat = np.load(os.path.join(self.path, 'index.npy')).astype(np.int64)
+        index_list, pos = unpack(flat, meta['index_list'], 0)
+        test_index_list, _ = unpack(flat, meta['test_index_list'], pos)
+        label_mapping = None
+        if meta['label_mapping'] is not None:
+            label_mapping = {int(k): v for k, v in meta['label_mapping'].items()}
+        with open(os.path.join(self.path, 'random_state.pkl'), 'rb') as f:
+            python_state, numpy_state = pickle.load(f)
+        random.setstate(python_state)
+        np.random.set_state(numpy_state)
+        print(f"Partition cache hit {os.path.basename(self.path)}")
+        return index_list, test_index_list, label_mapping
+
+    def save(self, index_list, test_index_list, label_mapping=None):
+        root = os.path.dirname(self.path)
+        tmp = os.path.join(root, f'.{os.path.basename(self.path)}.{uuid.uuid4().hex}')
+        os.makedirs(tmp)
+        chunks = []
+        meta = {'index_list': pack(index_list, chunks), 'test_index_list': pack(test_index_list, chunks),
+                'label_mapping': None if label_mapping is None else
+                {str(int(k)): int(v) for k, v in label_mapping.items()}}
+        flat = np.concatenate(chunks).astype(np.int32) if chunks else np.zeros(0, dtype=np.int32)
+        np.save(os.path.join(tmp, 'index.npy'), flat)
+        with open(os.path.join(tmp, 'structure.json'), 'w') as f:
+            json.dump(meta, f)
+        with open(os.path.join(tmp, 'random_state.pkl'), 'wb') as f:
+            pickle.dump((random.getstate(), np.random.get_state()), f)
+        try:
+            os.replace(tmp, self.path)
+        except OSError:
+            shutil.rmtree(tmp, ignore_errors=True)
+
+
+def _is_leaf(x):
+    if isinstance(x, np.ndarray):
+        return True
+    return all(not isinstance(v, (list, tuple, np.ndarray)) for v in x)
+
+
+def pack(nested, chunks):
+    """
+    Appends the leaves (index arrays or lists) to chunks and returns the nested structure:
+    a leaf is ['a' or 'l', length], 'a' for a numpy array and 'l' for a list.
+    """
+    if _is_leaf(nested):
+        chunks.append(np.asarray(nested, dtype=np.int64).reshape(-1))
+        return ['a' if isinstance(nested, np.ndarray) else 'l', len(nested)]
+    return [pack(x, chunks) for x in nested]
+
+
+def unpack(flat, structure, pos):
+    if len(structure) == 2 and isinstance(structure[0], str):
+        kind, n = structure
+        leaf = flat[pos:pos + n]
+        return (leaf.copy() if kind == 'a' else leaf.tolist()), pos + n
+    result = []
+    for s in structure:
+        x, pos = unpack(flat, s, pos)
+        result.append(x)
+    return result, pos
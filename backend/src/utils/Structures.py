@@ -1,5 +1,8 @@
+import math
 from collections import deque
 
+import numpy as np
+
 
 class BidirectionalMappedQueue:
     def __init__(self):
@@ -61,3 +64,96 @@ class ComputableDict(dict):
         for key, value in self.items():
             self[key] = value.to(device)
         return self
+
+
+class RunningStats:
+    r"""
+    Streaming mean and (population) std with O(1) work per value.
+    estimator='welford': exact statistics over the last `window` values (all values if window is None).
+    estimator='ewma': exponentially weighted statistics with smoothing factor `alpha`.
+    """
+
+    def __init__(self, window=None, estimator='welford', alpha=0.1):
+        if estimator not in ('welford', 'ewma'):
+            raise ValueError(f"Unknown estimator {estimator}")
+        self.window = window
+        self.estimator = estimator
+        self.alpha = alpha
+        self.values = deque()
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+
+    def push(self, x):
+        if self.estimator == 'ewma':
+            self.count += 1
+            if self.count == 1:
+                self.mean, self.m2 = x, 0.0
+            else:
+                delta = x - self.mean
+                self.mean += self.alpha * delta
+                self.m2 = (1 - self.alpha) * (self.m2 + self.alpha * delta * delta)
+            return
+        if self.window is not None:
+            if self.count == self.window:
+                self.__pop()
+            self.values.append(x)
+        self.count += 1
+        delta = x - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (x - self.mean)
+
+    def __pop(self):
+        x = self.values.popleft()
+        self.count -= 1
+        if self.count == 0:
+            self.mean, self.m2 = 0.0, 0.0
+            return
+        delta = x - self.mean
+        self.mean -= delta / self.count
+        self.m2 = max(self.m2 - delta * (x - self.mean), 0.0)
+
+    def __len__(self):
+        return self.count
+
+    @property
+    def var(self):
+        if self.count == 0:
+            return 0.0
+        if self.estimator == 'ewma':
+            return self.m2
+        return self.m2 / self.count
+
+    @property
+    def std(self):
+        return math.sqrt(self.var)
+
+
+class ScoreArray:
+    r"""
+    Per-client scores stored in a numpy array indexed by client id, grown on demand.
+    Unknown ids read as the default score.
+    """
+
+    def __init__(self, default, size=0):
+        self.default = default
+        self.scores = np.full(size, default, dtype=np.float64)
+
+    def __reserve(self, client_id):
+        if client_id >= len(self.scores):
+            size = max(client_id + 1, 2 * len(self.scores))
+            scores = np.full(size, self.default, dtype=np.float64)
+            scores[:len(self.scores)] = self.scores
+            self.scores = scores
+
+    def __getitem__(self, client_id):
+        if client_id >= len(self.scores):
+            return self.default
+        return float(self.scores[client_id])
+
+    def __setitem__(self, client_id, score):
+        self.__reserve(client_id)
+        self.scores[client_id] = score
+
+    def __len__(self):
+        return len(self.scores)
@@ -1,4 +1,7 @@
 import threading
+import time
+
+from utils.GlobalVarGetter import GlobalVarGetter
 
 
 class Time:
@@ -21,3 +24,11 @@ class Time:
         c_time = self.current_time
         self.thread_lock.release()
         return c_time
+
+
+def now():
+    """
+    The wall time in seconds, or the simulated time in the virtual clock mode.
+    """
+    clock = GlobalVarGetter.get().get('virtual_clock')
+    return time.time() if clock is None else clock.now()
@@ -6,8 +6,11 @@ import time
 import numpy as np
 import torch
 from torch.utils.data import DataLoader
+from torchvision import datasets, transforms
 
+from utils.DatasetCache import DatasetCache
 from utils.DatasetUtils import CustomDataset
+from utils.ParamVector import ParamVector
 
 
 def generate_stale_list(step, shuffle, n):
@@ -86,7 +89,9 @@ def getJson(filename):
 
 
 def to_cpu(data):
-    if isinstance(data, dict):
+    if isinstance(data, ParamVector):
+        return data.cpu()
+    elif isinstance(data, dict):
         return {k: to_cpu(v) for k, v in data.items()}
     elif isinstance(data, list):
         return [to_cpu(v) for v in data]
@@ -101,7 +106,9 @@ def to_cpu(data):
 def to_dev(data, dev):
     if not torch.cuda.is_available():
         return data
-    if isinstance(data, dict):
+    if isinstance(data, ParamVector):
+        return data.to(dev)
+    elif isinstance(data, dict):
         return {k: to_dev(v, dev) for k, v in data.items()}
     elif isinstance(data, list):
         return [to_dev(v, dev) for v in data]
@@ -139,26 +146,73 @@ def generate_random_seed():
     return seed
 
 
-def _read_data(dataset):
-    data = []
-    targets = []
-    dl = DataLoader(dataset, batch_size=1)
+def _read_data(dataset, batch_size=1024, num_workers=0):
+    bulk = _bulk_read_data(dataset)
+    if bulk is not None:
+        return bulk
+    # 其他数据集: 多进程大batch读取, 直接写入预先分配的共享内存
+    x, y = dataset[0]
+    x, y = torch.as_tensor(x), torch.as_tensor(y)
+    data = torch.empty((len(dataset), *x.shape), dtype=x.dtype).share_memory_()
+    targets = torch.empty((len(dataset), *y.shape), dtype=y.dtype).share_memory_()
+    dl = DataLoader(dataset, batch_size=batch_size, num_workers=num_workers)
+    start = 0
     for x, y in dl:
-        data.append(x[0])
-        targets.append(y[0])
-    data = torch.stack(data)
-    targets = torch.stack(targets)
-    data.share_memory_()
-    targets.share_memory_()
+        data[start:start + len(x)] = x
+        targets[start:start + len(y)] = y
+        start += len(x)
+    return data, targets
+
+
+def _bulk_read_data(dataset, chunk_size=8192):
+    """
+    Converts the .data array of a torchvision image dataset whose only transform is ToTensor into the tensor
+    the transform would produce, chunk by chunk into one preallocated shared tensor.
+    Returns None for the other datasets.
+    """
+    transform = dataset.transform if hasattr(dataset, 'transform') else None
+    if isinstance(transform, transforms.Compose) and len(transform.transforms) == 1:
+        transform = transform.transforms[0]
+    if not isinstance(transform, transforms.ToTensor) or getattr(dataset, 'target_transform', None) is not None:
+        return None
+    raw = torch.as_tensor(dataset.data)
+    if isinstance(dataset, datasets.MNIST):
+        # MNIST, FashionMNIST, EMNIST: [N, H, W] -> [N, 1, H, W]
+        raw = raw.unsqueeze(1)
+        raw_targets = dataset.targets
+    elif isinstance(dataset, datasets.CIFAR10):
+        # CIFAR10, CIFAR100: [N, H, W, C] -> [N, C, H, W]
+        raw = raw.permute(0, 3, 1, 2)
+        raw_targets = dataset.targets
+    elif isinstance(dataset, datasets.SVHN):
+        # SVHN is already [N, C, H, W]
+        raw_targets = dataset.labels
+    else:
+        return None
+    data = torch.empty(raw.shape, dtype=torch.get_default_dtype()).share_memory_()
+    for start in range(0, len(raw), chunk_size):
+        data[start:start + chunk_size] = raw[start:start + chunk_size].to(data.dtype).div(255)
+    targets = torch.as_tensor(np.asarray(raw_targets), dtype=torch.int64).clone().share_memory_()
     return data, targets
 
 
 def send_dataset(train_dataset, test_dataset, message_queue, global_config):
+    # 磁盘缓存: 只有manifest经过消息队列, 各进程以memmap打开同一份文件
+    if global_config.get('dataset_cache'):
+        batch_size = global_config.get('pre_load_batch_size', 1024)
+        num_workers = global_config.get('pre_load_workers', 0)
+        cache = DatasetCache(global_config['dataset_cache'], global_config.get('dataset_cache_verify', False))
+        for split, dataset, setter in (('train', train_dataset, message_queue.set_train_dataset),
+                                       ('test', test_dataset, message_queue.set_test_dataset)):
+            key = DatasetCache.key(global_config['dataset'], split)
+            setter(cache.load_or_build(key, lambda d=dataset: _read_data(d, batch_size, num_workers)))
     # 预加载
-    if 'dataset_pre_load' in global_config and global_config['dataset_pre_load']:
-        data, targets = _read_data(train_dataset)
+    elif 'dataset_pre_load' in global_config and global_config['dataset_pre_load']:
+        batch_size = global_config.get('pre_load_batch_size', 1024)
+        num_workers = global_config.get('pre_load_workers', 0)
+        data, targets = _read_data(train_dataset, batch_size, num_workers)
         message_queue.set_train_dataset(CustomDataset(data, targets))
-        data, targets = _read_data(test_dataset)
+        data, targets = _read_data(test_dataset, batch_size, num_workers)
         message_queue.set_test_dataset(CustomDataset(data, targets))
     # 静态加载
     else:
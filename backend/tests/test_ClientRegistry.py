@@ -0,0 +1,170 @@
+import random
+import threading
+
+import pytest
+
+from core.ClientRegistry import ClientRegistry, IdleClients, _Fenwick
+from schedule.RandomSchedule import RandomSchedule
+
+
+class RegistryQueue:
+    """The calls of MessageQueue which IdleClients uses."""
+
+    def __init__(self, registry):
+        self.registry = registry
+
+    def idle_client_num(self):
+        return self.registry.idle_count()
+
+    def get_idle_clients(self, positions):
+        return self.registry.idle_at(positions)
+
+    def sample_idle_clients(self, ratio, state):
+        return self.registry.sample_idle(ratio, state)
+
+    def weighted_sample_idle_clients(self, draws):
+        return self.registry.weighted_sample(draws)
+
+    def set_client_weights(self, weights):
+        self.registry.set_weights(weights)
+
+
+def idle_list(registry, client_ids):
+    return [c for c in client_ids if registry.is_idle(c)]
+
+
+def test_fenwick_prefix_and_search():
+    values = [1, 0, 3, 0, 2, 1, 0, 4]
+    tree = _Fenwick(values)
+    for i in range(len(values) + 1):
+        assert tree.prefix(i) == sum(values[:i])
+    for target in range(sum(values)):
+        expected = next(i for i in range(len(values)) if sum(values[:i + 1]) > target)
+        assert tree.search(target) == expected
+    tree.add(1, 5)
+    values[1] += 5
+    assert tree.total() == sum(values)
+    assert tree.search(1) == 1
+
+
+def test_registry_grows_past_capacity():
+    registry = ClientRegistry()
+    registry.register(range(100))
+    for c in range(0, 100, 3):
+        registry.set_status(c, True)
+    expected = idle_list(registry, range(100))
+    assert registry.idle_count() == len(expected)
+    assert registry.idle_at(range(len(expected))) == expected
+
+
+def test_out_of_order_ids_keep_the_list_order():
+    registry = ClientRegistry()
+    registry.set_status(1, True)
+    registry.set_status(7, False)
+    registry.register([5, 3, 9, 1, 7])
+    registry.set_status(3, True)
+    # a client which is not registered is never drawn
+    registry.set_status(0, False)
+    assert registry.idle_count() == 3
+    assert registry.idle_at(range(3)) == [5, 9, 7]
+    registry.register([5, 3, 9, 1, 7, 0, 4])
+    assert registry.idle_at(range(5)) == [5, 9, 7, 0, 4]
+
+
+def test_replaced_list_drops_stale_ids():
+    registry = ClientRegistry()
+    registry.register(range(4))
+    registry.set_status(2, True)
+    registry.register([10, 11, 2, 12])
+    assert registry.idle_at(range(4)) == [10, 11, 12]
+    registry.set_status(0, True)
+    registry.set_status(0, False)
+    assert registry.idle_count() == 3
+    registry.set_status(2, False)
+    assert registry.idle_at(range(4)) == [10, 11, 2, 12]
+
+
+def test_unregistered_statuses_grow_the_trees():
+    registry = ClientRegistry()
+    for c in range(40):
+        registry.set_status(c, c % 2 == 0)
+    assert registry.idle_count() == 0
+    registry.register(range(40))
+    assert registry.idle_at(range(20)) == list(range(1, 40, 2))
+
+
+def test_idle_at_skips_clients_no_longer_idle():
+    registry = ClientRegistry()
+    registry.register(range(10))
+    registry.set_status(3, True)
+    assert registry.idle_at([9]) == []
+    assert registry.idle_at([0, 8]) == [0, 9]
+
+
+def test_sample_matches_random_sample():
+    registry = ClientRegistry()
+    registry.register(range(50))
+    for c in (2, 7, 11, 30, 49):
+        registry.set_status(c, True)
+    expected_list = idle_list(registry, range(50))
+    schedule = RandomSchedule({"c_ratio": 0.3})
+    for seed in range(5):
+        random.seed(seed)
+        selected = schedule.schedule(IdleClients(RegistryQueue(registry)))
+        after = random.random()
+        random.seed(seed)
+        expected = random.sample(expected_list, int(0.3 * len(expected_list)))
+        assert selected == expected
+        # the global random state goes on as after random.sample
+        assert after == random.random()
+
+
+def test_sample_is_consistent_while_clients_start_training():
+    registry = ClientRegistry()
+    registry.register(range(10))
+    view = IdleClients(RegistryQueue(registry))
+    registry.set_status(3, True)
+    n, selected = view.sample(1.0)
+    assert n == 9
+    assert sorted(selected) == [c for c in range(10) if c != 3]
+
+
+def test_weighted_sample_without_replacement():
+    registry = ClientRegistry()
+    registry.register(range(6))
+    registry.set_weights({0: 0.0, 1: 1.0, 2: 2.0, 3: 0.0, 4: 3.0, 5: 4.0})
+    registry.set_status(5, True)
+    for seed in range(20):
+        rng = random.Random(seed)
+        selected = registry.weighted_sample([rng.random() for _ in range(5)])
+        # only the idle clients with a weight are drawn, each once
+        assert sorted(selected) == [1, 2, 4]
+    assert registry.weight_tree.total() == pytest.approx(6.0)
+
+
+def test_weighted_sample_frequencies():
+    registry = ClientRegistry()
+    registry.register(range(3))
+    registry.set_weights({0: 1.0, 1: 1.0, 2: 8.0})
+    rng = random.Random(0)
+    counts = [0, 0, 0]
+    for _ in range(2000):
+        counts[registry.weighted_sample([rng.random()])[0]] += 1
+    assert counts[2] / 2000 == pytest.approx(0.8, abs=0.04)
+
+
+def test_weighted_schedule_on_a_list():
+    schedule = RandomSchedule({"c_ratio": 0.5, "weighted": True})
+    schedule.weights = {0: 0.0, 1: 1.0, 2: 1.0, 3: 0.0}
+    random.seed(0)
+    assert sorted(schedule.schedule([0, 1, 2, 3])) == [1, 2]
+
+
+def test_wait_idle():
+    registry = ClientRegistry()
+    registry.register(range(2))
+    registry.set_status(0, True)
+    registry.set_status(1, True)
+    assert registry.wait_idle(0, timeout=0.01) == 0
+    threading.Timer(0.05, registry.set_status, (1, False)).start()
+    assert registry.wait_idle(0, timeout=5) == 1
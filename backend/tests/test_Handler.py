@@ -0,0 +1,101 @@
+import threading
+
+import pytest
+
+pytest.importorskip("torch")
+
+from core.handlers.Handler import Handler, HandlerChain, Filter, TreeFilter
+
+
+class Record(Handler):
+    def __init__(self, name):
+        super().__init__()
+        self.name = name
+
+    def _handle(self, request):
+        request['log'].append(self.name)
+        return request
+
+
+class Gate(Filter):
+    def _handle(self, request):
+        request['log'].append('filter')
+        return request['pass']
+
+
+class Branch(TreeFilter):
+    def _handle(self, request):
+        request['log'].append('branch')
+        return request['child']
+
+
+def run(chain, **request):
+    return chain.handle({'log': [], **request})['log']
+
+
+def test_plain_chain_and_function_handlers():
+    chain = HandlerChain()
+    chain.set_chain(Record(1)).set_next(Record(2))
+    chain.add_handler_after(lambda r: (r['log'].append('fn'), r)[1], Record)
+    chain.add_handler(Record(3))
+    assert run(chain) == [1, 'fn', 2, 3]
+
+
+@pytest.mark.parametrize('passed', [True, False])
+def test_wrapped_filter_lets_the_chain_continue(passed):
+    chain = HandlerChain()
+    chain.set_chain(Record(1)).set_next(Record(2))
+    chain.add_handler_before(Gate(), Record)
+    assert run(chain, **{'pass': passed}) == ['filter', 1, 2]
+
+
+def test_linked_filter_jumps_to_the_end():
+    chain = HandlerChain()
+    gate = Gate()
+    chain.set_chain(Record(1)).set_next(gate).set_next(Record(2))
+    assert run(chain, **{'pass': True}) == [1, 'filter', 2]
+    assert run(chain, **{'pass': False}) == [1, 'filter']
+    # the filter does not relink itself
+    assert gate.next_handler is gate.real_next
+
+
+def test_tree_filter_runs_the_chosen_child():
+    branch = Branch()
+    branch.add_child(HandlerChain(Record('a')))
+    branch.add_child(Record('b'))
+    chain = HandlerChain()
+    chain.set_chain(Record(0)).set_next(branch).set_next(Record('never'))
+    assert run(chain, child=1) == [0, 'branch', 'b']
+    assert run(chain, child=0) == [0, 'branch', 'a']
+
+
+def test_only_edits_of_the_chain_recompile_it():
+    chain = HandlerChain()
+    chain.set_chain(Record(1))
+    other = HandlerChain()
+    other.set_chain(Record('x')).set_next(Record('y'))
+    assert run(chain) == [1]
+    program = chain._program
+    run(other)
+    assert chain._program is program
+    chain.add_handler(Record(2))
+    assert run(chain) == [1, 2]
+    chain.remove_handler(Record)
+    assert run(chain) == [2]
+
+
+def test_filter_in_threads():
+    chain = HandlerChain()
+    chain.set_chain(Gate()).set_next(Record(1))
+    results = {}
+
+    def worker(i):
+        results[i] = run(chain, **{'pass': i % 2 == 0})
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    for i, log in results.items():
+        assert log == (['filter', 1] if i % 2 == 0 else ['filter'])
@@ -0,0 +1,59 @@
+import pytest
+
+pytest.importorskip("torch")
+
+from update.StreamAggregator import StreamAggregator
+from update.UpdateCaller import UpdateCaller
+
+
+class Sum:
+    """A streaming update method which adds up the weights."""
+
+    def stream_init(self):
+        return {'weights': 0, 'data_sum': 0}
+
+    def stream_fold(self, acc, update):
+        acc['weights'] += update['weights']
+        acc['data_sum'] += update['data_sum']
+
+    @staticmethod
+    def stream_merge(acc, other):
+        for k, v in other.items():
+            acc[k] += v
+        return acc
+
+    def stream_finish(self, epoch, update_list, acc):
+        return {'w': acc['weights'] / acc['data_sum']}, None
+
+
+class Model:
+    def state_dict(self):
+        return {'w': 'global'}
+
+
+class Updater:
+    model = Model()
+
+
+def test_take_zero_updates_returns_the_zero_accumulator():
+    stream = StreamAggregator(Sum())
+    assert stream.take(0) == {'weights': 0, 'data_sum': 0}
+
+
+def test_take_merges_the_segments():
+    stream = StreamAggregator(Sum(), limit=2)
+    for i in range(4):
+        assert 'weights' not in stream.fold({'weights': i, 'data_sum': 1, 'client_id': i})
+    assert stream.take(2) == {'weights': 1, 'data_sum': 2}
+    assert stream.take(0) == {'weights': 0, 'data_sum': 0}
+    assert stream.take(2) == {'weights': 5, 'data_sum': 2}
+    with pytest.raises(RuntimeError):
+        stream.take(1)
+
+
+def test_round_without_updates_keeps_the_global_model():
+    method = Sum()
+    caller = UpdateCaller(Updater(), method)
+    acc = StreamAggregator(method).take(0)
+    assert caller.update_server_weights(1, [], acc) == ({'w': 'global'}, None)
+    assert caller.update_server_weights(1, [{'client_id': 0}], {'weights': 4, 'data_sum': 2}) == ({'w': 2}, None)